@@ -7,6 +7,13 @@ import xbox360_controller
 import time
 import math
 import argparse
+import struct
+
+# Binary drive frame version 1, see server/drive_frame.py: magic, version,
+# flags, seq, timestamp, throttle, direction, steering, pan, tilt
+DRIVE_FRAME = struct.Struct('<BBHIdBbBxhh')
+DRIVE_FRAME_MAGIC = 0xD5
+DRIVE_FRAME_CAM_RATE = 0x02
 
 class RaspPiController(xbox360_controller.Controller):
     def __init__(self, debug):
@@ -32,6 +39,36 @@ class RaspPiController(xbox360_controller.Controller):
         self.curr_speed = 0
         self.curr_angle = 0
 
+        # Camera pan/tilt: send the right stick as a rate (xy_rate=vx,vy in
+        # pulses per second) once per change, instead of a step per frame.
+        self.cam_rate_mode = True
+        self.cam_max_rate = 600
+        self.cam_deadzone = 0.2
+        self.curr_cam_rate = (0, 0)
+
+        # Send the driving state as one binary frame per tick when the
+        # server supports it (proto=bin1), instead of text commands.
+        self.use_drive_frames = True
+        self.drive_frames = False
+        self.frame_seq = 0
+        self.curr_frame = None
+
+        # Send the frames as UDP datagrams, one every tick, when the server
+        # offers a drive port: a lost one is replaced by the next instead
+        # of holding up the stream. Other commands stay on TCP.
+        self.use_udp = True
+        self.udpSock = None
+        self.udp_addr = None
+
+        # The server closes connections that stay silent for a minute, so
+        # send an empty line after this many seconds without a TCP write.
+        self.keepalive = 10.0
+        self.last_sent = 0
+
+        # Token the server issued with driving. Presenting it after a
+        # reconnect takes driving back from our own dead connection.
+        self.driver_token = None
+
         self.host_ip = dweepy.get_latest_dweet_for('hsharma35-rpi3')[0]['content']['ip']
 
         super(RaspPiController, self).__init__(0)
@@ -47,17 +84,92 @@ class RaspPiController(xbox360_controller.Controller):
             tcpCliSock.connect(ADDR)                    # Connect with the server
             self.tcpCliSock = tcpCliSock
             print('Connected to rpi')
-            tcpCliSock.send('xy_home')
+            if not self.claim_driver():
+                print('Another client is driving, watching only')
+            self.send_commands(['xy_home'])
+            if self.use_drive_frames:
+                self.drive_frames = self.negotiate_drive_frames()
+            if self.drive_frames and self.use_udp:
+                self.udp_addr = self.negotiate_udp()
+                if self.udp_addr is not None:
+                    self.udpSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             return True
         except socket.error:
             # print('Can\'t connect to rpi')
             return False
 
+    def send_commands(self, commands):
+        '''Send the commands in one write, each ended by a newline so the
+        server can split them however TCP delivers them'''
+        if commands:
+            self.tcpCliSock.send(''.join(command + '\n' for command in commands))
+            self.last_sent = time.time()
+
+    def claim_driver(self):
+        '''Ask to drive, with our token from the last connection if any.
+        True if the server made us the driver (or does not know roles).'''
+        command = 'role=driver'
+        if self.driver_token is not None:
+            command += ' ' + self.driver_token
+        self.send_commands([command])
+        self.tcpCliSock.settimeout(1.0)
+        try:
+            reply = self.tcpCliSock.recv(1024).split()
+        except socket.timeout:
+            return True
+        finally:
+            self.tcpCliSock.settimeout(None)
+        if reply[:3] != ['ok', 'role', 'driver']:
+            return False
+        if len(reply) > 3:
+            self.driver_token = reply[3]
+        return True
+
+    def negotiate_drive_frames(self):
+        '''Ask the server for binary drive frames, True if it agreed'''
+        self.send_commands(['proto=bin1'])
+        self.tcpCliSock.settimeout(1.0)
+        try:
+            return self.tcpCliSock.recv(1024).strip() == 'ok bin1'
+        except socket.timeout:
+            return False
+        finally:
+            self.tcpCliSock.settimeout(None)
+
+    def negotiate_udp(self):
+        '''The server's UDP drive address, None if it has none'''
+        self.send_commands(['udp'])
+        self.tcpCliSock.settimeout(1.0)
+        try:
+            reply = self.tcpCliSock.recv(1024).split()
+        except socket.timeout:
+            return None
+        finally:
+            self.tcpCliSock.settimeout(None)
+        if len(reply) != 2 or reply[0] != 'udp' or not reply[1].isdigit():
+            return None
+        return (self.host_ip, int(reply[1]))
+
+    def drive_frame(self, repeat=False):
+        '''The packed frame of the current stick state, or None if it has
+        not changed since the last one (and not repeat)'''
+        speed, angle, fwd = self.get_car_motion()
+        direction = 0 if speed == 0 else (1 if fwd else -1)
+        pan, tilt = self.get_cam_rate() if self.cam_rate_mode else (0, 0)
+        flags = DRIVE_FRAME_CAM_RATE if self.cam_rate_mode else 0
+        state = (min(speed, 100), direction, angle, pan, tilt, flags)
+        if state == self.curr_frame and not repeat:
+            return None
+        self.curr_frame = state
+        self.frame_seq = (self.frame_seq + 1) & 0xFFFFFFFF
+        return DRIVE_FRAME.pack(DRIVE_FRAME_MAGIC, 1, flags, self.frame_seq, time.time(),
+                                min(speed, 100), direction, angle, pan, tilt)
+
     def set_speed(self):
         tmp = 'speed'
         spd = self.speed_multiplier
         data = tmp + str(spd)  # Change the integers into strings and combine them with the string 'speed'. 
-        self.tcpCliSock.send(data)
+        self.send_commands([data])
 
     def get_car_motion(self):
         move_lr, _ = self.get_left_stick()
@@ -74,37 +186,90 @@ class RaspPiController(xbox360_controller.Controller):
 
         return speed, angle, fwd
 
-    def send_car_motion(self):
+    def car_motion_commands(self):
+        commands = []
         speed, angle, fwd = self.get_car_motion()
         if self.curr_fwd != fwd or self.curr_speed != speed:
             self.curr_speed = speed
             self.curr_fwd = fwd
             if fwd:
-                self.tcpCliSock.send('forward={}'.format(speed))
+                commands.append('forward={}'.format(speed))
             else:
-                self.tcpCliSock.send('backward={}'.format(speed))
+                commands.append('backward={}'.format(speed))
         if self.curr_angle != angle:
             self.curr_angle = angle
-            self.tcpCliSock.send('turn={}'.format(angle))
+            commands.append('turn={}'.format(angle))
+        return commands
 
-    def send_cam_motion(self):
+    def send_car_motion(self):
+        self.send_commands(self.car_motion_commands())
+
+    def get_cam_rate(self):
+        pan_lr, tilt_ud = self.get_right_stick()
+        rates = []
+        for value in (-pan_lr, -tilt_ud):
+            if abs(value) < self.cam_deadzone:
+                value = 0
+            # quantize to 10% steps so stick noise does not resend
+            rates.append(int(round(value * 10)) * self.cam_max_rate // 10)
+        return tuple(rates)
+
+    def cam_motion_commands(self):
+        commands = []
+        if self.cam_rate_mode:
+            rate = self.get_cam_rate()
+            if rate != self.curr_cam_rate:
+                self.curr_cam_rate = rate
+                commands.append('xy_rate={},{}'.format(*rate))
+            return commands
         pan_lr, tilt_ud = self.get_right_stick()
         if tilt_ud < -0.5:
-            self.tcpCliSock.send('y+')
+            commands.append('y+')
         elif tilt_ud > 0.5:
-            self.tcpCliSock.send('y-')
+            commands.append('y-')
 
         if pan_lr > 0.5:
-            self.tcpCliSock.send('x+')
+            commands.append('x+')
         elif pan_lr < -0.5:
-            self.tcpCliSock.send('x-')
+            commands.append('x-')
+        return commands
+
+    def send_cam_motion(self):
+        self.send_commands(self.cam_motion_commands())
+
+    def upload_program(self, program):
+        '''Upload a motion program (see server/motion.py) to run on the car.
+        Returns the server reply, "program ok <steps>" or "program error ...".'''
+        self.send_commands(['program=' + program])
+        return self.tcpCliSock.recv(1024).strip()
+
+    def run_program(self):
+        self.send_commands(['program_run'])
+
+    def abort_program(self):
+        self.send_commands(['abort'])
 
     def send_buttons(self):
+        '''Send everything that changed this tick in one write'''
         if self.tcpCliSock is None:
             return
-        self.send_car_motion()
-        self.send_cam_motion()
+        if time.time() - self.last_sent > self.keepalive:
+            self.send_commands([''])
+        if self.drive_frames:
+            steps = [] if self.cam_rate_mode else self.cam_motion_commands()
+            if self.udpSock is not None:
+                self.udpSock.sendto(self.drive_frame(repeat=True), self.udp_addr)
+                self.send_commands(steps)
+                return
+            frame = self.drive_frame() or ''
+            if frame or steps:
+                self.tcpCliSock.send(frame + ''.join(command + '\n' for command in steps))
+                self.last_sent = time.time()
+            return
+        self.send_commands(self.car_motion_commands() + self.cam_motion_commands())
 
     def __del__(self):
         if self.tcpCliSock is not None:
             self.tcpCliSock.close()
+        if self.udpSock is not None:
+            self.udpSock.close()
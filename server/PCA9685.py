@@ -11,7 +11,11 @@
 **********************************************************************
 '''
 
-import smbus
+import hw_backend
+import i2c_stats
+import pi_board
+import os
+import threading
 import time
 import math
 
@@ -32,160 +36,208 @@ class PWM(object):
     _ALL_LED_OFF_L      = 0xFC
     _ALL_LED_OFF_H      = 0xFD
 
+    _CHANNELS           = 16
+    _ALLCALL_ADDRESS    = 0x70  # ALLCALLADR power-on value (0xE0 >> 1)
+    _MAX_BLOCK          = 32    # SMBus block transfer limit, in bytes
+
     _RESTART            = 0x80
+    _AI                 = 0x20
     _SLEEP              = 0x10
     _ALLCALL            = 0x01
     _INVRT              = 0x10
     _OUTDRV             = 0x04
 
-    RPI_REVISION_0 = ["900092"]
-    RPI_REVISION_1_MODULE_B = ["Beta", "0002", "0003", "0004", "0005", "0006", "000d", "000e", "000f"]
-    RPI_REVISION_1_MODULE_A = ["0007", "0008", "0009",]
-    RPI_REVISION_1_MODULE_BP = ["0010", "0013"]
-    RPI_REVISION_1_MODULE_AP = ["0012"]
-    RPI_REVISION_2_MODULE_B  = ["a01041", "a21041"]
-    RPI_REVISION_3_MODULE_B  = ["a02082", "a22082"]
-    RPI_REVISION_3_MODULE_BP = ["a020d3"]
-
     _DEBUG = False
     _DEBUG_INFO = 'DEBUG "PCA9685.py":'
 
+    retries = 2         # Extra attempts for a failed transaction before giving up
+    stats = None        # i2c_stats.BusStats while enable_stats() is in effect
+
     def _get_bus_number(self):
-        pi_revision = self._get_pi_revision()
-        if   pi_revision == '0':
-            return 0
-        elif pi_revision == '1 Module B':
-            return 0
-        elif pi_revision == '1 Module A':
-            return 0
-        elif pi_revision == '1 Module B+':
-            return 1
-        elif pi_revision == '1 Module A+':
-            return 0
-        elif pi_revision == '2 Module B':
-            return 1
-        elif pi_revision == '3 Module B':
-            return 1
-        elif pi_revision == '3 Module B+':
-            return 1
+        return pi_board.get_bus_number()
 
     def _get_pi_revision(self):
         "Gets the version number of the Raspberry Pi board"
-        # Courtesy quick2wire-python-api
-        # https://github.com/quick2wire/quick2wire-python-api
-        # Updated revision info from: http://elinux.org/RPi_HardwareHistory#Board_Revision_History
-        try:
-            f = open('/proc/cpuinfo','r')
-            for line in f:
-                if line.startswith('Revision'):
-                    if line[11:-1] in self.RPI_REVISION_0:
-                        return '0'
-                    elif line[11:-1] in self.RPI_REVISION_1_MODULE_B:
-                        return '1 Module B'
-                    elif line[11:-1] in self.RPI_REVISION_1_MODULE_A:
-                        return '1 Module A'
-                    elif line[11:-1] in self.RPI_REVISION_1_MODULE_BP:
-                        return '1 Module B+'
-                    elif line[11:-1] in self.RPI_REVISION_1_MODULE_AP:
-                        return '1 Module A+'
-                    elif line[11:-1] in self.RPI_REVISION_2_MODULE_B:
-                        return '2 Module B'
-                    elif line[11:-1] in self.RPI_REVISION_3_MODULE_B:
-                        return '3 Module B'
-                    elif line[11:-1] in self.RPI_REVISION_3_MODULE_BP:
-                        return '3 Module B+'
-                    else:
-                        print "Error. Pi revision didn't recognize, module number: %s" % line[11:-1]
-                        print 'Exiting...'
-                        quit()
-        except Exception, e:
-            f.close()
-            print e
-            print 'Exiting...'
-            quit()
-        finally:
-            f.close()
+        return pi_board.pi_revision()
+
+    def __init__(self, bus_number=None, address=0x40, auto_increment=True, cache=True, bus=None):
+        '''Init the class with bus_number and address
+
+        bus is an SMBus-like object to use instead of the one picked by
+        hw_backend (real smbus, or the simulator when PCA9685_BUS=sim).
 
-    def __init__(self, bus_number=None, address=0x40):
-        '''Init the class with bus_number and address'''
+        With auto_increment on, MODE1 AI is set and the four LEDn registers
+        of a channel are pushed in one I2C block transaction. Set it to
+        False to fall back to one byte transaction per register.
+
+        With cache on, the last value written to every channel and to
+        MODE1/MODE2/PRESCALE is kept and writes that would not change the
+        register are skipped. See flush() and invalidate(). On a bus shared
+        through actuatord (one with registers()) other processes write the
+        same channels, so channel values are never cached there; the daemon
+        skips the repeats itself.
+        '''
         if self._DEBUG:
             print self._DEBUG_INFO, "Debug on"
         self.address = address
-        if bus_number == None:
+        if bus_number != None:
+            self.bus_number = bus_number
+        elif bus is not None or hw_backend.simulated():
+            self.bus_number = 1
+        else:
             self.bus_number = self._get_bus_number()
+        if bus is None:
+            bus = hw_backend.open_i2c(self.bus_number, address)
+        self.bus = bus
+        self._auto_increment = auto_increment
+        self.cache = cache                  # channel values
+        self._cache_registers = cache       # MODE1, MODE2, PRESCALE
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._channel_shadow = {}
+        self._register_shadow = {}
+        self._lock = threading.RLock()
+        self._writer = None
+        self._mailbox = {}
+        self._mailbox_cond = threading.Condition()
+        self._writer_busy = False
+        self.writer_error = None    # what stopped the writer thread, see start_async()
+        self._frequency = None
+        registers = getattr(bus, 'registers', None)
+        if registers is not None:
+            # actuatord has set the chip up already, adopt its registers
+            # instead of resetting the outputs of the other clients
+            self._register_shadow.update(registers(address))
+            self.cache = False
+            self.auto_increment = auto_increment
         else:
-            self.bus_number = bus_number
-        self.bus = smbus.SMBus(self.bus_number)
-        if self._DEBUG:
-            print self._DEBUG_INFO, 'Reseting PCA9685 MODE1 (without SLEEP) and MODE2'
-        self.write_all_value(0, 0)
-        self._write_byte_data(self._MODE2, self._OUTDRV)
-        self._write_byte_data(self._MODE1, self._ALLCALL)
-        time.sleep(0.005)
+            if self._DEBUG:
+                print self._DEBUG_INFO, 'Reseting PCA9685 MODE1 (without SLEEP) and MODE2'
+            self._write_register(self._MODE2, self._OUTDRV)
+            if auto_increment:
+                self._write_register(self._MODE1, self._ALLCALL | self._AI)
+            else:
+                self._write_register(self._MODE1, self._ALLCALL)
+            self.write_all_value(0, 0)
+            time.sleep(0.005)
 
-        mode1 = self._read_byte_data(self._MODE1)
-        mode1 = mode1 & ~self._SLEEP
-        self._write_byte_data(self._MODE1, mode1)
-        time.sleep(0.005)
+            mode1 = self._read_register(self._MODE1)
+            mode1 = mode1 & ~self._SLEEP
+            self._write_register(self._MODE1, mode1)
+            time.sleep(0.005)
         self.frequency = 60
 
-    def _write_byte_data(self, reg, value):
+    def _write_byte_data(self, reg, value, address=None):
         '''Write data to I2C with self.address'''
         if self._DEBUG:
             print self._DEBUG_INFO, 'Writing value %2X to %2X' % (value, reg)
-        try:
-            self.bus.write_byte_data(self.address, reg, value)
-        except Exception, i:
-            print i
-            self._check_i2c()
+        self._transfer(address, self.bus.write_byte_data, reg, 3, 1, True, value)
+
+    def _write_i2c_block_data(self, reg, values, address=None):
+        '''Write a list of bytes starting at reg in one I2C transaction.
+        Needs MODE1 AI set, otherwise every byte lands on reg.'''
+        if self._DEBUG:
+            print self._DEBUG_INFO, 'Writing block %s to %2X' % (' '.join('%02X' % v for v in values), reg)
+        self._transfer(address, self.bus.write_i2c_block_data, reg, 2+len(values), len(values), True, values)
 
     def _read_byte_data(self, reg):
         '''Read data from I2C with self.address'''
         if self._DEBUG:
             print self._DEBUG_INFO, 'Reading value from %2X' % reg
-        try:
-            results = self.bus.read_byte_data(self.address, reg)
-            return results
-        except Exception, i:
-            print i
-            self._check_i2c()
+        return self._transfer(None, self.bus.read_byte_data, reg, 4, 1, False)
+
+    def _transfer(self, address, method, reg, nbytes, data_bytes, write, *args):
+        '''Run one bus transaction, retrying it up to self.retries times.
+        address defaults to self.address. nbytes (bytes on the wire) and
+        data_bytes (registers touched) are only used for the statistics.'''
+        if address is None:
+            address = self.address
+        stats = self.stats
+        for attempt in range(self.retries + 1):
+            try:
+                if stats is None:
+                    return method(address, reg, *args)
+                start = time.time()
+                result = method(address, reg, *args)
+                stats.record(reg, nbytes, time.time() - start, data_bytes, write)
+                return result
+            except Exception, i:
+                print i
+                if stats is not None:
+                    stats.error(reg, attempt < self.retries)
+        self.invalidate()
+        self._check_i2c()
+
+    def enable_stats(self):
+        '''Start counting transactions, latency and errors in self.stats'''
+        if self.stats is None:
+            self.stats = i2c_stats.BusStats()
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    @property
+    def lock(self):
+        '''Re-entrant lock held around every bus access. Hold it to make
+        several calls reach the chip without another thread in between.'''
+        return self._lock
+
+    def _write_register(self, reg, value):
+        '''Write a MODE1/MODE2/PRESCALE register unless the shadow
+        already holds value'''
+        if self._cache_registers and self._register_shadow.get(reg) == value:
+            self.cache_hits += 1
+            return
+        self.cache_misses += 1
+        self._register_shadow[reg] = value
+        self._write_byte_data(reg, value)
+
+    def _read_register(self, reg):
+        '''Read a MODE1/MODE2/PRESCALE register, from the shadow if known'''
+        if self._cache_registers and reg in self._register_shadow:
+            return self._register_shadow[reg]
+        value = self._read_byte_data(reg)
+        self._register_shadow[reg] = value
+        return value
+
+    def invalidate(self):
+        '''Forget every shadowed value, the next write of each register
+        goes to the bus. Use it when the chip may have been reset behind
+        our back.'''
+        with self._lock:
+            self._channel_shadow = {}
+            self._register_shadow = {}
+
+    def flush(self):
+        '''Write every shadowed value back to the chip, e.g. after a
+        brown-out reset of the PCA9685'''
+        with self._lock:
+            registers = self._register_shadow
+            channels = self._channel_shadow
+            self.invalidate()
+            if self._MODE2 in registers:
+                self._write_register(self._MODE2, registers[self._MODE2])
+            if self._MODE1 in registers:
+                self._write_register(self._MODE1, registers[self._MODE1])
+            if self._PRESCALE in registers:
+                self._write_prescale(registers[self._PRESCALE])
+            self._write_channels(channels)
 
     def _check_i2c(self):
-        import commands
-        bus_number = self._get_bus_number()
         print "\nYour Pi Rivision is: %s" % self._get_pi_revision()
-        print "I2C bus number is: %s" % bus_number
+        print "I2C bus number is: %s" % self.bus_number
         print "Checking I2C device:"
-        cmd = "ls /dev/i2c-%d" % bus_number
-        output = commands.getoutput(cmd)
-        print 'Commands "%s" output:' % cmd
-        print output
-        if '/dev/i2c-%d' % bus_number in output.split(' '):
+        if os.path.exists('/dev/i2c-%d' % self.bus_number):
             print "I2C device setup OK"
         else:
             print "Seems like I2C has not been set. Use 'sudo raspi-config' to set I2C"
-        cmd = "i2cdetect -y %s" % self.bus_number
-        output = commands.getoutput(cmd)
+            print "I2C buses found: %s" % (pi_board.i2c_buses() or "None")
         print "Your PCA9685 address is set to 0x%02X" % self.address
-        print "i2cdetect output:"
-        print output
-        outputs = output.split('\n')[1:]
-        addresses = []
-        for tmp_addresses in outputs:
-            tmp_addresses = tmp_addresses.split(':')[1]
-            tmp_addresses = tmp_addresses.strip().split(' ')
-            for address in tmp_addresses:
-                if address != '--':
-                    addresses.append(address)
-        print "Conneceted i2c device:"
-        if addresses == []:
-            print "None"
-        else:
-            for address in addresses:
-                print "  0x%s" % address
-        if "%02X" % self.address in addresses:
+        try:
+            self.bus.read_byte_data(self.address, self._MODE1)
             print "Wierd, I2C device is connected. Try to run the program again. If the problem's still, email the error message to service@sunfounder.com"
-        else:
+        except Exception:
             print "Device is missing."
             print "Check the address or wiring of PCA9685 servo driver, or email the error message to service@sunfounder.com"
             print 'Exiting...'
@@ -193,13 +245,15 @@ class PWM(object):
 
     @property
     def frequency(self):
-        return _frequency
+        return self._frequency
 
     @frequency.setter
     def frequency(self, freq):
         '''Set PWM frequency'''
         if self._DEBUG:
             print self._DEBUG_INFO, 'Set frequency to %d' % freq
+        if freq == self._frequency:
+            return
         self._frequency = freq
         prescale_value = 25000000.0
         prescale_value /= 4096.0
@@ -211,32 +265,285 @@ class PWM(object):
         prescale = math.floor(prescale_value + 0.5)
         if self._DEBUG:
             print self._DEBUG_INFO, 'Final pre-scale: %d' % prescale
+        with self._lock:
+            self._write_prescale(int(math.floor(prescale)))
 
-        old_mode = self._read_byte_data(self._MODE1);
+    def _write_prescale(self, prescale):
+        '''PRESCALE can only be written in SLEEP mode, so this puts the
+        oscillator to sleep, writes it and restarts. Skipped if unchanged.'''
+        if self._cache_registers and self._register_shadow.get(self._PRESCALE) == prescale:
+            self.cache_hits += 1
+            return
+        self.cache_misses += 1
+        old_mode = self._read_register(self._MODE1) & ~self._RESTART
         new_mode = (old_mode & 0x7F) | 0x10
         self._write_byte_data(self._MODE1, new_mode)
-        self._write_byte_data(self._PRESCALE, int(math.floor(prescale)))
+        self._write_byte_data(self._PRESCALE, prescale)
         self._write_byte_data(self._MODE1, old_mode)
         time.sleep(0.005)
         self._write_byte_data(self._MODE1, old_mode | 0x80)
+        self._register_shadow[self._MODE1] = old_mode
+        self._register_shadow[self._PRESCALE] = prescale
+
+    def _write_led_registers(self, reg, on, off, address=None):
+        '''Write ON_L, ON_H, OFF_L and OFF_H starting at reg'''
+        if self._auto_increment:
+            self._write_i2c_block_data(reg, [on & 0xFF, on >> 8, off & 0xFF, off >> 8], address)
+        else:
+            self._write_byte_data(reg, on & 0xFF, address)
+            self._write_byte_data(reg+1, on >> 8, address)
+            self._write_byte_data(reg+2, off & 0xFF, address)
+            self._write_byte_data(reg+3, off >> 8, address)
+
+    @property
+    def auto_increment(self):
+        return self._auto_increment
+
+    @auto_increment.setter
+    def auto_increment(self, auto_increment):
+        '''Switch between block writes (MODE1 AI on) and byte writes'''
+        if auto_increment not in (True, False):
+            raise ValueError('auto_increment must be "True" or "False", not "{0}"'.format(auto_increment))
+        mode1 = self._read_register(self._MODE1)
+        if auto_increment:
+            mode1 = mode1 | self._AI
+        else:
+            mode1 = mode1 & ~self._AI
+        with self._lock:
+            self._write_register(self._MODE1, mode1 & ~self._RESTART)
+            self._auto_increment = auto_increment
 
     def write(self, channel, on, off):
         '''Set on and off value on specific channel'''
         if self._DEBUG:
             print self._DEBUG_INFO, 'Set channel "%d" to value "%d"' % (channel, off)
-        self._write_byte_data(self._LED0_ON_L+4*channel, on & 0xFF)
-        self._write_byte_data(self._LED0_ON_H+4*channel, on >> 8)
-        self._write_byte_data(self._LED0_OFF_L+4*channel, off & 0xFF)
-        self._write_byte_data(self._LED0_OFF_H+4*channel, off >> 8)
+        if self._post({channel: (on, off)}):
+            return
+        with self._lock:
+            self._write_channels(self._unsent({channel: (on, off)}))
+
+    def write_many(self, values):
+        '''Set on and off value on several channels, values is a dict of
+        {channel: (on, off)}. Runs of adjacent channels go out as one block
+        write each (up to 8 channels per transaction).'''
+        if self._DEBUG:
+            print self._DEBUG_INFO, 'Set channels %s' % sorted(values.items())
+        if self._post(values):
+            return
+        with self._lock:
+            self._write_channels(self._unsent(values))
+
+    def _write_channels(self, values):
+        channels = []
+        for channel in sorted(values):
+            value = tuple(values[channel])
+            if self.cache and self._channel_shadow.get(channel) == value:
+                self.cache_hits += 1
+                continue
+            self.cache_misses += 1
+            self._channel_shadow[channel] = value
+            channels.append(channel)
+        self._write_blocks(channels, values)
+
+    def _write_blocks(self, channels, values, address=None):
+        '''Write values of the sorted channels, one block per run of
+        adjacent channels'''
+        if not self._auto_increment:
+            for channel in channels:
+                on, off = values[channel]
+                self._write_led_registers(self._LED0_ON_L+4*channel, on, off, address)
+            return
+        per_block = self._MAX_BLOCK / 4
+        start = 0
+        while start < len(channels):
+            end = start + 1
+            while (end < len(channels) and end - start < per_block
+                   and channels[end] == channels[end-1] + 1):
+                end += 1
+            block = []
+            for channel in channels[start:end]:
+                on, off = values[channel]
+                block += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+            self._write_i2c_block_data(self._LED0_ON_L+4*channels[start], block, address)
+            start = end
 
     def write_all_value(self, on, off):
         '''Set on and off value on all channel'''
         if self._DEBUG:
             print self._DEBUG_INFO, 'Set all channel to value "%d"' % (off)
-        self._write_byte_data(self._ALL_LED_ON_L, on & 0xFF)
-        self._write_byte_data(self._ALL_LED_ON_H, on >> 8)
-        self._write_byte_data(self._ALL_LED_OFF_L, off & 0xFF)
-        self._write_byte_data(self._ALL_LED_OFF_H, off >> 8)
+        if self._post(dict.fromkeys(range(self._CHANNELS), (on, off))):
+            return
+        with self._lock:
+            self._unsent({})        # every channel is overwritten anyway
+            if self.cache and all(self._channel_shadow.get(channel) == (on, off)
+                                  for channel in range(self._CHANNELS)):
+                self.cache_hits += 1
+                return
+            self.cache_misses += 1
+            for channel in range(self._CHANNELS):
+                self._channel_shadow[channel] = (on, off)
+            self._write_led_registers(self._ALL_LED_ON_L, on, off)
+
+    def play(self, channels, samples, rate_hz, on=0):
+        '''Play a sequence of off values at rate_hz.
+
+        channels is a channel number or a list of them. samples is a
+        sequence (or NumPy array) with one value per step; for several
+        channels each step is either one value for all of them or a row
+        with one value per channel. Steps are due at start + i/rate_hz,
+        so a late step does not delay the following ones. Every step is
+        one write_many() call.
+
+        Returns a dict with the achieved rate and the timing error of the
+        writes against their schedule, in seconds.
+        '''
+        if hasattr(samples, 'tolist'):
+            samples = samples.tolist()
+        if isinstance(channels, (list, tuple)):
+            channels = list(channels)
+        else:
+            channels = [channels]
+        period = 1.0 / rate_hz
+        errors = []
+        late = 0
+        first = last = None
+        start = time.time()
+        for i, sample in enumerate(samples):
+            due = start + i * period
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if isinstance(sample, (list, tuple)):
+                values = dict((channel, (on, int(value))) for channel, value in zip(channels, sample))
+            else:
+                values = dict.fromkeys(channels, (on, int(sample)))
+            self.write_many(values)
+            last = time.time()
+            if first is None:
+                first = last
+            error = last - due
+            errors.append(error)
+            if error > period:
+                late += 1
+        elapsed = time.time() - start
+        if not errors:
+            return {'samples': 0, 'elapsed': 0.0, 'rate': 0.0, 'mean_error': 0.0, 'max_error': 0.0, 'late': 0}
+        return {
+            'samples': len(errors),
+            'elapsed': elapsed,
+            'rate': (len(errors) - 1) / (last - first) if last > first else 0.0,
+            'mean_error': sum(errors) / len(errors),
+            'max_error': max(errors),
+            'late': late,
+        }
+
+    def start_async(self):
+        '''Hand channel writes to a background thread.
+
+        write(), write_many() and write_all_value() then only drop the
+        values in a per-channel mailbox and return. A newer value for a
+        channel replaces one that has not been sent yet, so the bus only
+        ever sees the latest setpoint. The writer sends whatever is in
+        the mailbox as one write_many() batch.
+
+        If a batch fails for good (see _check_i2c()), the writer puts it
+        back in the mailbox, keeps the exception in writer_error and
+        stops. Writes are then synchronous again and the next one, or
+        sync(), sends what was left over.
+        '''
+        if self._writer is not None:
+            return
+        self._writer_stop = False
+        self.writer_error = None
+        self._writer = threading.Thread(target=self._async_loop, name='PCA9685-writer-0x%02X' % self.address)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def stop_async(self):
+        '''Send what is still in the mailbox and go back to synchronous writes'''
+        writer = self._writer
+        if writer is None:
+            return
+        with self._mailbox_cond:
+            self._writer_stop = True
+            self._mailbox_cond.notify()
+        writer.join()       # the writer clears self._writer itself, see _async_loop()
+
+    def sync(self, timeout=None):
+        '''Wait until the writer thread has sent everything posted so far,
+        or send it here if the writer has stopped. Returns False on
+        timeout.'''
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._mailbox_cond:
+            while self._writer is not None and (self._mailbox or self._writer_busy):
+                if timeout is None:
+                    self._mailbox_cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._mailbox_cond.wait(remaining)
+        if self._writer is None and self._mailbox:
+            with self._lock:
+                self._write_channels(self._unsent({}))
+        return True
+
+    def _post(self, values):
+        '''Hand values to the writer thread. Returns False if there is
+        none (any more), the caller then writes them itself.'''
+        with self._mailbox_cond:
+            if self._writer is None:
+                return False
+            for channel, value in values.items():
+                self._mailbox[channel] = tuple(value)
+            self._mailbox_cond.notify_all()
+            return True
+
+    def _unsent(self, values):
+        '''values on top of whatever a stopped writer left in the mailbox,
+        which is emptied'''
+        with self._mailbox_cond:
+            if not self._mailbox:
+                return values
+            unsent = self._mailbox
+            self._mailbox = {}
+        unsent.update(values)
+        return unsent
+
+    def _async_loop(self):
+        while True:
+            with self._mailbox_cond:
+                while not self._mailbox and not self._writer_stop:
+                    self._mailbox_cond.wait()
+                if not self._mailbox:
+                    # Cleared under the condition, so a later _post() writes
+                    # synchronously instead of leaving values behind
+                    self._writer = None
+                    self._mailbox_cond.notify_all()
+                    return
+                pending = self._mailbox
+                self._mailbox = {}
+                self._writer_busy = True
+            error = None
+            try:
+                with self._lock:
+                    self._write_channels(pending)
+            except BaseException, error:
+                # _check_i2c() quit()s, which would only end this thread
+                # and leave every later post in a mailbox nobody reads
+                pass
+            with self._mailbox_cond:
+                self._writer_busy = False
+                if error is not None:
+                    pending.update(self._mailbox)
+                    self._mailbox = pending
+                    self.writer_error = error
+                    self._writer = None
+                self._mailbox_cond.notify_all()
+            if error is not None:
+                print 'PCA9685 0x%02X: writer thread stopped (%r), writing synchronously' % (self.address, error)
+                return
 
     def map(self, x, in_min, in_max, out_min, out_max):
         '''To map the value from arange to another'''
@@ -259,6 +566,130 @@ class PWM(object):
         else:
             print self._DEBUG_INFO, "Set debug off"
 
+_devices = {}
+_devices_lock = threading.Lock()
+
+def get_pwm(bus_number=None, address=0x40):
+    '''Return the process-wide PWM for (bus_number, address).
+
+    The chip is reset and programmed only by the first call, later
+    callers share the same object and its lock. init_time on the
+    returned PWM is how long that first construction took, in seconds.
+    '''
+    with _devices_lock:
+        pwm = _devices.get((bus_number, address))
+        if pwm is None:
+            start = time.time()
+            pwm = PWM(bus_number=bus_number, address=address)
+            pwm.init_time = time.time() - start
+            _devices[(bus_number, address)] = pwm
+            _devices[(pwm.bus_number, address)] = pwm
+        return pwm
+
+def devices():
+    '''Return the distinct PWM objects handed out by get_pwm()'''
+    with _devices_lock:
+        return list(set(_devices.values()))
+
+class PWMGroup(object):
+    '''Several PCA9685 boards on one bus behind logical channel numbers.
+
+    channel_map maps a logical channel to (address, channel). By default
+    logical channel 16*i + n is channel n of the i-th board in addresses.
+    write_many() splits a frame per board and commits the boards back to
+    back while holding all their locks. With allcall=True, channels that
+    get the same value on every board, and write_all_value(), go out once
+    to the ALLCALL address instead of once per board. It is off by
+    default: only turn it on when every PCA9685 answering ALLCALL on the
+    bus belongs to the group, or the others get the values too.
+    '''
+
+    def __init__(self, addresses=(0x40,), bus_number=None, channel_map=None, allcall=False):
+        self.boards = [get_pwm(bus_number, address) for address in addresses]
+        self._by_address = dict((board.address, board) for board in self.boards)
+        if channel_map is None:
+            channel_map = {}
+            for i, address in enumerate(addresses):
+                for channel in range(PWM._CHANNELS):
+                    channel_map[PWM._CHANNELS*i + channel] = (address, channel)
+        self.channel_map = dict(channel_map)
+        self.allcall = (allcall and len(self.boards) > 1
+                        and len(set(board.bus_number for board in self.boards)) == 1)
+
+    def write(self, channel, on, off):
+        '''Set on and off value on a logical channel'''
+        self.write_many({channel: (on, off)})
+
+    def write_many(self, values):
+        '''Set on and off value on several logical channels at once'''
+        frames = {}
+        for logical, value in values.items():
+            address, channel = self.channel_map[logical]
+            frames.setdefault(address, {})[channel] = tuple(value)
+        boards = [self._by_address[address] for address in sorted(frames)]
+        if any(board._writer is not None for board in boards):
+            for board in boards:
+                board.write_many(frames[board.address])
+            return
+        self._lock(boards)
+        try:
+            if self.allcall and len(boards) == len(self.boards):
+                self._broadcast_common(frames)
+            for board in boards:
+                board._write_channels(frames[board.address])
+        finally:
+            self._unlock(boards)
+
+    def write_all_value(self, on, off):
+        '''Set on and off value on every channel of every board'''
+        if not self.allcall or any(board._writer is not None for board in self.boards):
+            for board in self.boards:
+                board.write_all_value(on, off)
+            return
+        self._lock(self.boards)
+        try:
+            lead = self.boards[0]
+            lead._write_led_registers(PWM._ALL_LED_ON_L, on, off, PWM._ALLCALL_ADDRESS)
+            for board in self.boards:
+                for channel in range(PWM._CHANNELS):
+                    board._channel_shadow[channel] = (on, off)
+        finally:
+            self._unlock(self.boards)
+
+    def _broadcast_common(self, frames):
+        '''Send the channels that have the same value on every board to
+        the ALLCALL address and drop them from the per-board frames'''
+        first = frames[self.boards[0].address]
+        common = {}
+        for channel, value in first.items():
+            if not all(frames[board.address].get(channel) == value for board in self.boards):
+                continue
+            if all(board.cache and board._channel_shadow.get(channel) == value for board in self.boards):
+                continue
+            common[channel] = value
+        if not common:
+            return
+        for board in self.boards:
+            for channel, value in common.items():
+                board._channel_shadow[channel] = value
+                board.cache_misses += 1
+                del frames[board.address][channel]
+        self.boards[0]._write_blocks(sorted(common), common, PWM._ALLCALL_ADDRESS)
+
+    @staticmethod
+    def _ordered(boards):
+        '''boards in the one order every group takes their locks in, so
+        groups sharing boards cannot deadlock'''
+        return sorted(boards, key=lambda board: (board.bus_number, board.address))
+
+    def _lock(self, boards):
+        for board in self._ordered(boards):
+            board.lock.acquire()
+
+    def _unlock(self, boards):
+        for board in reversed(self._ordered(boards)):
+            board.lock.release()
+
 if __name__ == '__main__':
     import time
 
@@ -268,7 +699,5 @@ if __name__ == '__main__':
         time.sleep(0.5)
         print '\nChannel %d\n' % i
         time.sleep(0.5)
-        for j in range(4096):
-            pwm.write(i, 0, j)
-            print 'PWM value: %d' % j
-            time.sleep(0.0003)
+        report = pwm.play(i, range(4096), 3000)
+        print 'Played %(samples)d values at %(rate).0f Hz, timing error mean %(mean_error).6f s, max %(max_error).6f s' % report
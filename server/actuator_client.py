@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+'''
+Client side of actuatord, the daemon that owns the PCA9685 and GPIO.
+
+With the "daemon" backend (or "auto" while actuatord is running, see
+hw_backend.py) PCA9685.PWM and motor.py talk to a DaemonBus and to
+`gpio` from this module instead of smbus and RPi.GPIO, so any number of
+front-ends can drive the car at once.
+
+Requests are a 5 byte header (op, bus, address, reg, count) followed by
+count data bytes on the daemon's Unix socket. Every request, writes
+included, gets a 4 byte reply (status, three values), where status is 0
+or an errno. A failed write therefore raises IOError in the caller, and
+PCA9685's retries and I2C statistics see it as they would on smbus.
+
+Channel writes (aligned LEDn block writes, i.e. everything PWM.write and
+write_many send) go through a SetpointBlock instead: a small shared
+memory file holding the latest (on, off) of all 16 channels and a dirty
+mask. The client updates it and sends a one-header kick; the daemon
+writes whatever is dirty when it gets to the kick, so a burst of
+setpoints collapses into the latest values if the bus falls behind.
+
+The socket and the blocks belong to the daemon's user and are only open
+to its group: actuator_group in config, or the group of the user who ran
+it with sudo.
+'''
+
+import errno
+import fcntl
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+
+import settings
+
+SOCKET_PATH = '/tmp/rpi_car_actuator.sock'
+
+OP_OPEN = 1
+OP_WRITE_BYTE = 2
+OP_WRITE_BLOCK = 3
+OP_READ_BYTE = 4
+OP_KICK = 5
+OP_SYNC = 6
+OP_GPIO_MODE = 7
+OP_GPIO_SETUP = 8
+OP_GPIO_OUTPUT = 9
+OP_GPIO_INPUT = 10
+
+HEADER = struct.Struct('<BBBBB')
+REPLY = struct.Struct('<BBBB')
+
+_LED0_ON_L = 0x06
+_LED15_OFF_H = 0x45
+_CHANNELS = 16
+
+
+def socket_path():
+    path = os.environ.get('ACTUATOR_SOCKET')
+    if path is None:
+        path = str(settings.get('actuator_socket', SOCKET_PATH))
+    return path
+
+
+def block_path(bus_number, address):
+    '''Path of the SetpointBlock of the PCA9685 at (bus_number, address)'''
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'rpi_car_setpoints-%d-%02x' % (bus_number, address))
+
+
+def available():
+    '''True if an actuatord answers on socket_path()'''
+    path = socket_path()
+    if not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise IOError(errno.ECONNRESET, 'actuatord closed the connection')
+        data += chunk
+    return data
+
+
+class SetpointBlock(object):
+    '''Latest (on, off) of every channel of one PCA9685 in shared memory.
+
+    Layout: u32 sequence, u16 dirty mask, u16 padding, then 16 x (u16 on,
+    u16 off). Writers and the daemon hold an fcntl lock on the file while
+    they touch it; snapshot() reads without the lock, for monitors.
+    '''
+
+    _HEADER = struct.Struct('<IHH')
+    _VALUES = struct.Struct('<%dH' % (2 * _CHANNELS))
+    SIZE = _HEADER.size + _VALUES.size
+
+    def __init__(self, path, create=False, mode=0600, gid=-1):
+        self.path = path
+        if create:
+            if os.path.lexists(path):
+                os.remove(path)     # never reuse a file someone else may own
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, mode)
+            os.fchown(self._fd, -1, gid)
+            os.fchmod(self._fd, mode)
+            os.ftruncate(self._fd, self.SIZE)
+        else:
+            self._fd = os.open(path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, self.SIZE)
+
+    def write(self, first, values):
+        '''Set channels first, first+1, ... to the (on, off) in values'''
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            seq, dirty, pad = self._HEADER.unpack_from(self._map, 0)
+            for i, (on, off) in enumerate(values):
+                channel = first + i
+                struct.pack_into('<HH', self._map, self._HEADER.size + 4 * channel, on, off)
+                dirty |= 1 << channel
+            self._HEADER.pack_into(self._map, 0, (seq + 1) & 0xFFFFFFFF, dirty, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def take(self):
+        '''Return {channel: (on, off)} of the dirty channels and clear them'''
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            seq, dirty, pad = self._HEADER.unpack_from(self._map, 0)
+            if not dirty:
+                return {}
+            values = self._VALUES.unpack_from(self._map, self._HEADER.size)
+            self._HEADER.pack_into(self._map, 0, seq, 0, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return dict((channel, (values[2*channel], values[2*channel+1]))
+                    for channel in range(_CHANNELS) if dirty & (1 << channel))
+
+    def mark_dirty(self, channels):
+        '''Make take() return channels again, e.g. after their write failed'''
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            seq, dirty, pad = self._HEADER.unpack_from(self._map, 0)
+            for channel in channels:
+                dirty |= 1 << channel
+            self._HEADER.pack_into(self._map, 0, seq, dirty, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def snapshot(self):
+        '''(sequence, [(on, off)] * 16), read without locking'''
+        seq = self._HEADER.unpack_from(self._map, 0)[0]
+        values = self._VALUES.unpack_from(self._map, self._HEADER.size)
+        return seq, zip(values[0::2], values[1::2])
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class Connection(object):
+    '''One socket to actuatord, shared by every user in the process'''
+
+    def __init__(self, path=None):
+        self.path = path or socket_path()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+        self._lock = threading.Lock()
+
+    def request(self, op, bus=0, address=0, reg=0, data=()):
+        '''Send and wait for the reply, returns its three values'''
+        message = HEADER.pack(op, bus, address, reg, len(data)) + ''.join(chr(b) for b in data)
+        with self._lock:
+            self.sock.sendall(message)
+            status, a, b, c = REPLY.unpack(recv_exactly(self.sock, REPLY.size))
+        if status:
+            raise IOError(status, os.strerror(status))
+        return a, b, c
+
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def connection():
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = Connection()
+        return _connection
+
+
+class DaemonBus(object):
+    '''SMBus-like access to one I2C bus through actuatord'''
+
+    def __init__(self, bus_number):
+        self.bus_number = bus_number
+        self.conn = connection()
+        self.blocks = {}
+        self._registers = {}
+
+    def add_device(self, address):
+        mode1, mode2, prescale = self.conn.request(OP_OPEN, self.bus_number, address)
+        self._registers[address] = {0x00: mode1, 0x01: mode2, 0xFE: prescale}
+        if address not in self.blocks:
+            self.blocks[address] = SetpointBlock(block_path(self.bus_number, address))
+
+    def registers(self, address):
+        '''MODE1, MODE2 and PRESCALE as actuatord set them up, by register'''
+        return dict(self._registers[address])
+
+    def write_byte_data(self, address, reg, value):
+        self.conn.request(OP_WRITE_BYTE, self.bus_number, address, reg, (value,))
+
+    def write_i2c_block_data(self, address, reg, values):
+        block = self.blocks.get(address)
+        if (block is not None and _LED0_ON_L <= reg <= _LED15_OFF_H
+                and (reg - _LED0_ON_L) % 4 == 0 and len(values) % 4 == 0):
+            block.write((reg - _LED0_ON_L) / 4,
+                        [(values[i] | values[i+1] << 8, values[i+2] | values[i+3] << 8)
+                         for i in range(0, len(values), 4)])
+            self.conn.request(OP_KICK, self.bus_number, address)
+            return
+        self.conn.request(OP_WRITE_BLOCK, self.bus_number, address, reg, values)
+
+    def read_byte_data(self, address, reg):
+        return self.conn.request(OP_READ_BYTE, self.bus_number, address, reg)[0]
+
+    def sync(self):
+        '''Wait until actuatord has carried out everything sent so far.
+        Every request is answered, so this is only a round trip.'''
+        self.conn.request(OP_SYNC, self.bus_number)
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def open_bus(bus_number, address=0x40):
+    '''Return the process-wide DaemonBus for bus_number, with the chip at
+    address opened (and set up, if it was not yet) by actuatord'''
+    with _buses_lock:
+        bus = _buses.get(bus_number)
+        if bus is None:
+            bus = _buses[bus_number] = DaemonBus(bus_number)
+    bus.add_device(address)
+    return bus
+
+
+class DaemonGPIO(object):
+    '''The part of RPi.GPIO the server uses, carried out by actuatord.
+    cleanup() is a no-op: the pins belong to the daemon.'''
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        connection().request(OP_GPIO_MODE, reg=mode)
+
+    def setup(self, channel, direction, initial=LOW):
+        connection().request(OP_GPIO_SETUP, reg=channel, data=(direction, initial))
+
+    def output(self, channel, level):
+        connection().request(OP_GPIO_OUTPUT, reg=channel, data=(1 if level else 0,))
+
+    def input(self, channel):
+        return connection().request(OP_GPIO_INPUT, reg=channel)[0]
+
+    def cleanup(self, channel=None):
+        pass
+
+
+gpio = DaemonGPIO()
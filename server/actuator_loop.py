@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+'''
+Fixed-tick actuator loop.
+
+Commands only set targets (set_throttle, set_steer, set_pan_tilt). A
+thread ticks at tick_hz on an absolute CLOCK_MONOTONIC schedule (so
+a wall clock step cannot stall it), moves every output toward its
+target by at most its slew rate and commits the whole frame (steering
+CH0, motor EN CH4/CH5, pan/tilt CH14/CH15) with one write_many(). The
+I2C load is therefore bounded by the tick rate and the command-to-output
+delay by one tick, however fast commands arrive.
+
+Pan/tilt are only driven from the first set_pan_tilt() until
+release_pan_tilt(), which hands the camera back to video_dir's own
+moves (x+, xy_rate=, home_x_y, ...).
+
+With realtime on, the loop thread asks for SCHED_FIFO, CPU affinity and
+locked memory (see realtime.py) and carries on without them where they
+are not permitted. The frame has to reach the bus from this thread for
+that to help, so the PCA9685 should not be writing asynchronously (see
+PCA9685.PWM.start_async) while the loop runs. Run this file to benchmark
+the jitter of the frame writes:
+
+    PCA9685_BUS=sim python actuator_loop.py [seconds] [--hz 100] [--rt] [--cpu 3]
+'''
+
+import sys
+import threading
+import time
+
+import car_dir
+import motor
+import realtime
+import video_dir
+
+STEER_CHANNEL = 0
+PAN_CHANNEL = 14
+TILT_CHANNEL = 15
+
+
+def _approach(current, target, step):
+    if target > current:
+        return min(current + step, target)
+    return max(current - step, target)
+
+
+class ControlLoop(object):
+    '''Drives motor, steering and pan/tilt from targets at a fixed tick.
+
+    throttle is signed speed in motor units (-100..100, negative is
+    backward), steering and pan/tilt are servo pulses. The slew limits
+    are in those units per second; None means jump straight to the
+    target.
+    '''
+
+    def __init__(self, tick_hz=100, throttle_slew=250.0, steer_slew=2000.0, pan_tilt_slew=1500.0,
+                 realtime=False, priority=50, cpus=None):
+        self.tick_hz = tick_hz
+        self.realtime = realtime
+        self.priority = priority
+        self.cpus = cpus
+        self.realtime_report = None
+        self.throttle_slew = throttle_slew
+        self.steer_slew = steer_slew
+        self.pan_tilt_slew = pan_tilt_slew
+        self.motor = motor.motor
+        self.pwm = self.motor.pwm
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()   # held by a tick from computing to writing
+        self._targets = {'throttle': 0.0, 'steer': None, 'pan': None, 'tilt': None}
+        self._outputs = {'throttle': 0.0, 'steer': None, 'pan': None, 'tilt': None}
+        self._thread = None
+        self._stop = threading.Event()
+        self.ticks = 0
+        self.overruns = 0
+        self.write_started = self.write_done = None    # realtime.monotonic() around the last frame write
+        self.tick_listeners = []
+
+    # ----- targets, safe to call from any thread -----
+
+    def set_throttle(self, speed, immediate=False):
+        '''Signed speed target. immediate skips the slew limit, for stops.'''
+        with self._lock:
+            self._targets['throttle'] = float(max(-100, min(100, speed)))
+            if immediate:
+                self._outputs['throttle'] = self._targets['throttle']
+
+    def halt(self):
+        '''Stop the motors now: zero the throttle and write the stopped
+        direction pins and EN duty here instead of at the next tick. It
+        waits out a tick in progress, so that tick cannot undo the stop.'''
+        with self._commit_lock:
+            with self._lock:
+                self._targets['throttle'] = self._outputs['throttle'] = 0.0
+            self.motor.stop()
+            self.pwm.write_many(self.motor.speed_channels(0))
+
+    def set_steer(self, pulse):
+        with self._lock:
+            self._targets['steer'] = float(pulse)
+
+    def set_steer_angle(self, angle):
+        '''Steering target as the 0..255 angle of the turn= command'''
+        self.set_steer(car_dir.pulse(angle))
+
+    def set_pan_tilt(self, x=None, y=None):
+        with self._lock:
+            if x is not None:
+                self._targets['pan'] = float(max(video_dir.Xmin, min(video_dir.Xmax, x)))
+            if y is not None:
+                self._targets['tilt'] = float(max(video_dir.Ymin, min(video_dir.Ymax, y)))
+
+    def release_pan_tilt(self, settle=0.0):
+        '''Stop driving pan/tilt, after waiting up to settle seconds for
+        them to reach their targets. Returns after any tick in progress
+        has written, so no loop write can follow the caller's next camera
+        move.'''
+        deadline = realtime.monotonic() + settle
+        while self.running and realtime.monotonic() < deadline:
+            with self._lock:
+                if all(self._outputs[name] == self._targets[name] for name in ('pan', 'tilt')):
+                    break
+            time.sleep(1.0 / self.tick_hz)
+        with self._commit_lock:
+            with self._lock:
+                for name in ('pan', 'tilt'):
+                    self._targets[name] = None
+                    self._outputs[name] = None
+
+    def targets(self):
+        with self._lock:
+            return dict(self._targets)
+
+    def outputs(self):
+        with self._lock:
+            return dict(self._outputs)
+
+    # ----- the loop -----
+
+    def step(self, dt):
+        '''Advance every output by one tick of dt seconds and commit the frame'''
+        limits = {
+            'throttle': self.throttle_slew,
+            'steer': self.steer_slew,
+            'pan': self.pan_tilt_slew,
+            'tilt': self.pan_tilt_slew,
+        }
+        with self._commit_lock:
+            self._commit(limits, dt)
+
+    def _commit(self, limits, dt):
+        with self._lock:
+            for name, target in self._targets.items():
+                current = self._outputs[name]
+                if target is None:
+                    continue
+                if current is None or limits[name] is None:
+                    self._outputs[name] = target
+                else:
+                    self._outputs[name] = _approach(current, target, limits[name] * dt)
+            outputs = dict(self._outputs)
+
+        throttle = outputs['throttle']
+        frame = self.motor.speed_channels(abs(throttle))
+        if throttle > 0:
+            self.motor.forward()        # Motor only writes pins that change
+        elif throttle < 0:
+            self.motor.backward()
+        else:
+            self.motor.stop()
+        if outputs['steer'] is not None:
+            frame[STEER_CHANNEL] = (0, int(round(outputs['steer'])))
+        if outputs['pan'] is not None:
+            video_dir.Current_x = int(round(outputs['pan']))
+            frame[PAN_CHANNEL] = (0, video_dir.Current_x)
+        if outputs['tilt'] is not None:
+            video_dir.Current_y = int(round(outputs['tilt']))
+            frame[TILT_CHANNEL] = (0, video_dir.Current_y)
+        self.write_started = realtime.monotonic()
+        self.pwm.write_many(frame)
+        self.write_done = realtime.monotonic()
+        self.ticks += 1
+
+    def _run(self):
+        if self.realtime:
+            self.realtime_report = realtime.make_realtime(self.priority, self.cpus)
+            print 'Control loop real-time setup: %s' % ', '.join(
+                '%s %s' % item for item in sorted(self.realtime_report.items()))
+        period = 1.0 / self.tick_hz
+        due = realtime.monotonic()
+        while not self._stop.is_set():
+            due += period
+            delay = due - realtime.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                self.overruns += 1
+                due = realtime.monotonic()   # fell behind by more than a tick, re-anchor
+            now = realtime.monotonic()
+            self.step(period)
+            for listener in self.tick_listeners:
+                listener(now, due)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='actuator-loop')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def jitter_benchmark(seconds=10.0, tick_hz=100, rt=False, cpus=None):
+    """Run a ControlLoop for seconds and return statistics of the period
+    between the frames reaching the bus and of the time each write took"""
+    stamps = []
+    writes = []
+    def written(now, due):
+        stamps.append(loop.write_done)
+        writes.append(loop.write_done - loop.write_started)
+    loop = ControlLoop(tick_hz=tick_hz, realtime=rt, cpus=cpus)
+    loop.tick_listeners.append(written)
+    loop.set_steer(car_dir.homePWM)
+    loop.start()
+    start = realtime.monotonic()
+    while realtime.monotonic() - start < seconds:
+        # keep targets moving, like a driver would
+        phase = (realtime.monotonic() - start) % 2.0
+        loop.set_throttle(60 if phase < 1.0 else -60)
+        loop.set_steer_angle(int(phase * 127))
+        time.sleep(0.02)
+    loop.stop()
+    periods = [b - a for a, b in zip(stamps, stamps[1:])]
+    nominal = 1.0 / tick_hz
+    jitter = [abs(period - nominal) for period in periods]
+    if not periods:     # fewer than two ticks, nothing to measure
+        periods = jitter = [0.0]
+    writes = writes or [0.0]
+    return {
+        'ticks': loop.ticks,
+        'overruns': loop.overruns,
+        'nominal': nominal,
+        'period_p50': _percentile(periods, 50),
+        'period_p99': _percentile(periods, 99),
+        'period_max': max(periods),
+        'jitter_p50': _percentile(jitter, 50),
+        'jitter_p99': _percentile(jitter, 99),
+        'jitter_max': max(jitter),
+        'write_p50': _percentile(writes, 50),
+        'write_p99': _percentile(writes, 99),
+        'write_max': max(writes),
+        'realtime': loop.realtime_report,
+    }
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    tick_hz = 100
+    rt = False
+    cpus = None
+    if '--hz' in args:
+        i = args.index('--hz')
+        tick_hz = int(args[i+1])
+        del args[i:i+2]
+    if '--rt' in args:
+        args.remove('--rt')
+        rt = True
+    if '--cpu' in args:
+        i = args.index('--cpu')
+        cpus = [int(cpu) for cpu in args[i+1].split(',')]
+        del args[i:i+2]
+    seconds = float(args[0]) if args else 10.0
+
+    video_dir.setup()
+    car_dir.setup()
+    motor.setup()
+    result = jitter_benchmark(seconds, tick_hz, rt, cpus)
+    print '%(ticks)d ticks, %(overruns)d overruns' % result
+    print 'write period p50 %.3f ms  p99 %.3f ms  max %.3f ms  (nominal %.3f ms)' % (
+        result['period_p50'] * 1000, result['period_p99'] * 1000, result['period_max'] * 1000, result['nominal'] * 1000)
+    print 'jitter       p50 %.3f ms  p99 %.3f ms  max %.3f ms' % (
+        result['jitter_p50'] * 1000, result['jitter_p99'] * 1000, result['jitter_max'] * 1000)
+    print 'write time   p50 %.3f ms  p99 %.3f ms  max %.3f ms' % (
+        result['write_p50'] * 1000, result['write_p99'] * 1000, result['write_max'] * 1000)
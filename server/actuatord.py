@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+'''
+Actuator daemon: the one process that opens the I2C bus and the GPIO.
+
+tcp_server, cali_server, servo_test and the other tools become its
+clients (see actuator_client.py and hw_backend.py), so they can run
+side by side, and their startup no longer pays for bus detection, GPIO
+setup and the PCA9685 reset: the daemon sets each chip up once, when
+the first client opens it.
+
+    sudo python actuatord.py            # real hardware
+    PCA9685_BUS=sim python actuatord.py # simulator
+
+The daemon uses the backend configured as usual (PCA9685_BUS or
+i2c_bus), with "auto" and "daemon" meaning smbus here. It listens on
+ACTUATOR_SOCKET / "actuator_socket" (default /tmp/rpi_car_actuator.sock)
+and serves every client connection from its own thread; bus and GPIO
+access is serialized by one lock.
+
+The socket and the setpoint blocks are created mode 0660 for the group
+named by "actuator_group" in config, or else for the group of the user
+who started the daemon with sudo; without either only the daemon's own
+user can drive the car. Pins are set up once: a second front end calling
+motor.setup() does not reset the pins of a car that is moving.
+
+The front ends send every channel write, since they cannot know what
+the others wrote. The daemon remembers what it last wrote to each chip
+and skips the channels of a SetpointBlock that already hold their value.
+'''
+
+import grp
+import os
+import SocketServer
+import sys
+import threading
+
+import PCA9685
+import actuator_client as ipc
+import hw_backend
+import settings
+
+_MODE1 = 0x00
+_MODE2 = 0x01
+_PRESCALE = 0xFE
+_LED0_ON_L = 0x06
+_MAX_BLOCK = 32
+
+
+class Daemon(object):
+    '''The buses, chips, setpoint blocks and GPIO of the daemon'''
+
+    def __init__(self, backend=None, mode=0600, gid=-1):
+        if backend is None:
+            backend = hw_backend.backend_name()
+        if backend in ('auto', 'daemon'):
+            backend = 'smbus'
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.buses = {}
+        self.pwms = {}
+        self.blocks = {}
+        self.written = {}       # (bus, address) -> {channel: (on, off)} on the chip
+        self.pins = {}          # channel -> direction, as set up
+        self.mode = mode        # of the setpoint blocks, see run()
+        self.gid = gid
+        self.gpio = hw_backend.gpio(backend)
+        self.gpio.setwarnings(False)
+
+    def open(self, bus_number, address):
+        '''Set the chip up on first use. Returns MODE1, MODE2, PRESCALE.'''
+        key = (bus_number, address)
+        if key not in self.pwms:
+            bus = self.buses.get(bus_number)
+            if bus is None:
+                bus = self.buses[bus_number] = hw_backend.open_i2c(bus_number, address, self.backend)
+            elif hasattr(bus, 'add_device'):
+                bus.add_device(address)
+            self.pwms[key] = PCA9685.PWM(bus_number, address, bus=bus)
+            self.written[key] = {}
+            self.blocks[key] = ipc.SetpointBlock(ipc.block_path(bus_number, address), create=True,
+                                                 mode=self.mode, gid=self.gid)
+            print 'PCA9685 0x%02X on bus %d ready' % (address, bus_number)
+        bus = self.buses[bus_number]
+        return [bus.read_byte_data(address, reg) for reg in (_MODE1, _MODE2, _PRESCALE)]
+
+    def apply(self, bus_number, address):
+        '''Write the dirty channels of the SetpointBlock, one block per
+        run of adjacent channels. Channels that already hold their value
+        are skipped.'''
+        key = (bus_number, address)
+        block = self.blocks[key]
+        written = self.written[key]
+        values = block.take()
+        channels = sorted(c for c in values if written.get(c) != values[c])
+        bus = self.buses[bus_number]
+        try:
+            self._write_runs(bus, address, channels, values)
+        except IOError:
+            block.mark_dirty(channels)  # the next kick, or the client's retry, tries again
+            written.clear()
+            raise
+        for channel in channels:
+            written[channel] = values[channel]
+
+    def _write_runs(self, bus, address, channels, values):
+        start = 0
+        while start < len(channels):
+            end = start + 1
+            while (end < len(channels) and end - start < _MAX_BLOCK / 4
+                   and channels[end] == channels[end-1] + 1):
+                end += 1
+            data = []
+            for channel in channels[start:end]:
+                on, off = values[channel]
+                data += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+            bus.write_i2c_block_data(address, _LED0_ON_L + 4*channels[start], data)
+            start = end
+
+    def _forget(self, bus_number, address):
+        '''A raw write (ALL_LED, byte writes, a reset) may change any channel,
+        of every chip on the bus if it went to ALLCALL'''
+        target = (bus_number, address)
+        for key, written in self.written.items():
+            if key == target or (key[0] == bus_number and target not in self.written):
+                written.clear()
+
+    def execute(self, op, bus_number, address, reg, data):
+        '''Carry out one request and return the three reply values'''
+        if op == ipc.OP_KICK:
+            self.apply(bus_number, address)
+        elif op == ipc.OP_WRITE_BYTE:
+            self._forget(bus_number, address)
+            self.buses[bus_number].write_byte_data(address, reg, data[0])
+        elif op == ipc.OP_WRITE_BLOCK:
+            self._forget(bus_number, address)
+            self.buses[bus_number].write_i2c_block_data(address, reg, data)
+        elif op == ipc.OP_GPIO_OUTPUT:
+            self.gpio.output(reg, data[0])
+        elif op == ipc.OP_READ_BYTE:
+            return [self.buses[bus_number].read_byte_data(address, reg), 0, 0]
+        elif op == ipc.OP_OPEN:
+            return self.open(bus_number, address)
+        elif op == ipc.OP_SYNC:
+            pass
+        elif op == ipc.OP_GPIO_MODE:
+            if self.gpio.getmode() != reg:
+                self.gpio.setmode(reg)
+            return [0, 0, 0]
+        elif op == ipc.OP_GPIO_SETUP:
+            if self.pins.get(reg) != data[0]:
+                self.gpio.setup(reg, data[0], initial=data[1])
+                self.pins[reg] = data[0]
+        elif op == ipc.OP_GPIO_INPUT:
+            return [self.gpio.input(reg), 0, 0]
+        else:
+            raise IOError(22, 'unknown request %d' % op)
+        return [0, 0, 0]
+
+    def serve(self, sock):
+        '''Handle the requests of one client until it disconnects'''
+        while True:
+            try:
+                header = ipc.recv_exactly(sock, ipc.HEADER.size)
+            except IOError:
+                return
+            op, bus_number, address, reg, count = ipc.HEADER.unpack(header)
+            data = [ord(c) for c in ipc.recv_exactly(sock, count)] if count else []
+            try:
+                with self.lock:
+                    reply = self.execute(op, bus_number, address, reg, data)
+                status = 0
+            except (IOError, KeyError, ValueError), e:
+                print 'request %d 0x%02X/0x%02X failed: %s' % (op, address, reg, e)
+                reply = [0, 0, 0]
+                status = getattr(e, 'errno', None) or 5
+            sock.sendall(ipc.REPLY.pack(min(status, 255), *reply))
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        self.server.daemon_.serve(self.request)
+
+
+def _group():
+    '''The gid front ends run under, or -1 for the daemon's user only'''
+    name = settings.get('actuator_group')
+    if name is not None:
+        return grp.getgrnam(str(name)).gr_gid
+    if 'SUDO_GID' in os.environ:
+        return int(os.environ['SUDO_GID'])
+    return -1
+
+
+def run(path=None, backend=None):
+    path = path or ipc.socket_path()
+    if ipc.available():
+        print 'actuatord is already running on %s' % path
+        sys.exit(1)
+    if os.path.exists(path):
+        os.remove(path)     # left behind by a daemon that died
+    gid = _group()
+    mode = 0660 if gid != -1 else 0600
+    umask = os.umask(0177)      # no window in which others can connect
+    try:
+        server = SocketServer.ThreadingUnixStreamServer(path, _Handler)
+    finally:
+        os.umask(umask)
+    os.chown(path, -1, gid)
+    os.chmod(path, mode)
+    server.daemon_threads = True
+    server.daemon_ = Daemon(backend, mode, gid)
+    print 'actuatord (%s backend) listening on %s' % (server.daemon_.backend, path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    run()
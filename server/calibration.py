@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+'''
+Calibration of the steering offset and curve, the camera mount offsets
+and the motor directions, shared by cali_server and the calibration
+mode of tcp_server.
+
+A Session starts from the current config values and previews every
+change on the servos and motors as it is made. Its `commands` registry
+(see dispatch.py) maps the calibration client's commands (motor_run,
+leftreverse, offset=, offsetx+, curve=, ...) to them. confirm() writes the
+values with settings.save(), which replaces the config file atomically
+and reloads it, so car_dir, video_dir and motor pick the new values up
+through their settings subscriptions without a restart.
+'''
+
+import functools
+
+import car_dir
+import dispatch
+import motor
+import settings
+import video_dir
+
+
+class Session(object):
+    '''One calibration run: dispatch the cali commands through
+    self.commands, then confirm() or cancel()'''
+
+    def __init__(self):
+        self.offset_x = settings.get('offset_x')
+        self.offset_y = settings.get('offset_y')
+        self.offset = settings.get('offset')
+        self.forward0 = settings.get('forward0')
+        self.forward1 = settings.get('forward1', False)   # cali_server's default
+        self.turn_curve = settings.get('turn_curve')
+        self.turn_interp = settings.get('turn_interp', 'linear')
+        self.commands = dispatch.Registry()
+        add = self.commands.add
+        add('motor_run', self.motor_run)
+        add('leftmotor', self.left_motor, dispatch.word)
+        add('rightmotor', self.right_motor, dispatch.word)
+        add('leftreverse', lambda: self.left_motor(not self.forward0))
+        add('rightreverse', lambda: self.right_motor(not self.forward1))
+        add('motor_stop', self.motor_stop)
+        add('curve=', self.set_curve, str)   # curve=angle:pulse,angle:pulse,...[;spline]
+        for op in '=+-':
+            add('offset' + op, functools.partial(self.turn_offset, op), int)
+            add('offsetx' + op, functools.partial(self.mount_offset, op, None), int)
+            add('offsety' + op, functools.partial(self.mount_offset, None, op), int)
+
+    def values(self):
+        return {
+            'offset_x': self.offset_x,
+            'offset_y': self.offset_y,
+            'offset': self.offset,
+            'forward0': self.forward0,
+            'forward1': self.forward1,
+            'turn_curve': self.turn_curve,
+            'turn_interp': self.turn_interp if self.turn_curve is not None else None,
+        }
+
+    def preview(self):
+        '''Hold the servos at the center pulses plus the current offsets'''
+        video_dir.calibrate(self.offset_x, self.offset_y)
+        car_dir.calibrate(self.offset)
+
+    #--------Motor calibration----------
+    def motor_run(self):
+        print 'motor moving forward'
+        motor.setSpeed(50)
+        motor.motor0(self.forward0)
+        motor.motor1(self.forward1)
+
+    def left_motor(self, forward):
+        self.forward0 = forward
+        print 'left motor forward is', self.forward0
+        motor.motor0(self.forward0)
+
+    def right_motor(self, forward):
+        self.forward1 = forward
+        print 'right motor forward is', self.forward1
+        motor.motor1(self.forward1)
+
+    def motor_stop(self):
+        print 'motor stop'
+        motor.stop()
+
+    #-------Steering calibration------
+    def set_curve(self, text):
+        points, sep, interp = text.partition(';')
+        car_dir.set_curve(points, interp or None)
+        self.turn_curve = car_dir.format_curve(car_dir.curve)
+        self.turn_interp = car_dir.interp
+        print 'Steering curve', self.turn_curve, self.turn_interp
+
+    def turn_offset(self, op, value):
+        self.offset = _adjust(self.offset, op, value)
+        print 'Turning offset', self.offset
+        car_dir.calibrate(self.offset)
+
+    #----------Mount calibration---------
+    def mount_offset(self, op_x, op_y, value):
+        if op_x is not None:
+            self.offset_x = _adjust(self.offset_x, op_x, value)
+        if op_y is not None:
+            self.offset_y = _adjust(self.offset_y, op_y, value)
+        print 'Mount offset', self.offset_x, self.offset_y
+        video_dir.calibrate(self.offset_x, self.offset_y)
+
+    def confirm(self):
+        '''Stop the motors and save the values, which applies them'''
+        motor.stop()
+        values = self.values()
+        print ''
+        print '*********************************'
+        print ' You are setting config file to:'
+        print '*********************************'
+        for name in sorted(values):
+            if values[name] is not None:
+                print '%s = %s' % (name, values[name])
+        print '*********************************'
+        print ''
+        return settings.save(values)
+
+    def cancel(self):
+        '''Stop the motors and go back to the saved curve'''
+        motor.stop()
+        car_dir.load_offset()
+
+
+def _adjust(value, op, amount):
+    if op == '=':
+        return amount
+    if op == '+':
+        return value + amount
+    return value - amount
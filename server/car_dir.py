@@ -1,29 +1,128 @@
 #!/usr/bin/env python
 import PCA9685 as servo
+import settings
+import math
 import time                # Import necessary modules
 
+# ==========================================================================================
+# turn(angle) maps the 0..255 angle sent by the client onto the steering pulse through a
+# 256 entry table. The table is built from calibration points "angle:pulse,..." (config
+# value turn_curve, pulses before the offset), joined by straight lines or, with
+# turn_interp = spline, by a monotone cubic that never overshoots between the points.
+# turn_deadband angles either side of the center all map to homePWM.
+# ==========================================================================================
+DEFAULT_CURVE = [(0, 350), (255, 550)]
+
+curve = list(DEFAULT_CURVE)
+interp = 'linear'
+deadband = 0
+table = []
+
 def Map(x, in_min, in_max, out_min, out_max):
 	return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
 
-def setup(busnum=None):
-	global leftPWM, rightPWM, homePWM, pwm
-	leftPWM = 350
-	homePWM = 450
-	rightPWM = 550
-	offset =0
+def parse_curve(text):
+	'''Parse "angle:pulse,angle:pulse,..." into a sorted list of points'''
+	points = []
+	for item in str(text).split(','):
+		angle, sep, pulse = item.partition(':')
+		if not sep:
+			raise ValueError('calibration point must be angle:pulse, not %r' % item)
+		points.append((int(angle), int(pulse)))
+	points.sort()
+	if len(points) < 2 or len(set(angle for angle, pulse in points)) != len(points):
+		raise ValueError('need at least two calibration points with distinct angles')
+	return points
+
+def format_curve(points):
+	return ','.join('%d:%d' % point for point in points)
+
+def _slopes(points):
+	'''Fritsch-Carlson tangents, so the cubic stays monotone between points'''
+	d = [(points[i+1][1] - points[i][1]) / float(points[i+1][0] - points[i][0]) for i in range(len(points) - 1)]
+	m = [d[0]] + [(d[i-1] + d[i]) / 2 if d[i-1] * d[i] > 0 else 0.0 for i in range(1, len(d))] + [d[-1]]
+	for i in range(len(d)):
+		if d[i] == 0:
+			m[i] = m[i+1] = 0.0
+			continue
+		a = m[i] / d[i]
+		b = m[i+1] / d[i]
+		if a * a + b * b > 9:
+			t = 3 / math.sqrt(a * a + b * b)
+			m[i] = t * a * d[i]
+			m[i+1] = t * b * d[i]
+	return m
+
+def build_table(points, offset=0, interp='linear', deadband=0):
+	'''Return the 256 steering pulses for angles 0..255'''
+	m = _slopes(points) if interp == 'spline' else None
+	home = 450 + offset
+	result = []
+	segment = 0
+	for angle in range(256):
+		if abs(angle - 127.5) <= deadband:
+			result.append(home)
+			continue
+		if angle <= points[0][0]:
+			result.append(points[0][1] + offset)
+			continue
+		if angle >= points[-1][0]:
+			result.append(points[-1][1] + offset)
+			continue
+		while points[segment+1][0] < angle:
+			segment += 1
+		(x0, y0), (x1, y1) = points[segment], points[segment+1]
+		if m is None:
+			result.append(Map(angle - x0, 0, x1 - x0, y0, y1) + offset)
+			continue
+		h = float(x1 - x0)
+		t = (angle - x0) / h
+		y = ((2*t**3 - 3*t**2 + 1) * y0 + (t**3 - 2*t**2 + t) * h * m[segment]
+		     + (-2*t**3 + 3*t**2) * y1 + (t**3 - t**2) * h * m[segment+1])
+		result.append(int(round(y)) + offset)
+	return result
+
+def load_offset(changed=None):
+	'''(Re)compute the steering pulses and table from the config. Registered
+	with settings, so an edited offset or curve applies to the next turn.'''
+	global leftPWM, rightPWM, homePWM, curve, interp, deadband
+	keys = ('offset', 'turn_curve', 'turn_interp', 'turn_deadband')
+	if changed is not None and not any(key in changed for key in keys):
+		return
+	offset = settings.get('offset')
+	leftPWM = 350 + offset
+	homePWM = 450 + offset
+	rightPWM = 550 + offset
 	try:
-		for line in open('config'):
-			if line[0:8] == 'offset =':
-				offset = int(line[9:-1])
-	except:
-		print 'config error'
-	leftPWM += offset
-	homePWM += offset
-	rightPWM += offset
-	if busnum == None:
-		pwm = servo.PWM()                  # Initialize the servo controller.
-	else:
-		pwm = servo.PWM(bus_number=busnum) # Initialize the servo controller.
+		curve = parse_curve(settings.get('turn_curve', format_curve(DEFAULT_CURVE)))
+	except ValueError, e:
+		print 'turn_curve ignored:', e
+		curve = list(DEFAULT_CURVE)
+	interp = settings.get('turn_interp', 'linear')
+	deadband = settings.get('turn_deadband', 0)
+	rebuild()
+
+def rebuild():
+	global table
+	table = build_table(curve, leftPWM - 350, interp, deadband)
+
+def set_curve(points, new_interp=None, new_deadband=None):
+	'''Replace the calibration curve at run time, e.g. from cali_server'''
+	global curve, interp, deadband
+	if isinstance(points, basestring):
+		points = parse_curve(points)
+	curve = sorted(points)
+	if new_interp is not None:
+		interp = new_interp
+	if new_deadband is not None:
+		deadband = new_deadband
+	rebuild()
+
+def setup(busnum=None):
+	global pwm
+	load_offset()
+	settings.subscribe(load_offset)
+	pwm = servo.get_pwm(busnum)        # Shared servo controller, initialized once per process.
 	pwm.frequency = 60
 
 # ==========================================================================================
@@ -45,9 +144,12 @@ def turn_right():
 # Make the car turn back.
 # ==========================================================================================
 
+def pulse(angle):
+	'''Steering pulse for a 0..255 angle'''
+	return table[min(max(angle, 0), 255)]
+
 def turn(angle):
-	angle = Map(angle, 0, 255, leftPWM, rightPWM)
-	pwm.write(0, 0, angle)
+	pwm.write(0, 0, pulse(angle))
 
 def home():
 	global homePWM
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+'''
+The client connections of tcp_server, served from one select() loop.
+
+Any number of clients can be connected at once. Each Connection has its
+own framing.CommandReader and a role:
+
+    driver      at most one; its commands and drive frames drive the car
+    observer    everyone else; only the read-only commands (temperature,
+                stats, status) are answered
+
+A new connection becomes the driver only if there is none. Driving is
+handed over on request only: claim() ("role=driver [token]") succeeds
+if there is no driver, if it presents the token issued to the current
+driver, or if it comes from one of driver_hosts. Every grant issues a
+new token. A client reconnecting after its link dropped presents its
+token and the old socket, which may be dead without either side
+knowing yet, is closed rather than waited for. "role=observer" gives
+driving up.
+
+A connection that frames its commands with newlines and then sends
+nothing for idle_timeout seconds is closed; such clients send an empty
+line now and then while idle. Older clients (client_App, cali_client)
+send bare commands only on button clicks and are never timed out, only
+dropped when TCP keepalive finds their link dead.
+Replies are queued and written when the socket is writable, so a slow
+observer never stalls the loop; one that lets max_queued bytes pile up
+is dropped.
+'''
+
+import binascii
+import errno
+import os
+import select
+import socket
+import time
+import traceback
+
+import framing
+
+DRIVER = 'driver'
+OBSERVER = 'observer'
+
+
+class Connection(object):
+
+    def __init__(self, sock, address, now):
+        self.sock = sock
+        self.address = address
+        self.host = address[0]
+        self.role = OBSERVER
+        self.reader = framing.CommandReader()
+        self.connected_at = now
+        self.last_seen = now
+        self.closed = False
+        self._queued = bytearray()
+
+    def send(self, data):
+        '''Queue data for the client, written by the server's loop'''
+        self._queued.extend(data)
+
+    def queued(self):
+        return len(self._queued)
+
+    def flush(self):
+        '''Write as much of the queue as the socket takes without blocking'''
+        if not self._queued:
+            return
+        sent = self.sock.send(self._queued)
+        del self._queued[:sent]
+
+    def describe(self):
+        return '%s:%d' % self.address
+
+
+class Server(object):
+    '''Accepts clients on address and passes every command they send to
+    handle(connection, command), whose return value, if not None, is sent
+    back. role_changed(connection, old_role) is called whenever a
+    connection gains or loses the driver role, including when the
+    driver disconnects.'''
+
+    def __init__(self, address, handle, role_changed=None, idle_timeout=60.0,
+                 max_queued=65536, bufsize=1024, driver_hosts=()):
+        self.address = address
+        self.handle = handle
+        self.role_changed = role_changed
+        self.idle_timeout = idle_timeout
+        self.max_queued = max_queued
+        self.bufsize = bufsize
+        self.connections = {}       # socket -> Connection
+        self.readers = {}           # other socket -> callback(now), see add_reader()
+        self.driver_hosts = frozenset(driver_hosts)
+        self.driver = None
+        self.token = None           # issued to the driver, see claim()
+        self.sock = None
+
+    def listen(self, backlog=5):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        self.sock.listen(backlog)
+        self.sock.setblocking(False)
+
+    def add_reader(self, sock, callback):
+        '''Call callback(now) from the loop whenever sock is readable'''
+        self.readers[sock] = callback
+
+    def observers(self):
+        return [c for c in self.connections.itervalues() if c.role == OBSERVER]
+
+    def claim(self, connection, token=None):
+        '''Make connection the driver if it may take over (see the module
+        docstring). Returns its new token, or None if refused.'''
+        previous = self.driver
+        if previous is not None and previous is not connection:
+            if token is not None and token == self.token:
+                print '%s took over with the driver token' % connection.describe()
+                self.set_role(connection, DRIVER)
+                self.close(previous)    # the same client, reconnected
+            elif connection.host in self.driver_hosts:
+                self.set_role(connection, DRIVER)
+            else:
+                return None
+        else:
+            self.set_role(connection, DRIVER)
+        return self.token
+
+    def set_role(self, connection, role):
+        '''Make connection the driver (demoting the current one) or an
+        observer'''
+        old = connection.role
+        if role == old:
+            return
+        if role == DRIVER:
+            previous = self.driver
+            if previous is not None:
+                previous.role = OBSERVER
+                self.driver = None
+                self._role_changed(previous, DRIVER)
+            self.driver = connection
+            self.token = binascii.hexlify(os.urandom(8))
+        elif connection is self.driver:
+            self.driver = None
+        connection.role = role
+        self._role_changed(connection, old)
+
+    def _role_changed(self, connection, old):
+        print '%s is now %s (was %s)' % (connection.describe(), connection.role, old)
+        if self.role_changed is not None:
+            self.role_changed(connection, old)
+
+    def _accept(self, now):
+        try:
+            sock, address = self.sock.accept()
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNABORTED):
+                return
+            raise
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = Connection(sock, address, now)
+        self.connections[sock] = connection
+        print '...connected from :', address
+        if self.driver is None:
+            self.set_role(connection, DRIVER)
+
+    def close(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        del self.connections[connection.sock]
+        connection.sock.close()
+        print '...disconnected :', connection.address
+        if connection is self.driver:
+            self.driver = None
+            connection.role = OBSERVER
+            self._role_changed(connection, DRIVER)
+
+    def _read(self, connection, now):
+        try:
+            data = connection.sock.recv(self.bufsize)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self.close(connection)
+            return
+        connection.last_seen = now
+        for command in connection.reader.feed(data):
+            try:
+                reply = self.handle(connection, command)
+            except Exception:
+                # A broken handler costs this command, not every connection
+                print 'Command Error! %s failed:' % connection.describe(), repr(command)
+                traceback.print_exc()
+                reply = 'error %s\n' % command if isinstance(command, str) else None
+            if connection.closed:
+                return
+            if reply is not None:
+                connection.send(reply)
+
+    def _write(self, connection):
+        try:
+            connection.flush()
+        except socket.error, e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self.close(connection)
+
+    def _expire(self, now):
+        for connection in self.connections.values():
+            if connection.reader.framed and now - connection.last_seen > self.idle_timeout:
+                print '%s idle for %.0f s' % (connection.describe(), now - connection.last_seen)
+                self.close(connection)
+            elif connection.queued() > self.max_queued:
+                print '%s is not reading its replies' % connection.describe()
+                self.close(connection)
+
+    def poll(self, timeout=1.0):
+        '''Wait up to timeout for activity and handle it'''
+        readable = [self.sock] + self.connections.keys() + self.readers.keys()
+        writable = [c.sock for c in self.connections.itervalues() if c.queued()]
+        try:
+            readable = select.select(readable, writable, [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        now = time.time()
+        for sock in readable:
+            if sock is self.sock:
+                self._accept(now)
+                continue
+            if sock in self.readers:
+                try:
+                    self.readers[sock](now)
+                except Exception:
+                    print 'Error! reading', sock.getsockname()
+                    traceback.print_exc()
+                continue
+            connection = self.connections.get(sock)
+            if connection is not None:
+                self._read(connection, now)
+        for connection in self.connections.values():
+            if connection.queued():
+                self._write(connection)
+        self._expire(now)
+
+    def serve_forever(self):
+        if self.sock is None:
+            self.listen()
+        while True:
+            self.poll()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''
+Table-driven dispatch of the text commands of tcp_server and cali_server.
+
+A Registry maps a command name to (handler, parse). Names come in two
+kinds:
+
+    'stop', 'x+', 'motor_run'   the whole command; handler()
+    'turn=', 'offset+', 'speed' a prefix taking an argument;
+                                handler(parse(rest_of_command))
+
+dispatch() looks the whole command up first. Otherwise one precompiled
+regex splits off the lower case name and an optional '=', '+' or '-'
+("offsetx+10" -> "offsetx+", "10"; "speed50" -> "speed", "50";
+"leftmotorTrue" -> "leftmotor", "True") and that is looked up, so every
+command costs at most two dict lookups whatever the size of the table.
+'''
+
+import re
+
+_SPLIT = re.compile(r'([a-z_]+[=+-]?)(.*)$', re.S)
+
+
+class UnknownCommand(ValueError):
+    pass
+
+
+def word(text):
+    '''True or False, as the calibration client spells them'''
+    if text not in ('True', 'False'):
+        raise ValueError('expected True or False, not %r' % text)
+    return text == 'True'
+
+
+def ints(text):
+    '''A comma separated list of integers, e.g. "vx,vy"'''
+    return [int(value) for value in text.split(',')]
+
+
+class Registry(object):
+    '''Command names to handlers, see the module docstring'''
+
+    def __init__(self):
+        self.table = {}
+
+    def add(self, name, handler, parse=None):
+        '''Register handler for name. Prefix names need a parse function
+        (str, int, word, ints or any callable raising ValueError).'''
+        self.table[name] = (handler, parse)
+
+    def command(self, name, parse=None):
+        '''Decorator form of add()'''
+        def register(handler):
+            self.add(name, handler, parse)
+            return handler
+        return register
+
+    def merged(self, other):
+        '''A new Registry holding both tables, other's entries winning'''
+        registry = Registry()
+        registry.table = dict(self.table)
+        registry.table.update(other.table)
+        return registry
+
+    def dispatch(self, data):
+        '''Run the handler of data and return what it returns, which the
+        servers send back to the client unless it is None. Raises
+        UnknownCommand, or ValueError for a malformed argument.'''
+        entry = self.table.get(data)
+        if entry is not None:
+            handler, parse = entry
+            if parse is None:
+                return handler()
+            return handler(parse(''))
+        match = _SPLIT.match(data)
+        if match is not None:
+            entry = self.table.get(match.group(1))
+            if entry is not None and entry[1] is not None:
+                handler, parse = entry
+                return handler(parse(match.group(2)))
+        raise UnknownCommand('Cannot recognize command: %s' % data)
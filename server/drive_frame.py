@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+'''
+Binary drive frame: the whole driving state of one control tick in one
+fixed-size message, instead of several text commands.
+
+A client asks for it with the text command "proto=bin1"; the server
+answers "ok bin1" and from then on takes frames as well as text
+commands on that connection (see framing.CommandReader). Version 1 is
+24 bytes, little endian:
+
+    u8   magic 0xD5 (never the first byte of a text command)
+    u8   version, 1
+    u16  flags, FLAG_*
+    u32  sequence number
+    f64  client timestamp, seconds
+    u8   throttle, 0..100
+    i8   direction, 1 forward, -1 backward, 0 stopped
+    u8   steering angle, 0..255 as in turn=
+    u8   padding
+    i16  pan, i16 tilt: pulses/s with FLAG_CAM_RATE, pulses with
+         FLAG_CAM_PULSE, ignored without either
+'''
+
+import collections
+import struct
+
+MAGIC = 0xD5
+VERSION = 1
+PROTOCOL = 'bin1'
+
+FLAG_STOP = 0x01        # stop now and abort a motion program, like 'stop'
+FLAG_CAM_RATE = 0x02    # pan/tilt are a velocity, like xy_rate=
+FLAG_CAM_PULSE = 0x04   # pan/tilt are servo pulses
+
+FRAME = struct.Struct('<BBHIdBbBxhh')
+
+DriveFrame = collections.namedtuple(
+    'DriveFrame', 'seq timestamp throttle direction steering pan tilt flags')
+
+
+def pack(frame):
+    return FRAME.pack(MAGIC, VERSION, frame.flags, frame.seq, frame.timestamp, frame.throttle,
+                      frame.direction, frame.steering, frame.pan, frame.tilt)
+
+
+def unpack_from(data, offset=0):
+    '''Return the DriveFrame at data[offset:]. Raises ValueError if it
+    is not a version 1 frame.'''
+    magic, version, flags, seq, timestamp, throttle, direction, steering, pan, tilt = \
+        FRAME.unpack_from(data, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a drive frame version %d: %02X %d' % (VERSION, magic, version))
+    return DriveFrame(seq, timestamp, throttle, direction, steering, pan, tilt, flags)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+Newline framing of the command stream.
+
+TCP does not keep message boundaries, so commands sent back to back
+(forward=60 then turn=128) can arrive in one recv(). Clients end every
+command with '\\n' and CommandReader.feed() returns every complete
+command in a read, keeping a partial one in its buffer for the next.
+
+Older clients send bare commands. Until a reader has seen a newline it
+takes each read as one command, as the servers always did.
+
+After negotiate('bin1') the reader also returns binary drive frames
+(drive_frame.DriveFrame) found between the commands.
+'''
+
+import drive_frame
+
+
+def encode(commands):
+    '''One send()-able string holding the commands, each framed'''
+    return ''.join(command + '\n' for command in commands)
+
+
+class CommandReader(object):
+    '''Incremental parser of one connection's command stream'''
+
+    def __init__(self, max_length=65536):
+        self.max_length = max_length
+        self.framed = False
+        self.binary = False
+        self._buffer = bytearray()
+        self._scanned = 0       # the buffer holds no newline before this
+
+    def negotiate(self, protocol):
+        '''Handle "proto=<protocol>", returns the reply for the client'''
+        if protocol != drive_frame.PROTOCOL:
+            return 'error proto %s\n' % protocol
+        self.binary = True
+        return 'ok %s\n' % protocol
+
+    def feed(self, data):
+        '''Return the list of commands (and drive frames) completed by data'''
+        if not self.framed:
+            if '\n' not in data:
+                return [data]
+            self.framed = True
+        buf = self._buffer
+        buf.extend(data)
+        commands = []
+        begin = 0
+        scanned = self._scanned
+        while begin < len(buf):
+            if self.binary and buf[begin] == drive_frame.MAGIC:
+                end = begin + drive_frame.FRAME.size
+                if end > len(buf):
+                    scanned = 0
+                    break
+                try:
+                    commands.append(drive_frame.unpack_from(buf, begin))
+                except ValueError, e:
+                    print 'Command Error!', e
+                begin = scanned = end
+                continue
+            end = buf.find('\n', max(begin, scanned))
+            if end < 0:
+                scanned = len(buf)
+                break
+            command = str(buf[begin:end]).rstrip('\r')
+            if command:
+                commands.append(command)
+            begin = end + 1
+        del buf[:begin]
+        self._scanned = max(0, scanned - begin)
+        if len(buf) > self.max_length:
+            print 'Command Error! Dropping %d bytes without a newline' % len(buf)
+            del buf[:]
+            self._scanned = 0
+        return commands
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''
+Chooses between the real hardware and the in-memory simulator.
+
+The backend is taken from the PCA9685_BUS environment variable, or else
+from an "i2c_bus = ..." line in the config file:
+
+    smbus   the real I2C bus and RPi.GPIO
+    sim     pca9685_sim.SimulatedBus and sim_gpio
+    daemon  actuatord, which owns the bus and the GPIO (actuator_client.py)
+    auto    daemon if actuatord is running, else smbus (default)
+
+For the simulator, PCA9685_SIM_SPEED / "i2c_speed" sets the modelled bus
+clock in Hz (100000 or 400000) and PCA9685_SIM_LATENCY / "i2c_latency"
+set to True makes every transaction take that long in wall time.
+'''
+
+import os
+
+import settings
+
+_sim_buses = {}
+_auto = None
+
+
+def _setting(env, key, default):
+    value = os.environ.get(env)
+    if value is None:
+        value = str(settings.get(key, default))
+    return value
+
+
+def backend_name():
+    '''The configured backend, with auto resolved once per process'''
+    global _auto
+    name = _setting('PCA9685_BUS', 'i2c_bus', 'auto').lower()
+    if name != 'auto':
+        return name
+    if _auto is None:
+        import actuator_client
+        _auto = 'daemon' if actuator_client.available() else 'smbus'
+    return _auto
+
+
+def simulated():
+    return backend_name() == 'sim'
+
+
+def open_i2c(bus_number, address=0x40, backend=None):
+    '''Return an SMBus-like object for bus_number. Simulated buses are
+    shared per process, so every PWM on the same bus sees the same chips.
+    backend overrides the configured one.'''
+    backend = backend or backend_name()
+    if backend == 'daemon':
+        import actuator_client
+        return actuator_client.open_bus(bus_number, address)
+    if backend != 'sim':
+        import smbus
+        return smbus.SMBus(bus_number)
+    import pca9685_sim
+    if bus_number not in _sim_buses:
+        speed = int(_setting('PCA9685_SIM_SPEED', 'i2c_speed', pca9685_sim.FAST_MODE))
+        latency = _setting('PCA9685_SIM_LATENCY', 'i2c_latency', 'False') in ('True', 'true', '1')
+        _sim_buses[bus_number] = pca9685_sim.SimulatedBus(bus_number, (), speed, latency)
+    bus = _sim_buses[bus_number]
+    bus.add_device(address)
+    return bus
+
+
+def sim_bus(bus_number=1):
+    '''Return the simulated bus created for bus_number, or None'''
+    return _sim_buses.get(bus_number)
+
+
+def gpio(backend=None):
+    '''Return the RPi.GPIO module, or its stand-in for the backend'''
+    backend = backend or backend_name()
+    if backend == 'daemon':
+        import actuator_client
+        return actuator_client.gpio
+    if backend == 'sim':
+        import sim_gpio
+        return sim_gpio
+    import RPi.GPIO as GPIO
+    return GPIO
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+I2C transaction statistics for PCA9685.PWM.
+
+Turn them on with pwm.enable_stats(); pwm.stats is None otherwise and
+the write path only pays for that one check.
+'''
+
+import json
+import threading
+import time
+
+_LED0_ON_L = 0x06
+_LED15_OFF_H = 0x45
+
+# Latency histogram bucket upper bounds in microseconds: 4 buckets per
+# octave from 8 us to ~1 s, plus one overflow bucket.
+BUCKETS = [int(8 * 2 ** (i / 4.0)) for i in range(69)]
+
+
+class BusStats(object):
+    '''Counts, latency histogram and error counters of one PWM'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.transactions = 0
+            self.bytes = 0
+            self.errors = 0
+            self.retries = 0
+            self.max_latency = 0.0
+            self.total_latency = 0.0
+            self.histogram = [0] * (len(BUCKETS) + 1)
+            self.register_writes = {}
+            self.channel_writes = {}
+            self.register_errors = {}
+
+    def record(self, reg, nbytes, seconds, data_bytes=1, write=True):
+        '''Account one successful transaction. nbytes is the number of
+        bytes on the wire, data_bytes the number of registers touched.'''
+        us = seconds * 1e6
+        bucket = 0
+        while bucket < len(BUCKETS) and us > BUCKETS[bucket]:
+            bucket += 1
+        with self._lock:
+            self.transactions += 1
+            self.bytes += nbytes
+            self.total_latency += seconds
+            if seconds > self.max_latency:
+                self.max_latency = seconds
+            self.histogram[bucket] += 1
+            if not write:
+                return
+            self.register_writes[reg] = self.register_writes.get(reg, 0) + 1
+            if _LED0_ON_L <= reg <= _LED15_OFF_H:
+                first = (reg - _LED0_ON_L) / 4
+                last = (reg + data_bytes - 1 - _LED0_ON_L) / 4
+                for channel in range(first, min(last, 15) + 1):
+                    self.channel_writes[channel] = self.channel_writes.get(channel, 0) + 1
+
+    def error(self, reg, retrying):
+        with self._lock:
+            self.errors += 1
+            self.register_errors[reg] = self.register_errors.get(reg, 0) + 1
+            if retrying:
+                self.retries += 1
+
+    def percentile(self, p):
+        '''Latency in seconds below which p percent of the transactions
+        fell, to the resolution of the histogram bucket'''
+        with self._lock:
+            total = sum(self.histogram)
+            if not total:
+                return 0.0
+            rank = total * p / 100.0
+            seen = 0
+            for bucket, count in enumerate(self.histogram):
+                seen += count
+                if seen >= rank and count:
+                    if bucket < len(BUCKETS):
+                        return min(BUCKETS[bucket] / 1e6, self.max_latency)
+                    return self.max_latency
+            return self.max_latency
+
+    def snapshot(self):
+        '''Return every counter as a plain dict'''
+        elapsed = time.time() - self.started
+        p50 = self.percentile(50)
+        p99 = self.percentile(99)
+        with self._lock:
+            return {
+                'elapsed': elapsed,
+                'transactions': self.transactions,
+                'bytes': self.bytes,
+                'bytes_per_second': self.bytes / elapsed if elapsed > 0 else 0.0,
+                'errors': self.errors,
+                'retries': self.retries,
+                'latency': {
+                    'mean': self.total_latency / self.transactions if self.transactions else 0.0,
+                    'p50': p50,
+                    'p99': p99,
+                    'max': self.max_latency,
+                },
+                'histogram_us': dict((str(BUCKETS[i]) if i < len(BUCKETS) else 'inf', n)
+                                     for i, n in enumerate(self.histogram) if n),
+                'register_writes': dict(('0x%02X' % reg, n) for reg, n in self.register_writes.items()),
+                'channel_writes': dict((str(ch), n) for ch, n in self.channel_writes.items()),
+                'register_errors': dict(('0x%02X' % reg, n) for reg, n in self.register_errors.items()),
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), sort_keys=True, **kwargs)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_json(indent=2))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+'''
+Motion programs: timed setpoints uploaded once and run on the car.
+
+A program is a ';' separated list of steps "time:name=value,...", where
+time is seconds from the start of the program and the names are
+
+    throttle    signed speed, -100..100 (negative drives backward)
+    steer       steering angle, 0..255 as in turn=
+    pan, tilt   camera servo pulses
+
+For example, drive 1.5 s at 60% turning right, then stop and sweep the
+camera:
+
+    0:throttle=60,steer=200;1.5:throttle=0,steer=128,pan=200;2.5:pan=700
+
+ProgramRunner plays the steps on CLOCK_MONOTONIC from its own thread,
+so network jitter never reaches the timing. The throttle is always set
+to 0 when a program ends or is aborted, and finish(aborted) is called
+after.
+'''
+
+import threading
+import time
+
+import realtime
+
+LIMITS = {
+    'throttle': (-100, 100),
+    'steer': (0, 255),
+    'pan': (0, 4095),
+    'tilt': (0, 4095),
+}
+
+MAX_STEPS = 1000
+
+
+def parse(text):
+    '''Return the program as a list of (time, {name: value}) steps.
+    Raises ValueError on anything malformed.'''
+    steps = []
+    for item in text.strip().strip(';').split(';'):
+        when, sep, body = item.partition(':')
+        if not sep:
+            raise ValueError('step must be time:name=value,..., not %r' % item)
+        when = float(when)
+        if when < 0 or (steps and when < steps[-1][0]):
+            raise ValueError('step times must be >= 0 and in order, got %s' % when)
+        setpoint = {}
+        for assignment in body.split(','):
+            name, sep, value = assignment.partition('=')
+            name = name.strip()
+            if not sep or name not in LIMITS:
+                raise ValueError('unknown setpoint %r' % assignment)
+            value = int(value)
+            low, high = LIMITS[name]
+            if not low <= value <= high:
+                raise ValueError('%s=%d out of range %d..%d' % (name, value, low, high))
+            setpoint[name] = value
+        steps.append((when, setpoint))
+    if len(steps) > MAX_STEPS:
+        raise ValueError('program has %d steps, at most %d allowed' % (len(steps), MAX_STEPS))
+    return steps
+
+
+class ProgramRunner(object):
+    '''Runs parsed programs by calling apply({name: value}) at each step
+    and finish(aborted), if given, when one ends or is aborted'''
+
+    def __init__(self, apply, finish=None):
+        self.apply = apply
+        self.finish = finish
+        self.program = None
+        self.last_run = None
+        self._thread = None
+        self._abort = threading.Event()
+
+    def load(self, text):
+        '''Parse and keep a program for start(); returns its step count'''
+        self.program = parse(text)
+        return len(self.program)
+
+    def start(self, program=None):
+        self.abort()
+        if program is not None:
+            self.program = program
+        if not self.program:
+            raise ValueError('no program loaded')
+        self._abort.clear()
+        self._thread = threading.Thread(target=self._run, args=(self.program,), name='motion-program')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def abort(self):
+        '''Stop a running program and zero the throttle'''
+        thread = self._thread
+        if thread is None:
+            return False
+        self._abort.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        return True
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _wait_until(self, due):
+        while True:
+            remaining = due - realtime.monotonic()
+            if remaining <= 0:
+                return True
+            if self._abort.is_set():
+                return False
+            time.sleep(min(remaining, 0.01))
+
+    def _run(self, program):
+        start = realtime.monotonic()
+        late = []
+        try:
+            for when, setpoint in program:
+                if not self._wait_until(start + when):
+                    break
+                late.append(realtime.monotonic() - start - when)
+                self.apply(setpoint)
+        finally:
+            self.apply({'throttle': 0})
+            if self.finish is not None:
+                self.finish(self._abort.is_set())
+            self.last_run = {
+                'steps': len(late),
+                'aborted': self._abort.is_set(),
+                'max_late': max(late) if late else 0.0,
+            }
+            self._thread = None
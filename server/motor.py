@@ -1,8 +1,11 @@
 #!/usr/bin/env python
-import RPi.GPIO as GPIO
+import hw_backend
 import PCA9685 as p
+import settings
 import time    # Import necessary modules
 
+GPIO = hw_backend.gpio()      # RPi.GPIO, or sim_gpio when PCA9685_BUS=sim
+
 # ===========================================================================
 # Raspberry Pi pin11, 12, 13 and 15 to realize the clockwise/counterclockwise
 # rotation and forward and backward movements
@@ -21,47 +24,113 @@ EN_M1    = 5  # servo driver IC CH5
 
 pins = [Motor0_A, Motor0_B, Motor1_A, Motor1_B]
 
+def _to_bool(x):
+	'''Accept True/False or the 'True'/'False' strings used by config and cali_server'''
+	if x in (True, 'True'):
+		return True
+	if x in (False, 'False'):
+		return False
+	return None
+
+class Motor(object):
+	'''The two DC motors of the car.
+
+	The forward direction of each motor comes from the forward0/forward1
+	config values (and follows them when the config is reloaded), and
+	the level of every direction pin and the duty of the EN channels are
+	remembered, so a command only touches the pins and channels whose
+	state actually changes. Not with actuatord, where other front ends
+	drive the same pins and channels: there every command is sent.
+	'''
+
+	def __init__(self, busnum=None):
+		self.pwm = p.get_pwm(busnum)   # Shared servo controller, initialized once per process.
+		self.pwm.frequency = 60
+		self.load_directions()
+		self.speed = None
+		self.cache = self.pwm.cache     # off when the PCA9685 is shared
+		self._levels = {}
+		GPIO.setwarnings(False)
+		GPIO.setmode(GPIO.BOARD)        # Number GPIOs by its physical location
+		for pin in pins:
+			GPIO.setup(pin, GPIO.OUT)   # Set all pins' mode as output
+
+	def load_directions(self, changed=None):
+		self.forward0 = settings.get('forward0')
+		self.forward1 = settings.get('forward1', True)
+
+	def _output(self, pin, level):
+		if not self.cache or self._levels.get(pin) != level:
+			GPIO.output(pin, level)
+			self._levels[pin] = level
+
+	def set_speed(self, speed):
+		'''speed is 0..100, scaled to the EN channel duty'''
+		if self.cache and int(round(speed * 40)) == self.speed:
+			return
+		self.pwm.write_many(self.speed_channels(speed))
+		print 'speed is: ', self.speed
+
+	def speed_channels(self, speed):
+		'''Record speed and return its EN channel values as a write_many()
+		frame, for callers that batch them with other channels'''
+		self.speed = int(round(speed * 40))
+		return {EN_M0: (0, self.speed), EN_M1: (0, self.speed)}
+
+	def motor0(self, x):
+		'''Turn motor 0 clockwise if x is True, counterclockwise if False'''
+		if x:
+			self._output(Motor0_A, GPIO.LOW)
+			self._output(Motor0_B, GPIO.HIGH)
+		else:
+			self._output(Motor0_A, GPIO.HIGH)
+			self._output(Motor0_B, GPIO.LOW)
+
+	def motor1(self, x):
+		'''Turn motor 1 clockwise if x is True, counterclockwise if False'''
+		if x:
+			self._output(Motor1_A, GPIO.LOW)
+			self._output(Motor1_B, GPIO.HIGH)
+		else:
+			self._output(Motor1_A, GPIO.HIGH)
+			self._output(Motor1_B, GPIO.LOW)
+
+	def forward(self, speed=None):
+		if speed is not None:
+			self.set_speed(speed)
+		self.motor0(self.forward0)
+		self.motor1(self.forward1)
+
+	def backward(self, speed=None):
+		if speed is not None:
+			self.set_speed(speed)
+		self.motor0(not self.forward0)
+		self.motor1(not self.forward1)
+
+	def stop(self):
+		for pin in pins:
+			self._output(pin, GPIO.LOW)
+
+# ===========================================================================
+# Module level interface, kept for tcp_server, cali_server and the tests
+# below. They all act on the Motor created by setup().
+# ===========================================================================
+motor = None
+
 # ===========================================================================
 # Adjust the duty cycle of the square waves output from channel 4 and 5 of
 # the servo driver IC, so as to control the speed of the car.
 # ===========================================================================
 def setSpeed(speed):
-	speed *= 40
-	print 'speed is: ', speed
-	pwm.write(EN_M0, 0, speed)
-	pwm.write(EN_M1, 0, speed)
+	motor.set_speed(speed)
 
 def setup(busnum=None):
-	global forward0, forward1, backward1, backward0
-	global pwm
-	if busnum == None:
-		pwm = p.PWM()                  # Initialize the servo controller.
-	else:
-		pwm = p.PWM(bus_number=busnum) # Initialize the servo controller.
-
-	pwm.frequency = 60
-	forward0 = 'True'
-	forward1 = 'True'
-	GPIO.setwarnings(False)
-	GPIO.setmode(GPIO.BOARD)        # Number GPIOs by its physical location
-	try:
-		for line in open("config"):
-			if line[0:8] == "forward0":
-				forward0 = line[11:-1]
-			if line[0:8] == "forward1":
-				forward1 = line[11:-1]
-	except:
-		pass
-	if forward0 == 'True':
-		backward0 = 'False'
-	elif forward0 == 'False':
-		backward0 = 'True'
-	if forward1 == 'True':
-		backward1 = 'False'
-	elif forward1 == 'False':
-		backward1 = 'True'
-	for pin in pins:
-		GPIO.setup(pin, GPIO.OUT)   # Set all pins' mode as output
+	global motor, pwm
+	if motor is not None:
+		settings.unsubscribe(motor.load_directions)
+	motor = Motor(busnum)
+	settings.subscribe(motor.load_directions)    # once, for the Motor in use
+	pwm = motor.pwm
 
 # ===========================================================================
 # Control the DC motor to make it rotate clockwise, so the car will 
@@ -69,44 +138,31 @@ def setup(busnum=None):
 # ===========================================================================
 
 def motor0(x):
-	if x == 'True':
-		GPIO.output(Motor0_A, GPIO.LOW)
-		GPIO.output(Motor0_B, GPIO.HIGH)
-	elif x == 'False':
-		GPIO.output(Motor0_A, GPIO.HIGH)
-		GPIO.output(Motor0_B, GPIO.LOW)
-	else:
+	x = _to_bool(x)
+	if x is None:
 		print 'Config Error'
+	else:
+		motor.motor0(x)
 
 def motor1(x):
-	if x == 'True':
-		GPIO.output(Motor1_A, GPIO.LOW)
-		GPIO.output(Motor1_B, GPIO.HIGH)
-	elif x == 'False':
-		GPIO.output(Motor1_A, GPIO.HIGH)
-		GPIO.output(Motor1_B, GPIO.LOW)
+	x = _to_bool(x)
+	if x is not None:
+		motor.motor1(x)
 
 def forward():
-	motor0(forward0)
-	motor1(forward1)
+	motor.forward()
 
 def backward():
-	motor0(backward0)
-	motor1(backward1)
+	motor.backward()
 
 def forwardWithSpeed(spd = 50):
-	setSpeed(spd)
-	motor0(forward0)
-	motor1(forward1)
+	motor.forward(spd)
 
 def backwardWithSpeed(spd = 50):
-	setSpeed(spd)
-	motor0(backward0)
-	motor1(backward1)
+	motor.backward(spd)
 
 def stop():
-	for pin in pins:
-		GPIO.output(pin, GPIO.LOW)
+	motor.stop()
 
 # ===========================================================================
 # The first parameter(status) is to control the state of the car, to make it 
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+'''
+In-memory PCA9685 register file behind an SMBus-like interface.
+
+SimulatedBus has the write_byte_data / write_i2c_block_data /
+read_byte_data methods PCA9685.PWM uses, so the server modules can run
+and be benchmarked on a machine without an I2C bus. Every chip on the
+bus is a SimulatedPCA9685 that honours MODE1 AI (auto-increment), the
+ALL_LED registers, the SLEEP-only PRESCALE write and the ALLCALL address.
+'''
+
+import errno
+import time
+
+STANDARD_MODE = 100000
+FAST_MODE = 400000
+
+_ALLCALL_ADDRESS = 0x70
+
+
+class SimulatedPCA9685(object):
+    '''Register file of one PCA9685'''
+    _MODE1          = 0x00
+    _PRESCALE       = 0xFE
+    _LED0_ON_L      = 0x06
+    _LAST_LED_REG   = 0x45
+    _ALL_LED_ON_L   = 0xFA
+    _ALL_LED_OFF_H  = 0xFD
+
+    _RESTART        = 0x80
+    _AI             = 0x20
+    _SLEEP          = 0x10
+    _ALLCALL        = 0x01
+
+    def __init__(self, address=0x40):
+        self.address = address
+        self.registers = bytearray(256)
+        self.reset()
+
+    def reset(self):
+        '''Power-on register values'''
+        self.registers[:] = bytearray(256)
+        self.registers[0x00] = 0x11     # MODE1: SLEEP | ALLCALL
+        self.registers[0x01] = 0x04     # MODE2: OUTDRV
+        self.registers[0x02] = 0xE2
+        self.registers[0x03] = 0xE4
+        self.registers[0x04] = 0xE8
+        self.registers[0x05] = 0xE0
+        self.registers[self._PRESCALE] = 0x1E
+
+    @property
+    def auto_increment(self):
+        return bool(self.registers[self._MODE1] & self._AI)
+
+    @property
+    def allcall(self):
+        return bool(self.registers[self._MODE1] & self._ALLCALL)
+
+    def _next_register(self, reg):
+        if not self.auto_increment:
+            return reg
+        if reg == self._LAST_LED_REG:
+            return 0x00
+        return (reg + 1) & 0xFF
+
+    def _store(self, reg, value):
+        if reg == self._PRESCALE and not self.registers[self._MODE1] & self._SLEEP:
+            return                      # ignored unless the oscillator sleeps
+        if reg == self._MODE1:
+            value &= ~self._RESTART     # self-clearing
+        if self._ALL_LED_ON_L <= reg <= self._ALL_LED_OFF_H:
+            offset = reg - self._ALL_LED_ON_L
+            for channel in range(16):
+                self.registers[self._LED0_ON_L + 4*channel + offset] = value
+            return
+        self.registers[reg] = value
+
+    def write(self, reg, values):
+        '''Write values starting at reg, as one I2C transaction would'''
+        for value in values:
+            self._store(reg, value & 0xFF)
+            reg = self._next_register(reg)
+
+    def read(self, reg):
+        if self._ALL_LED_ON_L <= reg <= self._ALL_LED_OFF_H:
+            return 0
+        return self.registers[reg]
+
+    def channel(self, channel):
+        '''Return the (on, off) values of a channel'''
+        reg = self._LED0_ON_L + 4*channel
+        r = self.registers
+        return (r[reg] | r[reg+1] << 8, r[reg+2] | r[reg+3] << 8)
+
+    @property
+    def prescale(self):
+        return self.registers[self._PRESCALE]
+
+
+class SimulatedBus(object):
+    '''SMBus stand-in holding any number of SimulatedPCA9685 chips.
+
+    speed is the bus clock in Hz. With latency on, every transaction
+    sleeps for as long as it would hold a real bus at that clock.
+    Every function in listeners is called as listener(address, reg,
+    values) after each write, e.g. by vehicle_sim.
+    '''
+    def __init__(self, bus_number=1, addresses=(0x40,), speed=FAST_MODE, latency=False):
+        self.bus_number = bus_number
+        self.speed = speed
+        self.latency = latency
+        self.devices = {}
+        self.listeners = []
+        for address in addresses:
+            self.add_device(address)
+        self.reset_counters()
+
+    def add_device(self, address):
+        if address not in self.devices:
+            self.devices[address] = SimulatedPCA9685(address)
+        return self.devices[address]
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_time = 0.0
+
+    def _targets(self, address):
+        if address in self.devices:
+            return [self.devices[address]]
+        if address == _ALLCALL_ADDRESS:
+            targets = [d for d in self.devices.values() if d.allcall]
+            if targets:
+                return targets
+        raise IOError(errno.EREMOTEIO, 'Remote I/O error')
+
+    def _account(self, nbytes):
+        # START + nbytes * (8 bits + ACK) + STOP
+        seconds = (nbytes * 9 + 2) / float(self.speed)
+        self.transactions += 1
+        self.bytes += nbytes
+        self.bus_time += seconds
+        if self.latency:
+            time.sleep(seconds)
+
+    def write_byte_data(self, address, reg, value):
+        for device in self._targets(address):
+            device.write(reg, [value])
+        self._account(3)
+        for listener in self.listeners:
+            listener(address, reg, [value])
+
+    def write_i2c_block_data(self, address, reg, values):
+        if len(values) > 32:
+            raise IOError(errno.EINVAL, 'Invalid argument')
+        for device in self._targets(address):
+            device.write(reg, values)
+        self._account(2 + len(values))
+        for listener in self.listeners:
+            listener(address, reg, values)
+
+    def read_byte_data(self, address, reg):
+        value = self._targets(address)[0].read(reg)
+        # write address + register, repeated START, read address + data
+        self._account(4)
+        return value
+
+    def stats(self):
+        return {
+            'transactions': self.transactions,
+            'bytes': self.bytes,
+            'bus_time': self.bus_time,
+        }
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+'''
+Raspberry Pi board revision and I2C bus discovery.
+
+The revision is read from /proc/cpuinfo once per process and looked up
+in REVISIONS. The resulting bus number is saved in a small cache file
+(CACHE_FILE, or $PCA9685_BUS_CACHE) together with the revision, so
+later launches on the same board skip discovery entirely. Unknown
+boards fall back to the /dev/i2c-* devices that exist and then to the
+"busnum" line of the config file, instead of exiting.
+'''
+
+import glob
+import json
+import os
+
+import settings
+
+# Courtesy quick2wire-python-api
+# https://github.com/quick2wire/quick2wire-python-api
+# Updated revision info from: http://elinux.org/RPi_HardwareHistory#Board_Revision_History
+REVISIONS = {
+    '900092': ('0', 0),
+    'Beta':   ('1 Module B', 0),
+    '0002':   ('1 Module B', 0),
+    '0003':   ('1 Module B', 0),
+    '0004':   ('1 Module B', 0),
+    '0005':   ('1 Module B', 0),
+    '0006':   ('1 Module B', 0),
+    '000d':   ('1 Module B', 0),
+    '000e':   ('1 Module B', 0),
+    '000f':   ('1 Module B', 0),
+    '0007':   ('1 Module A', 0),
+    '0008':   ('1 Module A', 0),
+    '0009':   ('1 Module A', 0),
+    '0010':   ('1 Module B+', 1),
+    '0013':   ('1 Module B+', 1),
+    '0012':   ('1 Module A+', 0),
+    'a01041': ('2 Module B', 1),
+    'a21041': ('2 Module B', 1),
+    'a02082': ('3 Module B', 1),
+    'a22082': ('3 Module B', 1),
+    'a020d3': ('3 Module B+', 1),
+}
+
+_NEW_STYLE = 0x800000       # bit 23: new-style revision code, every such board uses bus 1
+_OVERVOLTAGE = 0x1000000    # warranty bit that prefixes old-style codes
+
+CACHE_FILE = os.path.expanduser('~/.cache/rpi_car_i2c.json')
+
+_revision = False           # False: not read yet, None: not a Pi
+_bus_number = None
+
+
+def revision():
+    '''Return the raw revision code from /proc/cpuinfo, or None'''
+    global _revision
+    if _revision is False:
+        _revision = None
+        try:
+            for line in open('/proc/cpuinfo'):
+                name, sep, value = line.partition(':')
+                if sep and name.strip() == 'Revision':
+                    _revision = value.strip()
+                    break
+        except IOError:
+            pass
+    return _revision
+
+
+def _lookup(code):
+    if code is None:
+        return None
+    if code in REVISIONS:
+        return REVISIONS[code]
+    try:
+        value = int(code, 16)
+    except ValueError:
+        return None
+    if value & _NEW_STYLE:
+        return ('new style %s' % code, 1)
+    if value & _OVERVOLTAGE:
+        return REVISIONS.get('%04x' % (value & 0xFFFF))
+    return None
+
+
+def pi_revision():
+    '''Return the board name, e.g. "3 Module B", or None if unknown'''
+    board = _lookup(revision())
+    if board is None:
+        return None
+    return board[0]
+
+
+def i2c_buses():
+    '''Return the numbers of the /dev/i2c-* devices that exist'''
+    buses = []
+    for path in glob.glob('/dev/i2c-*'):
+        try:
+            buses.append(int(path[len('/dev/i2c-'):]))
+        except ValueError:
+            pass
+    return sorted(buses)
+
+
+def _cache_file():
+    return os.environ.get('PCA9685_BUS_CACHE', CACHE_FILE)
+
+
+def _load_cache():
+    try:
+        with open(_cache_file()) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if cached.get('revision') != revision():
+        return None
+    if not os.path.exists('/dev/i2c-%d' % cached.get('bus', -1)):
+        return None
+    return cached['bus']
+
+
+def _save_cache(bus_number):
+    path = _cache_file()
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'revision': revision(), 'bus': bus_number}, f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def _discover(default):
+    buses = i2c_buses()
+    board = _lookup(revision())
+    if board is not None and (not buses or board[1] in buses):
+        return board[1], True
+    if board is None and revision() is not None:
+        print "Pi revision %s not recognized, probing /dev/i2c-*" % revision()
+    if buses:
+        return buses[0], True
+    configured = settings.get('busnum')
+    if configured is not None:
+        return int(configured), False
+    print "No I2C bus found, using bus %d. Use 'sudo raspi-config' to enable I2C" % default
+    return default, False
+
+
+def get_bus_number(default=1):
+    '''Return the I2C bus the PCA9685 sits on, discovering it at most
+    once per process and once per board'''
+    global _bus_number
+    if _bus_number is None:
+        bus_number = _load_cache()
+        if bus_number is None:
+            bus_number, found = _discover(default)
+            if found:
+                _save_cache(bus_number)
+        _bus_number = bus_number
+    return _bus_number
+
+
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+
+
+def cpu_temp():
+    '''Return the SoC temperature in degrees Celsius. Raises IOError
+    where there is no thermal zone, e.g. off the Pi.'''
+    with open(THERMAL_ZONE) as f:
+        return int(f.read().strip()) / 1000.0
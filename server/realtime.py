@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+'''
+Real-time scheduling for the calling thread, where the OS permits it.
+
+make_realtime() asks for SCHED_FIFO, pins the thread to the given CPUs
+and locks the process memory. Each step that is not permitted (no root,
+no CAP_SYS_NICE, not Linux) is skipped with a note in the returned
+report instead of raising, so callers can always use it.
+'''
+
+import ctypes
+import ctypes.util
+import os
+import time
+
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+CLOCK_MONOTONIC = 1
+
+_libc = None
+
+
+def _lib():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        if name is None:
+            raise OSError('libc not found')
+        _libc = ctypes.CDLL(name, use_errno=True)
+    return _libc
+
+
+class _SchedParam(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def monotonic():
+    '''Seconds from CLOCK_MONOTONIC, which wall clock changes do not move'''
+    if hasattr(time, 'monotonic'):
+        return time.monotonic()
+    ts = _Timespec()
+    try:
+        _check(_lib().clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)))
+    except OSError:
+        return time.time()
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
+def _check(result):
+    if result != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def set_fifo(priority):
+    '''SCHED_FIFO at priority for the calling thread'''
+    if hasattr(os, 'sched_setscheduler'):
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return
+    _check(_lib().sched_setscheduler(0, SCHED_FIFO, ctypes.byref(_SchedParam(priority))))
+
+
+def set_affinity(cpus):
+    '''Restrict the calling thread to the CPU numbers in cpus'''
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    cpu_set = (ctypes.c_ulong * (1024 / bits))()    # cpu_set_t holds 1024 CPUs
+    for cpu in cpus:
+        cpu_set[cpu / bits] |= 1 << (cpu % bits)
+    _check(_lib().sched_setaffinity(0, ctypes.sizeof(cpu_set), ctypes.byref(cpu_set)))
+
+
+def lock_memory():
+    '''mlockall() so page faults cannot stall the loop'''
+    _check(_lib().mlockall(MCL_CURRENT | MCL_FUTURE))
+
+
+def make_realtime(priority=50, cpus=None, memory=True):
+    '''Apply what is permitted and return {step: 'ok' or the error}'''
+    report = {}
+    steps = [('sched_fifo', lambda: set_fifo(priority))]
+    if cpus:
+        steps.append(('affinity', lambda: set_affinity(cpus)))
+    if memory:
+        steps.append(('mlockall', lock_memory))
+    for name, step in steps:
+        try:
+            step()
+            report[name] = 'ok'
+        except (OSError, AttributeError), e:
+            report[name] = str(e)
+    return report
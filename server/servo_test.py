@@ -7,14 +7,11 @@ MaxPulse = 700
 
 def setup():
     global pwm
-    pwm = servo.PWM()
+    pwm = servo.get_pwm()
 
-def servo_test():
-    for value in range(MinPulse, MaxPulse):
-        pwm.write(0, 0, value)
-        pwm.write(14, 0, value)
-        pwm.write(15, 0, value)
-        time.sleep(0.002)
+def servo_test(rate_hz=500):
+    report = pwm.play([0, 14, 15], range(MinPulse, MaxPulse), rate_hz)
+    print 'Played %(samples)d steps at %(rate).1f Hz (%(late)d late), timing error mean %(mean_error).6f s, max %(max_error).6f s' % report
 
 if __name__ == '__main__':
     setup()
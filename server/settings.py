@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+'''
+The server configuration file, parsed once and shared by every module.
+
+The file holds "name = value" lines. Values are converted to the type of
+the matching entry in DEFAULTS, or else to bool/int/float when they look
+like one. The file is re-read only when its mtime changes: call check()
+or start watch() and every function registered with subscribe() is
+called with the names of the values that changed, so offsets edited on
+disk apply without a restart. save() replaces the file atomically, so a
+crash or power cut mid-write leaves either the old or the new values.
+'''
+
+import os
+import threading
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+DEFAULTS = {
+    'offset_x': 0,      # pan servo offset from the center pulse
+    'offset_y': 0,      # tilt servo offset from the center pulse
+    'offset': 0,        # steering servo offset from the center pulse
+    'forward0': True,   # direction of motor 0 that drives the car forward
+    # forward1 has no common default: motor.py drives with True and the
+    # calibration starts from False when the file does not set it, as they
+    # always did. Each passes its own to get().
+}
+
+
+def _parse(text, default=None):
+    text = text.strip()
+    if isinstance(default, bool) or text in ('True', 'False'):
+        if text in ('True', 'False'):
+            return text == 'True'
+        raise ValueError('expected True or False, not %r' % text)
+    if isinstance(default, (int, float)):
+        return type(default)(text)
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+class Config(object):
+    '''Typed view of one configuration file'''
+
+    def __init__(self, path=CONFIG_FILE, defaults=DEFAULTS):
+        self.path = path
+        self.defaults = dict(defaults)
+        self.values = dict(defaults)
+        self.mtime = None
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._watcher = None
+        self.check()
+
+    def _read(self):
+        values = dict(self.defaults)
+        try:
+            f = open(self.path)
+        except IOError:
+            return values
+        with f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                name, sep, text = line.partition('=')
+                name = name.strip()
+                if not sep or not name:
+                    print 'config line %d ignored: %r' % (number, line)
+                    continue
+                try:
+                    values[name] = _parse(text, self.defaults.get(name))
+                except ValueError, e:
+                    print 'config line %d ignored: %s' % (number, e)
+        return values
+
+    def check(self):
+        '''Re-read the file if its mtime changed. Returns the names of the
+        values that changed and notifies the subscribers about them.'''
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime == self.mtime and self.mtime is not None:
+                return []
+            self.mtime = mtime
+            values = self._read()
+            changed = sorted(name for name in set(values) | set(self.values)
+                             if values.get(name) != self.values.get(name))
+            self.values = values
+        if changed:
+            self._notify(changed)
+        return changed
+
+    def save(self, values):
+        '''Set {name: value} in the file, keeping its other lines, then
+        reload it. The new file is written next to the old one, synced and
+        renamed over it. Returns the names of the values that changed.'''
+        with self._lock:
+            try:
+                with open(self.path) as f:
+                    lines = f.readlines()
+            except IOError:
+                lines = []
+            pending = dict((name, value) for name, value in values.items() if value is not None)
+            out = []
+            for line in lines:
+                name, sep, text = line.partition('=')
+                name = name.strip()
+                if sep and not name.startswith('#') and name in pending:
+                    line = '%s = %s\n' % (name, pending.pop(name))
+                elif not line.endswith('\n'):
+                    line += '\n'
+                out.append(line)
+            for name in sorted(pending):
+                out.append('%s = %s\n' % (name, pending[name]))
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.writelines(out)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+            self.mtime = None       # reload even if the mtime did not move
+        return self.check()
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def subscribe(self, callback):
+        '''Call callback(changed_names) after every reload that changed values'''
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _notify(self, changed):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(changed)
+
+    def watch(self, interval=1.0):
+        '''Poll the file mtime from a daemon thread every interval seconds'''
+        if self._watcher is not None:
+            return
+        stop = threading.Event()
+        def loop():
+            while not stop.wait(interval):
+                self.check()
+        self._watcher = threading.Thread(target=loop, name='config-watch')
+        self._watcher.daemon = True
+        self._watcher.stop = stop
+        self._watcher.start()
+
+    def stop_watch(self):
+        if self._watcher is not None:
+            self._watcher.stop.set()
+            self._watcher = None
+
+
+config = Config()
+
+def get(name, default=None):
+    '''Return a value of the server config file'''
+    return config.get(name, default)
+
+def subscribe(callback):
+    config.subscribe(callback)
+
+def unsubscribe(callback):
+    config.unsubscribe(callback)
+
+def check():
+    return config.check()
+
+def save(values):
+    return config.save(values)
+
+def watch(interval=1.0):
+    config.watch(interval)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+'''
+Drive motor, car_dir and video_dir against the simulated PCA9685 and
+report command rate and I2C traffic per command. With --dispatch, time
+tcp_server's command registry instead: text commands parsed and run per
+second, alone and behind the newline framing, and the same driving state
+sent as binary drive frames.
+
+    PCA9685_BUS=sim python sim_bench.py [commands] [--latency] [--speed 100000] [--dispatch]
+'''
+
+import os
+import sys
+import time
+
+os.environ['PCA9685_BUS'] = 'sim'
+
+import hw_backend
+import motor
+import car_dir
+import video_dir
+
+busnum = 1
+
+
+def run(count):
+    video_dir.setup(busnum=busnum)
+    car_dir.setup(busnum=busnum)
+    motor.setup(busnum=busnum)
+    video_dir.home_x_y()
+    car_dir.home()
+    bus = hw_backend.sim_bus(busnum)
+    print 'setup: %(transactions)d transactions, %(bytes)d bytes' % bus.stats()
+    bus.reset_counters()
+
+    start = time.time()
+    for i in range(count):
+        motor.forwardWithSpeed(i % 100)
+        car_dir.turn(i % 256)
+        if i % 2:
+            video_dir.move_increase_x()
+        else:
+            video_dir.move_decrease_y()
+    elapsed = time.time() - start
+
+    stats = bus.stats()
+    print '%d commands in %.3f s (%.0f commands/s)' % (count, elapsed, count / elapsed)
+    print '%d transactions, %d bytes, %.1f ms modelled bus time' % (
+        stats['transactions'], stats['bytes'], stats['bus_time'] * 1000)
+    print '%.2f transactions, %.1f bytes per command' % (
+        stats['transactions'] / float(count), stats['bytes'] / float(count))
+
+
+DISPATCH_MIX = ['turn=%d' % (i * 37 % 256) for i in range(8)] + [
+    'forward=60', 'backward=40', 'speed70', 'xy_rate=300,-150', 'xy_rate=0,0', 'home', 'stop']
+
+
+def run_dispatch(count):
+    import drive_frame
+    import framing
+    import tcp_server       # sets the car up on the simulator, without serving
+    commands = [DISPATCH_MIX[i % len(DISPATCH_MIX)] for i in range(count)]
+    stream = framing.encode(commands)
+    # one tick of driving: throttle, steering and camera rate
+    ticks = [['forward=%d' % (i % 100), 'turn=%d' % (i % 256), 'xy_rate=%d,0' % (i % 7 * 100)]
+             for i in range(count / 3)]
+    text_ticks = framing.encode(sum(ticks, []))
+    frame_ticks = ''.join(drive_frame.pack(drive_frame.DriveFrame(
+        i, 0.0, i % 100, 1, i % 256, i % 7 * 100, 0, drive_frame.FLAG_CAM_RATE)) for i in range(len(ticks)))
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')      # the handlers log every command
+    try:
+        start = time.time()
+        for command in commands:
+            tcp_server.registry.dispatch(command)
+        dispatched = time.time() - start
+
+        reader = framing.CommandReader()
+        start = time.time()
+        for offset in range(0, len(stream), tcp_server.BUFSIZ):
+            for command in reader.feed(stream[offset:offset + tcp_server.BUFSIZ]):
+                tcp_server.registry.dispatch(command)
+        framed = time.time() - start
+
+        def run_stream(stream, reader):
+            start = time.time()
+            for offset in range(0, len(stream), tcp_server.BUFSIZ):
+                for item in reader.feed(stream[offset:offset + tcp_server.BUFSIZ]):
+                    if isinstance(item, drive_frame.DriveFrame):
+                        tcp_server.apply_frame(item)
+                    else:
+                        tcp_server.registry.dispatch(item)
+            return time.time() - start
+        reader = framing.CommandReader()
+        reader.negotiate(drive_frame.PROTOCOL)
+        text_elapsed = run_stream(text_ticks, reader)
+        frame_elapsed = run_stream(frame_ticks, reader)
+    finally:
+        sys.stdout = stdout
+        tcp_server.loop.stop()
+        tcp_server.video_dir.set_velocity(0, 0)
+        time.sleep(0.2)     # let the pan/tilt thread come to rest before exit
+    print '%d commands, %d names in the registry' % (count, len(tcp_server.registry.table))
+    print 'dispatch:           %.3f s (%.0f commands/s)' % (dispatched, count / dispatched)
+    print 'framing + dispatch: %.3f s (%.0f commands/s)' % (framed, count / framed)
+    print '%d drive ticks as text:   %.3f s (%.0f ticks/s), %.1f bytes/tick' % (
+        len(ticks), text_elapsed, len(ticks) / text_elapsed, len(text_ticks) / float(len(ticks)))
+    print '%d drive ticks as frames: %.3f s (%.0f ticks/s), %d bytes/tick' % (
+        len(ticks), frame_elapsed, len(ticks) / frame_elapsed, drive_frame.FRAME.size)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--latency' in args:
+        args.remove('--latency')
+        os.environ['PCA9685_SIM_LATENCY'] = 'True'
+    if '--speed' in args:
+        i = args.index('--speed')
+        os.environ['PCA9685_SIM_SPEED'] = args[i+1]
+        del args[i:i+2]
+    if '--dispatch' in args:
+        args.remove('--dispatch')
+        run_dispatch(int(args[0]) if args else 100000)
+    else:
+        run(int(args[0]) if args else 1000)
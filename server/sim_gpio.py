@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''
+Stand-in for RPi.GPIO used with the simulated backend.
+
+Only the calls the server makes are provided. Pin levels are kept in
+`pins` and every output() call is counted in `writes`.
+'''
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+pins = {}
+modes = {}
+writes = 0
+_mode = None
+
+
+def setwarnings(flag):
+    pass
+
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def getmode():
+    return _mode
+
+
+def setup(channel, direction, initial=LOW):
+    modes[channel] = direction
+    if direction == OUT:
+        pins[channel] = initial
+
+
+def output(channel, value):
+    global writes
+    if modes.get(channel) != OUT:
+        raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+    writes += 1
+    pins[channel] = HIGH if value else LOW
+
+
+def input(channel):
+    return pins.get(channel, LOW)
+
+
+def cleanup():
+    pins.clear()
+    modes.clear()
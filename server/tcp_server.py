@@ -1,125 +1,414 @@
 #!/usr/bin/env python
-import RPi.GPIO as GPIO
 import video_dir
 import car_dir
 import motor
 from socket import *
 from time import ctime          # Import necessary modules   
+import time
+import json
+import PCA9685
+import hw_backend
+import pi_board
+import settings
+import actuator_loop
+import motion
+import calibration
+import framing
+import dispatch
+import drive_frame
+import udp_drive
+import connections
 
 ctrl_cmd = ['forward', 'backward', 'left', 'right', 'stop', 'read cpu_temp', 'home', 'distance', 'x+', 'x-', 'y+', 'y-', 'xy_home']
 
 busnum = 1          # Edit busnum to 0, if you uses Raspberry Pi 1 or 0
+ASYNC_PWM = True    # Without the control loop, write to the PCA9685 from a background thread so slow I2C never stalls recv()
+I2C_STATS = False   # Collect I2C latency/error statistics, sent back by the 'i2c_stats' command
+CONTROL_TICK_HZ = 100   # Apply drive/steering through actuator_loop at this rate, 0 applies commands on arrival
+CONTROL_REALTIME = None # Run the control loop SCHED_FIFO with locked memory where permitted: True, False or None for real hardware only
+CONTROL_CPUS = None     # e.g. [3] to keep the control loop off the cores the camera streamer uses
+UDP_PORT = 21568        # Drive frames over UDP from connected clients (see udp_drive.py), 0 turns it off
+UDP_MAX_AGE = 0.1       # Drop UDP drive frames that took this many seconds longer than the quickest
+IDLE_TIMEOUT = 60.0     # Close newline-framing client connections that send nothing for this many seconds
+DRIVER_HOSTS = ()       # Addresses whose 'role=driver' takes driving over without the driver's token
 
 HOST = ''           # The variable of HOST is null, so the function bind( ) can be bound to all valid addresses.
 PORT = 21567
 BUFSIZ = 1024       # Size of the buffer
 ADDR = (HOST, PORT)
 
-tcpSerSock = socket(AF_INET, SOCK_STREAM)    # Create a socket.
-tcpSerSock.bind(ADDR)    # Bind the IP address and port number of the server. 
-tcpSerSock.listen(5)     # The parameter of listen() defines the number of connections permitted at one time. Once the 
-                         # connections are full, others will be rejected. 
-
+setup_start = time.time()
 video_dir.setup(busnum=busnum)
 car_dir.setup(busnum=busnum)
 motor.setup(busnum=busnum)     # Initialize the Raspberry Pi GPIO connected to the DC motor. 
 video_dir.home_x_y()
 car_dir.home()
+for pwm in PCA9685.devices():
+    print 'PCA9685 0x%02X on bus %d initialized in %.1f ms' % (pwm.address, pwm.bus_number, pwm.init_time * 1000)
+print 'Hardware setup took %.1f ms' % ((time.time() - setup_start) * 1000)
+if ASYNC_PWM and not CONTROL_TICK_HZ:
+    # The control loop already keeps I2C off the network thread, and its
+    # frames must reach the bus from its own (real-time) thread
+    for pwm in PCA9685.devices():
+        pwm.start_async()
+if I2C_STATS:
+    for pwm in PCA9685.devices():
+        pwm.enable_stats()
+settings.watch()   # Apply config edits (offsets, motor directions) without a restart
+
+loop = None
+cruise = 0          # Speed of the bare 'forward'/'backward' commands: the last speedNN, forward=NN or backward=NN,
+                    # like the EN duty they used to leave behind (0 after reset)
+if CONTROL_TICK_HZ:
+    realtime = CONTROL_REALTIME
+    if realtime is None:
+        realtime = not hw_backend.simulated()
+    loop = actuator_loop.ControlLoop(tick_hz=CONTROL_TICK_HZ, realtime=realtime, cpus=CONTROL_CPUS)
+    loop.set_steer(car_dir.homePWM)
+    loop.start()
+
+def drive(speed):
+	'''Signed speed, negative drives backward'''
+	if loop is not None:
+		loop.set_throttle(speed)
+	elif speed >= 0:
+		motor.forwardWithSpeed(speed)
+	else:
+		motor.backwardWithSpeed(-speed)
 
-try:
-    while True:
-	print 'Waiting for connection...'
-	# Waiting for connection. Once receiving a connection, the function accept() returns a separate 
-	# client socket for the subsequent communication. By default, the function accept() is a blocking 
-	# one, which means it is suspended before the connection comes.
-	tcpCliSock, addr = tcpSerSock.accept() 
-	print '...connected from :', addr     # Print the IP address of the client connected with the server.
-
-	while True:
-		data = ''
-		data = tcpCliSock.recv(BUFSIZ)    # Receive data sent from the client. 
-		# Analyze the command received and control the car accordingly.
-		if not data:
-			break
-		if data == ctrl_cmd[0]:
-			print 'motor moving forward'
-			motor.forward()
-		elif data == ctrl_cmd[1]:
-			print 'recv backward cmd'
-			motor.backward()
-		elif data == ctrl_cmd[2]:
-			print 'recv left cmd'
-			car_dir.turn_left()
-		elif data == ctrl_cmd[3]:
-			print 'recv right cmd'
-			car_dir.turn_right()
-		elif data == ctrl_cmd[6]:
-			print 'recv home cmd'
-			car_dir.home()
-		elif data == ctrl_cmd[4]:
-			print 'recv stop cmd'
-			motor.ctrl(0)
-		elif data == ctrl_cmd[5]:
-			print 'read cpu temp...'
-			temp = cpu_temp.read()
-			tcpCliSock.send('[%s] %0.2f' % (ctime(), temp))
-		elif data == ctrl_cmd[8]:
-			print 'recv x+ cmd'
-			video_dir.move_increase_x()
-		elif data == ctrl_cmd[9]:
-			print 'recv x- cmd'
-			video_dir.move_decrease_x()
-		elif data == ctrl_cmd[10]:
-			print 'recv y+ cmd'
-			video_dir.move_increase_y()
-		elif data == ctrl_cmd[11]:
-			print 'recv y- cmd'
-			video_dir.move_decrease_y()
-		elif data == ctrl_cmd[12]:
-			print 'home_x_y'
-			video_dir.home_x_y()
-		elif data[0:5] == 'speed':     # Change the speed
-			print data
-			numLen = len(data) - len('speed')
-			if numLen == 1 or numLen == 2 or numLen == 3:
-				tmp = data[-numLen:]
-				print 'tmp(str) = %s' % tmp
-				spd = int(tmp)
-				print 'spd(int) = %d' % spd
-				if spd < 24:
-					spd = 24
-				motor.setSpeed(spd)
-		elif data[0:5] == 'turn=':	#Turning Angle
-			print 'data =', data
-			angle = data.split('=')[1]
-			try:
-				angle = int(angle)
-				car_dir.turn(angle)
-			except:
-				print 'Error: angle =', angle
-		elif data[0:8] == 'forward=':
-			print 'data =', data
-			spd = data[8:]
-			try:
-				spd = int(spd)
-				motor.forwardWithSpeed(spd)
-			except:
-				print 'Error speed =', spd
-                elif data[0:9] == 'backward=':
-                        print 'data =', data
-                        spd = data.split('=')[1]
-			try:
-				spd = int(spd)
-	                        motor.backwardWithSpeed(spd)
-			except:
-				print 'ERROR, speed =', spd
+def steer(pulse, direct):
+	'''Steer to pulse through the control loop, or call direct() without one'''
+	if loop is not None:
+		loop.set_steer(pulse)
+	else:
+		direct()
 
+def apply_setpoint(setpoint):
+	'''Apply one motion program step, see motion.py'''
+	if 'throttle' in setpoint:
+		drive(setpoint['throttle'])
+	if 'steer' in setpoint:
+		angle = setpoint['steer']
+		steer(car_dir.pulse(angle), lambda: car_dir.turn(angle))
+	if 'pan' in setpoint or 'tilt' in setpoint:
+		if loop is not None:
+			loop.set_pan_tilt(setpoint.get('pan'), setpoint.get('tilt'))
 		else:
-			print 'Command Error! Cannot recognize command: ' + data
+			video_dir.move_to(setpoint.get('pan'), setpoint.get('tilt'))
+
+def release_camera():
+	'''Hand pan/tilt back from the control loop, where motion programs and
+	pulse drive frames put it, to video_dir's own moves'''
+	if loop is not None:
+		loop.release_pan_tilt()
+
+def manual_camera(move):
+	'''A camera command that takes the camera back from the control loop first'''
+	def command(*args):
+		release_camera()
+		return move(*args)
+	return command
+
+def program_finished(aborted):
+	'''Let a finished program's last camera move complete, then release it'''
+	if loop is not None:
+		loop.release_pan_tilt(settle=0.0 if aborted else 1.0)
+
+programs = motion.ProgramRunner(apply_setpoint, program_finished)
+
+session = None      # calibration.Session between 'calibrate' and 'confirm'/'cancel'
+
+def start_calibration():
+	'''Stop driving and hand the servos to a calibration session. The
+	control loop is paused so it does not overwrite the previews.'''
+	global session, active
+	print 'calibration mode'
+	if session is not None:
+		return
+	programs.abort()
+	video_dir.stop_moving()		# before the previews, which it would overwrite
+	if loop is not None:
+		loop.stop()
+		loop.set_throttle(0, immediate=True)
+	motor.stop()
+	session = calibration.Session()
+	session.preview()
+	# No drive or camera commands: the loop is stopped and would apply
+	# their targets the moment it resumes
+	active = observer_commands.merged(session.commands).merged(calibration_commands)
+
+def end_calibration(save):
+	'''Save or drop the calibration and resume driving around the (new)
+	home positions'''
+	global session, active
+	if save:
+		changed = session.confirm()
+		print 'calibration saved, changed:', ', '.join(changed) or 'nothing'
+	else:
+		session.cancel()
+		print 'calibration cancelled'
+	session = None
+	active = registry
+	release_camera()
+	video_dir.home_x_y()
+	if loop is not None:
+		loop.set_throttle(0, immediate=True)
+		loop.set_steer(car_dir.homePWM)
+		loop.start()
+	else:
+		car_dir.home()
+
+# ==========================================================================================
+# Command handlers. Each takes the parsed argument of its command, if it has one, and
+# returns the reply to send back to the client, or None. See dispatch.py.
+# ==========================================================================================
+def forward():
+	print 'motor moving forward'
+	if loop is not None:
+		loop.set_throttle(cruise)
+	else:
+		motor.forward()
+
+def backward():
+	print 'recv backward cmd'
+	if loop is not None:
+		loop.set_throttle(-cruise)
+	else:
+		motor.backward()
+
+def left():
+	print 'recv left cmd'
+	steer(car_dir.leftPWM, car_dir.turn_left)
+
+def right():
+	print 'recv right cmd'
+	steer(car_dir.rightPWM, car_dir.turn_right)
+
+def home():
+	print 'recv home cmd'
+	steer(car_dir.homePWM, car_dir.home)
+
+def stop():
+	print 'recv stop cmd'
+	programs.abort()
+	if loop is not None:
+		loop.halt()
+	else:
+		motor.ctrl(0)
+
+def read_cpu_temp():
+	print 'read cpu temp...'
+	try:
+		temp = pi_board.cpu_temp()
+	except (IOError, ValueError), e:
+		print 'Error: cpu temp', e
+		return '[%s] error %s' % (ctime(), e)
+	return '[%s] %0.2f' % (ctime(), temp)
+
+def xy_rate(rates):
+	'''Pan/tilt velocity in pulses per second: xy_rate=vx,vy'''
+	vx, vy = rates
+	if vx or vy:
+		release_camera()
+	video_dir.set_velocity(vx, vy)
+
+def program_load(text):
+	'''Upload a motion program, see motion.py'''
+	try:
+		return 'program ok %d\n' % programs.load(text)
+	except ValueError, e:
+		print 'Error: program', e
+		return 'program error %s\n' % e
+
+def program_run():
+	try:
+		programs.start()
+	except ValueError, e:
+		return 'program error %s\n' % e
+
+def abort():
+	print 'abort motion program'
+	programs.abort()
+
+def i2c_stats():
+	return ''.join(pwm.stats.to_json() + '\n' for pwm in PCA9685.devices() if pwm.stats is not None) or None
+
+def speed(spd):
+	'''Speed of the bare forward/backward commands: speedNN'''
+	global cruise
+	print 'spd(int) = %d' % spd
+	if spd < 24:
+		spd = 24
+	cruise = spd
+	if loop is None:
+		motor.setSpeed(spd)
+	elif loop.targets()['throttle'] != 0:
+		loop.set_throttle(spd if loop.targets()['throttle'] > 0 else -spd)
+
+def drive_at(spd):
+	'''forward=NN, or backward=NN with -NN, which also sets the speed of later bare forward/backward'''
+	global cruise
+	cruise = abs(spd)
+	drive(spd)
+
+def turn(angle):
+	'''Turning angle, 0..255'''
+	steer(car_dir.pulse(angle), lambda: car_dir.turn(angle))
+
+def udp_port():
+	'''Where to send drive frames as datagrams, "udp off" if nowhere'''
+	if udp is None:
+		return 'udp off\n'
+	return 'udp %d\n' % udp.port
+
+def udp_stats():
+	if udp is not None:
+		return udp.to_json() + '\n'
+
+def status():
+	'''Who is connected and what the car is doing, as JSON'''
+	driver = clients.driver
+	state = {
+		'driver': driver.describe() if driver is not None else None,
+		'observers': len(clients.observers()),
+		'calibrating': session is not None,
+	}
+	if loop is not None:
+		state['targets'] = loop.targets()
+	return json.dumps(state, sort_keys=True) + '\n'
+
+def apply_frame(frame):
+	'''Apply a binary drive frame, see drive_frame.py. Ignored, returning
+	False, while calibrating.'''
+	if session is not None:
+		return False
+	if frame.flags & drive_frame.FLAG_STOP:
+		stop()
+	else:
+		drive(frame.direction * frame.throttle)
+	setpoint = {'steer': frame.steering}
+	if frame.flags & drive_frame.FLAG_CAM_RATE:
+		if frame.pan or frame.tilt:	# a resting stick leaves a program's camera alone
+			release_camera()
+		video_dir.set_velocity(frame.pan, frame.tilt)
+	elif frame.flags & drive_frame.FLAG_CAM_PULSE:
+		setpoint['pan'] = frame.pan
+		setpoint['tilt'] = frame.tilt
+	apply_setpoint(setpoint)
+
+registry = dispatch.Registry()
+registry.add(ctrl_cmd[0], forward)
+registry.add(ctrl_cmd[1], backward)
+registry.add(ctrl_cmd[2], left)
+registry.add(ctrl_cmd[3], right)
+registry.add(ctrl_cmd[4], stop)
+registry.add(ctrl_cmd[5], read_cpu_temp)
+registry.add(ctrl_cmd[6], home)
+registry.add(ctrl_cmd[8], manual_camera(video_dir.move_increase_x))
+registry.add(ctrl_cmd[9], manual_camera(video_dir.move_decrease_x))
+registry.add(ctrl_cmd[10], manual_camera(video_dir.move_increase_y))
+registry.add(ctrl_cmd[11], manual_camera(video_dir.move_decrease_y))
+registry.add(ctrl_cmd[12], manual_camera(video_dir.home_x_y))
+registry.add('xy_rate=', xy_rate, dispatch.ints)
+registry.add('program=', program_load, str)
+registry.add('program_run', program_run)
+registry.add('abort', abort)
+registry.add('i2c_stats', i2c_stats)
+registry.add('speed', speed, int)
+registry.add('turn=', turn, int)
+registry.add('forward=', drive_at, int)
+registry.add('backward=', lambda spd: drive_at(-spd), int)
+registry.add('calibrate', start_calibration)
+registry.add('udp', udp_port)
+registry.add('udp_stats', udp_stats)
+registry.add('status', status)
+
+# The read-only part of registry, all that observers may use (see connections.py)
+observer_commands = dispatch.Registry()
+for name in (ctrl_cmd[5], 'i2c_stats', 'udp', 'udp_stats', 'status'):
+	observer_commands.add(name, *registry.table[name])
+
+# Only while calibrating, on top of the read-only and calibration.Session commands
+calibration_commands = dispatch.Registry()
+calibration_commands.add(ctrl_cmd[4], stop)
+calibration_commands.add('calibrate', start_calibration)
+calibration_commands.add('confirm', lambda: end_calibration(True))
+calibration_commands.add('cancel', lambda: end_calibration(False))
+
+active = registry   # dispatches the commands, swapped by start/end_calibration()
+
+udp = None
+if UDP_PORT:
+	udp = udp_drive.DriveReceiver(UDP_PORT, apply_frame, UDP_MAX_AGE)
+
+def claim_role(connection, text):
+	'''role=driver [token] asks for driving, role=observer gives it up'''
+	words = text.split()
+	role = words[0] if words else ''
+	if role == connections.OBSERVER:
+		clients.set_role(connection, role)
+		return 'ok role %s\n' % role
+	if role != connections.DRIVER or len(words) > 2:
+		return 'error role %s\n' % text
+	token = clients.claim(connection, words[1] if len(words) > 1 else None)
+	if token is None:
+		return 'error role driver taken\n'
+	return 'ok role driver %s\n' % token
+
+def role_changed(connection, old):
+	'''Follow the driver with the UDP drive channel, and stop the car when
+	its driver leaves or is replaced rather than keep going on its last command'''
+	if connection.role == connections.DRIVER:
+		if udp is not None:
+			udp.allow(connection.host)
+		return
+	if udp is not None:
+		udp.disallow(connection.host)
+	if session is not None:
+		end_calibration(False)
+	video_dir.stop_moving()
+	stop()
+
+def handle(connection, data):
+	'''Act on one command or drive frame from a client and return the reply'''
+	driving = connection.role == connections.DRIVER
+	if isinstance(data, drive_frame.DriveFrame):
+		if driving:
+			apply_frame(data)
+		return None
+	if data[0:6] == 'proto=':	# binary drive frames on this connection
+		return connection.reader.negotiate(data[6:])
+	if data[0:5] == 'role=':
+		return claim_role(connection, data[5:])
+	try:
+		if driving:
+			return active.dispatch(data)
+		return observer_commands.dispatch(data)
+	except dispatch.UnknownCommand:
+		if not driving:
+			return 'error observer %s\n' % data
+		if session is not None:
+			print 'Ignored while calibrating: ' + data
+			return 'error calibrating %s\n' % data
+		print 'Command Error! Cannot recognize command: ' + data
+	except ValueError, e:
+		print 'Error:', data, e
 
-except KeyboardInterrupt:
-    print('Got keyboard interrupt')
-    print('...closing socket connection')
-    tcpSerSock.close()
+clients = connections.Server(ADDR, handle, role_changed, IDLE_TIMEOUT, bufsize=BUFSIZ, driver_hosts=DRIVER_HOSTS)
 
+def serve():
+	clients.listen()
+	if udp is not None:
+		clients.add_reader(udp.sock, udp.read)	# frames take turns with the TCP commands
+	print 'Waiting for connections...'
+	try:
+		clients.serve_forever()
+	except KeyboardInterrupt:
+		print('Got keyboard interrupt')
+		print('...closing socket connections')
+		for connection in clients.connections.values():
+			clients.close(connection)
+		clients.sock.close()
 
+if __name__ == '__main__':
+	serve()
@@ -0,0 +1,12 @@
+'''
+Unit tests of the server modules, run against the simulated PCA9685 and
+GPIO so no Raspberry Pi is needed. From the server directory:
+
+    python -m unittest discover -s tests -t .
+'''
+
+import os
+import sys
+
+os.environ.setdefault('PCA9685_BUS', 'sim')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,75 @@
+import os
+import unittest
+
+import PCA9685
+import actuator_client as ipc
+import actuatord
+import pca9685_sim
+
+BUS = 4     # a simulated bus of its own, and setpoint blocks no daemon uses
+
+
+class SharedBus(pca9685_sim.SimulatedBus):
+    '''A simulated bus that looks shared through actuatord to PWM'''
+
+    def registers(self, address):
+        chip = self.devices[address]
+        return dict((reg, chip.registers[reg]) for reg in (0x00, 0x01, 0xFE))
+
+
+class SharedPWMTest(unittest.TestCase):
+
+    def test_front_ends_do_not_cache_channels(self):
+        bus = SharedBus(BUS)
+        PCA9685.PWM(bus=bus)        # the daemon sets the chip up
+        a = PCA9685.PWM(bus=bus)
+        b = PCA9685.PWM(bus=bus)
+        self.assertFalse(a.cache)
+        a.write(0, 0, 400)
+        b.write(0, 0, 300)
+        a.write(0, 0, 400)
+        self.assertEqual(bus.devices[0x40].channel(0), (0, 400))
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = actuatord.Daemon('sim')
+        self.daemon.open(BUS, 0x40)
+        self.block = self.daemon.blocks[(BUS, 0x40)]
+        self.bus = self.daemon.buses[BUS]
+        self.chip = self.bus.devices[0x40]
+        self.bus.reset_counters()
+
+    def tearDown(self):
+        self.block.close()
+        os.remove(ipc.block_path(BUS, 0x40))
+
+    def kick(self, channel, off):
+        self.block.write(channel, [(0, off)])
+        self.daemon.execute(ipc.OP_KICK, BUS, 0x40, 0, [])
+
+    def test_skips_channels_holding_their_value(self):
+        self.kick(0, 400)
+        self.kick(0, 400)
+        self.assertEqual(self.bus.transactions, 1)
+        self.kick(0, 300)
+        self.assertEqual(self.chip.channel(0), (0, 300))
+        self.assertEqual(self.bus.transactions, 2)
+
+    def test_raw_write_forgets(self):
+        self.kick(0, 400)
+        self.daemon.execute(ipc.OP_WRITE_BLOCK, BUS, 0x40, 0xFA, [0, 0, 0, 0])
+        self.kick(0, 400)
+        self.assertEqual(self.chip.channel(0), (0, 400))
+
+    def test_pins_set_up_once(self):
+        self.daemon.execute(ipc.OP_GPIO_MODE, 0, 0, 10, [])
+        self.daemon.execute(ipc.OP_GPIO_SETUP, 0, 0, 11, [0, 0])
+        self.daemon.execute(ipc.OP_GPIO_OUTPUT, 0, 0, 11, [1])
+        self.daemon.execute(ipc.OP_GPIO_SETUP, 0, 0, 11, [0, 0])
+        self.assertEqual(self.daemon.execute(ipc.OP_GPIO_INPUT, 0, 0, 11, []), [1, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import calibration
+import car_dir
+import motor
+import settings
+import sim_gpio
+import video_dir
+
+
+class CalibrationTest(unittest.TestCase):
+    '''A Session against the simulated backend and a scratch config file'''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'config')
+        with open(path, 'w') as f:
+            f.write('offset_x = -10\noffset = 4\n')
+        self.saved_config = settings.config
+        settings.config = settings.Config(path)
+        car_dir.setup()
+        video_dir.setup()
+        motor.setup()
+        self.session = calibration.Session()
+
+    def tearDown(self):
+        settings.config = self.saved_config
+        shutil.rmtree(self.dir)
+
+    def test_adjust(self):
+        self.assertEqual(calibration._adjust(5, '=', 2), 2)
+        self.assertEqual(calibration._adjust(5, '+', 2), 7)
+        self.assertEqual(calibration._adjust(5, '-', 2), 3)
+
+    def test_forward1_default(self):
+        # cali_server always started from False when the config did not say
+        self.assertIs(self.session.forward1, False)
+
+    def test_commands(self):
+        dispatch = self.session.commands.dispatch
+        for command in ('offset+6', 'offsetx-5', 'offsety=3', 'leftmotorFalse', 'rightreverse'):
+            dispatch(command)
+        values = self.session.values()
+        self.assertEqual((values['offset'], values['offset_x'], values['offset_y']), (10, -15, 3))
+        self.assertEqual((values['forward0'], values['forward1']), (False, True))
+        self.assertIsNone(values['turn_interp'])
+        self.assertEqual(car_dir.pwm.bus.devices[0x40].channel(0), (0, 460))
+        self.assertEqual(sim_gpio.pins[motor.Motor1_A], sim_gpio.LOW)
+        self.assertEqual(sim_gpio.pins[motor.Motor1_B], sim_gpio.HIGH)
+
+    def test_curve(self):
+        self.session.commands.dispatch('curve=0:340,255:560;spline')
+        values = self.session.values()
+        self.assertEqual((values['turn_curve'], values['turn_interp']), ('0:340,255:560', 'spline'))
+        self.session.cancel()
+        self.assertEqual(car_dir.curve, car_dir.DEFAULT_CURVE)
+
+    def test_confirm_applies(self):
+        self.session.commands.dispatch('offset=-7')
+        self.session.commands.dispatch('rightmotorFalse')
+        changed = self.session.confirm()
+        self.assertIn('offset', changed)
+        self.assertEqual(settings.get('offset'), -7)
+        self.assertEqual(car_dir.homePWM, 443)
+        self.assertIs(motor.motor.forward1, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import car_dir
+
+
+class CurveTest(unittest.TestCase):
+
+    def test_parse_and_format(self):
+        points = car_dir.parse_curve('255:560,0:340,128:455')
+        self.assertEqual(points, [(0, 340), (128, 455), (255, 560)])
+        self.assertEqual(car_dir.format_curve(points), '0:340,128:455,255:560')
+
+    def test_parse_errors(self):
+        for text in ('0:350', '0:350,0:400', '0-350,255:550', '0:a,255:550'):
+            self.assertRaises(ValueError, car_dir.parse_curve, text)
+
+
+class TableTest(unittest.TestCase):
+
+    def test_linear_default(self):
+        table = car_dir.build_table(car_dir.DEFAULT_CURVE)
+        self.assertEqual(len(table), 256)
+        self.assertEqual((table[0], table[255]), (350, 550))
+        # the old turn() mapping, Map(angle, 0, 255, leftPWM, rightPWM)
+        self.assertEqual(table, [car_dir.Map(a, 0, 255, 350, 550) for a in range(256)])
+
+    def test_offset_and_clamp(self):
+        table = car_dir.build_table([(20, 360), (235, 540)], offset=-5)
+        self.assertEqual(table[0], 355)
+        self.assertEqual(table[20], 355)
+        self.assertEqual(table[255], 535)
+
+    def test_deadband(self):
+        table = car_dir.build_table(car_dir.DEFAULT_CURVE, offset=3, deadband=2)
+        self.assertEqual(table[126:130], [453] * 4)
+        self.assertNotEqual(table[125], 453)
+
+    def test_spline_is_monotone(self):
+        points = [(0, 350), (100, 440), (128, 450), (160, 470), (255, 550)]
+        table = car_dir.build_table(points, interp='spline')
+        for angle, pulse in points:
+            self.assertEqual(table[angle], pulse)
+        for a, b in zip(table, table[1:]):
+            self.assertLessEqual(a, b)
+        # a linear table would have a kink at 128, the spline is smooth
+        self.assertNotEqual(table, car_dir.build_table(points))
+
+    def test_spline_flat_segment(self):
+        table = car_dir.build_table([(0, 350), (100, 450), (155, 450), (255, 550)], interp='spline')
+        self.assertEqual(set(table[100:156]), set([450]))
+
+    def test_pulse_clamps_angle(self):
+        car_dir.table = car_dir.build_table(car_dir.DEFAULT_CURVE)
+        self.assertEqual(car_dir.pulse(-10), 350)
+        self.assertEqual(car_dir.pulse(300), 550)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import socket
+import unittest
+
+import connections
+
+
+class FakeSocket(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = []
+        self.server = connections.Server(('127.0.0.1', 0), self.handle, self.role_changed,
+                                         driver_hosts=('10.0.0.2',))
+
+    def handle(self, connection, command):
+        if command == 'boom':
+            raise RuntimeError(command)
+        return 'ok %s\n' % command
+
+    def role_changed(self, connection, old):
+        self.changes.append((connection.host, old, connection.role))
+
+    def connect(self, host, port=5000):
+        connection = connections.Connection(FakeSocket(), (host, port), 0.0)
+        self.server.connections[connection.sock] = connection
+        return connection
+
+    def test_first_claim_wins(self):
+        a = self.connect('10.0.0.1')
+        b = self.connect('10.0.0.1', 5001)
+        token = self.server.claim(a)
+        self.assertTrue(token)
+        self.assertIs(self.server.driver, a)
+        # the same host is not enough to take over
+        self.assertIsNone(self.server.claim(b))
+        self.assertIs(self.server.driver, a)
+        self.assertEqual(b.role, connections.OBSERVER)
+
+    def test_token_takes_over(self):
+        a = self.connect('10.0.0.1')
+        b = self.connect('10.0.0.1', 5001)
+        token = self.server.claim(a)
+        self.assertIsNone(self.server.claim(b, 'wrong'))
+        new_token = self.server.claim(b, token)
+        self.assertIs(self.server.driver, b)
+        self.assertNotEqual(new_token, token)
+        self.assertTrue(a.closed and a.sock.closed)
+        # the old token is spent
+        c = self.connect('10.0.0.1', 5002)
+        self.assertIsNone(self.server.claim(c, token))
+
+    def test_driver_hosts(self):
+        a = self.connect('10.0.0.1')
+        b = self.connect('10.0.0.2')
+        self.server.claim(a)
+        self.assertTrue(self.server.claim(b))
+        self.assertIs(self.server.driver, b)
+        self.assertEqual(a.role, connections.OBSERVER)
+        self.assertFalse(a.closed)
+
+    def test_role_changed(self):
+        a = self.connect('10.0.0.1')
+        self.server.claim(a)
+        self.server.claim(a)
+        self.server.set_role(a, connections.OBSERVER)
+        self.assertIsNone(self.server.driver)
+        self.assertEqual(self.changes, [('10.0.0.1', 'observer', 'driver'),
+                                        ('10.0.0.1', 'driver', 'observer')])
+
+    def test_close_releases_driver(self):
+        a = self.connect('10.0.0.1')
+        self.server.claim(a)
+        self.server.close(a)
+        self.assertIsNone(self.server.driver)
+        self.assertEqual(self.changes[-1], ('10.0.0.1', 'driver', 'observer'))
+        self.assertNotIn(a.sock, self.server.connections)
+
+    def test_expire(self):
+        a = self.connect('10.0.0.1')
+        b = self.connect('10.0.0.2')
+        bare = self.connect('10.0.0.3')
+        a.reader.feed('\n')
+        b.reader.feed('\n')
+        b.last_seen = 50.0
+        self.server._expire(self.server.idle_timeout + 10.0)
+        self.assertTrue(a.closed)
+        self.assertFalse(b.closed)
+        # bare command clients never send a keepalive
+        self.assertFalse(bare.closed)
+        b.send('x' * (self.server.max_queued + 1))
+        self.server._expire(60.0)
+        self.assertTrue(b.closed)
+
+    def test_handler_error_is_answered(self):
+        ours, theirs = socket.socketpair()
+        try:
+            a = connections.Connection(ours, ('10.0.0.1', 5000), 0.0)
+            self.server.connections[ours] = a
+            theirs.sendall('boom\nfine\n')
+            self.server._read(a, 1.0)
+            self.assertEqual(str(a._queued), 'error boom\nok fine\n')
+            self.assertEqual(a.last_seen, 1.0)
+            theirs.close()
+            self.server._read(a, 2.0)
+            self.assertTrue(a.closed)
+        finally:
+            ours.close()
+            theirs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
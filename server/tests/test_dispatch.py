@@ -0,0 +1,62 @@
+import unittest
+
+import dispatch
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.registry = dispatch.Registry()
+        add = self.registry.add
+        add('stop', lambda: self.calls.append('stop'))
+        add('turn=', lambda value: self.calls.append(('turn', value)), int)
+        add('speed', lambda value: self.calls.append(('speed', value)), int)
+        add('offsetx+', lambda value: self.calls.append(('offsetx+', value)), int)
+        add('leftmotor', lambda value: self.calls.append(('leftmotor', value)), dispatch.word)
+        add('xy_rate=', lambda value: self.calls.append(('xy_rate', value)), dispatch.ints)
+
+    def test_whole_command(self):
+        self.registry.dispatch('stop')
+        self.assertEqual(self.calls, ['stop'])
+
+    def test_prefixes(self):
+        for command in ('turn=200', 'speed50', 'offsetx+10', 'leftmotorFalse', 'xy_rate=-5,7'):
+            self.registry.dispatch(command)
+        self.assertEqual(self.calls, [('turn', 200), ('speed', 50), ('offsetx+', 10),
+                                      ('leftmotor', False), ('xy_rate', [-5, 7])])
+
+    def test_return_value(self):
+        self.registry.add('read', lambda: 'reply\n')
+        self.assertEqual(self.registry.dispatch('read'), 'reply\n')
+
+    def test_unknown(self):
+        self.assertRaises(dispatch.UnknownCommand, self.registry.dispatch, 'fly')
+        # a whole-command name does not take an argument
+        self.assertRaises(dispatch.UnknownCommand, self.registry.dispatch, 'stop=1')
+
+    def test_malformed_argument(self):
+        self.assertRaises(ValueError, self.registry.dispatch, 'turn=left')
+        self.assertRaises(ValueError, self.registry.dispatch, 'leftmotortrue')
+        self.assertEqual(self.calls, [])
+
+    def test_merged(self):
+        other = dispatch.Registry()
+        other.add('stop', lambda: 'other stop')
+        other.add('home', lambda: 'home')
+        merged = self.registry.merged(other)
+        self.assertEqual(merged.dispatch('stop'), 'other stop')
+        self.assertEqual(merged.dispatch('home'), 'home')
+        merged.dispatch('turn=1')
+        self.assertEqual(self.calls, [('turn', 1)])
+        self.assertNotIn('home', self.registry.table)
+
+    def test_decorator(self):
+        @self.registry.command('speed=', int)
+        def speed(value):
+            return value * 2
+        self.assertEqual(self.registry.dispatch('speed=21'), 42)
+
+
+if __name__ == '__main__':
+    unittest.main()
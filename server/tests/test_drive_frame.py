@@ -0,0 +1,63 @@
+import unittest
+
+import drive_frame
+import framing
+
+
+def frame(seq=1, throttle=50, direction=1, steering=128, pan=0, tilt=0, flags=0, timestamp=12.5):
+    return drive_frame.DriveFrame(seq, timestamp, throttle, direction, steering, pan, tilt, flags)
+
+
+class DriveFrameTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        f = frame(seq=0xFFFFFFFF, direction=-1, pan=-300, tilt=700,
+                  flags=drive_frame.FLAG_CAM_RATE | drive_frame.FLAG_STOP)
+        data = drive_frame.pack(f)
+        self.assertEqual(len(data), 24)
+        self.assertEqual(ord(data[0]), drive_frame.MAGIC)
+        self.assertEqual(drive_frame.unpack_from(data), f)
+
+    def test_offset(self):
+        data = 'xyz' + drive_frame.pack(frame())
+        self.assertEqual(drive_frame.unpack_from(data, 3), frame())
+
+    def test_bad_version(self):
+        data = bytearray(drive_frame.pack(frame()))
+        data[1] = 2
+        self.assertRaises(ValueError, drive_frame.unpack_from, data)
+
+
+class BinaryReaderTest(unittest.TestCase):
+
+    def test_negotiate(self):
+        reader = framing.CommandReader()
+        self.assertEqual(reader.negotiate('bin2'), 'error proto bin2\n')
+        self.assertFalse(reader.binary)
+        self.assertEqual(reader.negotiate(drive_frame.PROTOCOL), 'ok bin1\n')
+        self.assertTrue(reader.binary)
+
+    def test_frames_between_commands(self):
+        reader = framing.CommandReader()
+        reader.feed('proto=bin1\n')
+        reader.negotiate(drive_frame.PROTOCOL)
+        data = 'stop\n' + drive_frame.pack(frame(seq=7)) + 'x+\n'
+        self.assertEqual(reader.feed(data), ['stop', frame(seq=7), 'x+'])
+
+    def test_frame_split(self):
+        reader = framing.CommandReader()
+        reader.feed('\n')
+        reader.negotiate(drive_frame.PROTOCOL)
+        data = drive_frame.pack(frame(seq=3))
+        self.assertEqual(reader.feed(data[:10]), [])
+        self.assertEqual(reader.feed(data[10:] + 'stop\n'), [frame(seq=3), 'stop'])
+
+    def test_text_only_without_negotiation(self):
+        reader = framing.CommandReader()
+        reader.feed('\n')
+        data = drive_frame.pack(frame())
+        self.assertNotIn(frame(), reader.feed(data + '\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+import framing
+
+
+class CommandReaderTest(unittest.TestCase):
+
+    def test_bare_commands(self):
+        reader = framing.CommandReader()
+        self.assertEqual(reader.feed('forward'), ['forward'])
+        self.assertEqual(reader.feed('turn=128'), ['turn=128'])
+
+    def test_split_and_merged_reads(self):
+        reader = framing.CommandReader()
+        self.assertEqual(reader.feed('forward=60\nturn='), ['forward=60'])
+        self.assertEqual(reader.feed('128\r\n\nstop\n'), ['turn=128', 'stop'])
+        # once framed, a read without a newline is a partial command
+        self.assertEqual(reader.feed('x+'), [])
+        self.assertEqual(reader.feed('\n'), ['x+'])
+
+    def test_encode(self):
+        reader = framing.CommandReader()
+        self.assertEqual(reader.feed(framing.encode(['a', 'b=1'])), ['a', 'b=1'])
+
+    def test_max_length(self):
+        reader = framing.CommandReader(max_length=16)
+        reader.feed('\n')
+        self.assertEqual(reader.feed('x' * 32), [])
+        self.assertEqual(reader.feed('stop\n'), ['stop'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import threading
+import unittest
+
+import motion
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_parse(self):
+        steps = motion.parse('0:throttle=60,steer=200;1.5:throttle=0,steer=128,pan=200;2.5:pan=700;')
+        self.assertEqual(steps, [
+            (0.0, {'throttle': 60, 'steer': 200}),
+            (1.5, {'throttle': 0, 'steer': 128, 'pan': 200}),
+            (2.5, {'pan': 700}),
+        ])
+
+    def test_malformed(self):
+        for text in ('throttle=60', '0:speed=60', '0:throttle=101', '0:steer=-1',
+                     '1:pan=1;0.5:pan=2', '-1:pan=1', '0:throttle=fast', '0:throttle'):
+            self.assertRaises(ValueError, motion.parse, text)
+
+    def test_max_steps(self):
+        text = ';'.join('%d:pan=1' % i for i in range(motion.MAX_STEPS + 1))
+        self.assertRaises(ValueError, motion.parse, text)
+
+
+class ProgramRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.applied = []
+        self.finished = threading.Event()
+        self.aborted = None
+        self.runner = motion.ProgramRunner(self.applied.append, self.finish)
+
+    def finish(self, aborted):
+        self.aborted = aborted
+        self.finished.set()
+
+    def test_run(self):
+        self.assertEqual(self.runner.load('0:throttle=50;0.02:steer=10'), 2)
+        self.runner.start()
+        self.assertTrue(self.finished.wait(2.0))
+        self.assertEqual(self.applied, [{'throttle': 50}, {'steer': 10}, {'throttle': 0}])
+        self.assertFalse(self.aborted)
+        self.runner.abort()
+        self.assertEqual(self.runner.last_run['steps'], 2)
+
+    def test_abort(self):
+        self.runner.start(motion.parse('0:throttle=50;10:throttle=100'))
+        self.assertTrue(self.runner.running or self.applied)
+        self.assertTrue(self.runner.abort())
+        self.assertTrue(self.aborted)
+        self.assertEqual(self.applied[-1], {'throttle': 0})
+        self.assertNotIn({'throttle': 100}, self.applied)
+        self.assertTrue(self.runner.last_run['aborted'])
+
+    def test_nothing_loaded(self):
+        self.assertRaises(ValueError, self.runner.start)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import motor
+import settings
+
+
+class MotorSettingsTest(unittest.TestCase):
+    '''motor.Motor against a scratch config file'''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'config')
+        with open(path, 'w') as f:
+            f.write('forward0 = True\n')
+        self.saved_config = settings.config
+        settings.config = settings.Config(path)
+        motor.setup()
+
+    def tearDown(self):
+        settings.config = self.saved_config
+        shutil.rmtree(self.dir)
+
+    def test_forward1_default(self):
+        # motor.py always drove with True when the config did not say
+        self.assertIs(motor.motor.forward1, True)
+
+    def test_setup_subscribes_once(self):
+        motor.setup()
+        motor.setup()
+        names = [getattr(c, '__name__', None) for c in settings.config._subscribers]
+        self.assertEqual(names.count('load_directions'), 1)
+
+    def test_follows_config(self):
+        settings.save({'forward0': False, 'forward1': False})
+        self.assertEqual((motor.motor.forward0, motor.motor.forward1), (False, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
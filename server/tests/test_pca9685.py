@@ -0,0 +1,97 @@
+import unittest
+
+import PCA9685
+import pca9685_sim
+
+
+class PWMTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = pca9685_sim.SimulatedBus()
+        self.chip = self.bus.devices[0x40]
+        self.pwm = PCA9685.PWM(bus=self.bus)
+        self.bus.reset_counters()
+
+    def test_setup(self):
+        self.assertTrue(self.chip.auto_increment)
+        self.assertFalse(self.chip.registers[0x00] & 0x10)     # awake
+        self.assertEqual(self.chip.prescale, 101)               # 60 Hz
+        self.assertEqual(self.pwm.frequency, 60)
+
+    def test_write_is_one_block(self):
+        self.pwm.write(3, 0, 0x123)
+        self.assertEqual((self.bus.transactions, self.bus.bytes), (1, 6))
+        self.assertEqual(self.chip.channel(3), (0, 0x123))
+
+    def test_without_auto_increment(self):
+        self.pwm.auto_increment = False
+        self.assertFalse(self.chip.auto_increment)
+        self.bus.reset_counters()
+        self.pwm.write(3, 0, 0x123)
+        self.assertEqual(self.bus.transactions, 4)
+        self.assertEqual(self.chip.channel(3), (0, 0x123))
+
+    def test_write_all_value(self):
+        self.pwm.write(2, 0, 5)
+        self.bus.reset_counters()
+        self.pwm.write_all_value(0, 300)
+        self.assertEqual(self.bus.transactions, 1)
+        self.assertEqual(set(self.chip.channel(c) for c in range(16)), set([(0, 300)]))
+
+    def test_write_many_blocks(self):
+        self.pwm.write_many({4: (0, 100), 5: (0, 100), 14: (0, 300), 15: (0, 310)})
+        self.assertEqual(self.bus.transactions, 2)
+        self.assertEqual([self.chip.channel(c) for c in (4, 5, 14, 15)],
+                         [(0, 100), (0, 100), (0, 300), (0, 310)])
+
+    def test_long_run_is_split(self):
+        self.pwm.write_many(dict((c, (0, c + 1)) for c in range(16)))
+        self.assertEqual(self.bus.transactions, 2)     # 8 channels per 32 byte block
+        self.assertEqual(self.chip.channel(15), (0, 16))
+
+    def test_write_skips_unchanged(self):
+        hits = self.pwm.cache_hits
+        self.pwm.write(0, 0, 450)
+        self.pwm.write(0, 0, 450)
+        self.assertEqual(self.bus.transactions, 1)
+        self.assertEqual(self.chip.channel(0), (0, 450))
+        self.assertEqual(self.pwm.cache_hits, hits + 1)
+
+    def test_write_many_sends_changes_only(self):
+        self.pwm.write_many({4: (0, 100), 5: (0, 100)})
+        self.bus.reset_counters()
+        self.pwm.write_many({4: (0, 100), 5: (0, 200)})
+        self.assertEqual((self.bus.transactions, self.bus.bytes), (1, 6))
+
+    def test_write_all_value_skips_unchanged(self):
+        self.pwm.write_all_value(0, 0)
+        self.pwm.write(2, 0, 0)
+        self.assertEqual(self.bus.transactions, 0)     # the chip starts at 0, 0
+
+    def test_invalidate(self):
+        self.pwm.write(0, 0, 450)
+        self.pwm.invalidate()
+        self.pwm.write(0, 0, 450)
+        self.assertEqual(self.bus.transactions, 2)
+
+    def test_flush(self):
+        self.pwm.write(0, 0, 450)
+        self.chip.reset()       # brown-out
+        self.pwm.flush()
+        self.assertEqual(self.chip.channel(0), (0, 450))
+        self.assertTrue(self.chip.auto_increment)
+        self.assertEqual(self.chip.prescale, 101)
+
+    def test_async_writer(self):
+        self.pwm.start_async()
+        try:
+            self.pwm.write(0, 0, 400)
+            self.pwm.write_many({0: (0, 410), 1: (0, 420)})
+            self.pwm.sync(1.0)
+        finally:
+            self.pwm.stop_async()
+        self.assertEqual((self.chip.channel(0), self.chip.channel(1)), ((0, 410), (0, 420)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import pca9685_sim
+
+
+class SimulatedPCA9685Test(unittest.TestCase):
+
+    def setUp(self):
+        self.chip = pca9685_sim.SimulatedPCA9685()
+
+    def test_power_on(self):
+        self.assertEqual(self.chip.registers[0x00], 0x11)
+        self.assertFalse(self.chip.auto_increment)
+        self.assertEqual(self.chip.prescale, 0x1E)
+
+    def test_byte_writes_without_auto_increment(self):
+        self.chip.write(0x06, [1, 2, 3, 4])
+        self.assertEqual(self.chip.registers[0x06:0x0A], bytearray([4, 0, 0, 0]))
+
+    def test_block_write_with_auto_increment(self):
+        self.chip.write(0x00, [0x21])
+        self.chip.write(0x0A, [0x10, 0x01, 0x20, 0x02])
+        self.assertEqual(self.chip.channel(1), (0x110, 0x220))
+        # MODE1 RESTART clears itself
+        self.chip.write(0x00, [0xA1])
+        self.assertEqual(self.chip.registers[0x00], 0x21)
+
+    def test_all_led(self):
+        self.chip.write(0x00, [0x21])
+        self.chip.write(0xFA, [0, 0, 0x2C, 0x01])
+        self.assertEqual(set(self.chip.channel(c) for c in range(16)), set([(0, 300)]))
+        self.assertEqual(self.chip.read(0xFC), 0)
+
+    def test_prescale_needs_sleep(self):
+        self.chip.write(0x00, [0x01])
+        self.chip.write(0xFE, [0x79])
+        self.assertEqual(self.chip.prescale, 0x1E)
+        self.chip.write(0x00, [0x11])
+        self.chip.write(0xFE, [0x79])
+        self.assertEqual(self.chip.prescale, 0x79)
+
+
+class SimulatedBusTest(unittest.TestCase):
+
+    def test_counters_and_listeners(self):
+        bus = pca9685_sim.SimulatedBus(addresses=(0x40, 0x41))
+        heard = []
+        bus.listeners.append(lambda *args: heard.append(args))
+        bus.write_i2c_block_data(0x40, 0x06, [0, 0, 1, 0])
+        bus.write_byte_data(0x41, 0x06, 5)
+        self.assertEqual(bus.stats()['transactions'], 2)
+        self.assertEqual(bus.stats()['bytes'], 6 + 3)
+        self.assertEqual(heard, [(0x40, 0x06, [0, 0, 1, 0]), (0x41, 0x06, [5])])
+
+    def test_allcall_and_errors(self):
+        bus = pca9685_sim.SimulatedBus(addresses=(0x40, 0x41))
+        bus.write_byte_data(0x70, 0x06, 9)
+        self.assertEqual([bus.devices[a].registers[0x06] for a in (0x40, 0x41)], [9, 9])
+        self.assertRaises(IOError, bus.write_byte_data, 0x50, 0x06, 1)
+        self.assertRaises(IOError, bus.write_i2c_block_data, 0x40, 0x06, [0] * 33)
+
+
+if __name__ == '__main__':
+    unittest.main()
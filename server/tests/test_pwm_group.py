@@ -0,0 +1,42 @@
+import unittest
+
+import PCA9685
+import hw_backend
+
+BUS = 3     # a simulated bus of its own
+
+
+class PWMGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outsider = PCA9685.get_pwm(BUS, 0x42)     # answers ALLCALL too
+        self.bus = hw_backend.sim_bus(BUS)
+
+    def chip(self, address):
+        return self.bus.devices[address]
+
+    def test_logical_channels(self):
+        group = PCA9685.PWMGroup((0x40, 0x41), BUS)
+        group.write_many({0: (0, 300), 17: (0, 310)})
+        self.assertEqual(self.chip(0x40).channel(0), (0, 300))
+        self.assertEqual(self.chip(0x41).channel(1), (0, 310))
+
+    def test_allcall_off_by_default(self):
+        group = PCA9685.PWMGroup((0x40, 0x41), BUS)
+        self.outsider.write_many({2: (0, 111), 3: (0, 123)})
+        group.write_all_value(0, 200)
+        group.write_many({2: (0, 250), 18: (0, 250)})
+        self.assertEqual(self.chip(0x40).channel(2), (0, 250))
+        self.assertEqual(self.chip(0x41).channel(3), (0, 200))
+        self.assertEqual([self.chip(0x42).channel(c) for c in (2, 3)], [(0, 111), (0, 123)])
+
+    def test_allcall(self):
+        group = PCA9685.PWMGroup((0x40, 0x41), BUS, allcall=True)
+        self.bus.reset_counters()
+        group.write_all_value(0, 220)
+        self.assertEqual(self.bus.transactions, 1)
+        self.assertEqual([self.chip(a).channel(9) for a in (0x40, 0x41, 0x42)], [(0, 220)] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
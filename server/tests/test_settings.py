@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import settings
+
+
+class ConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'config')
+        self.write('# comment\noffset_x = -10\nforward0 = False\nname = spline\nratio = 0.5\nbad line\n')
+        self.config = settings.Config(self.path, {'offset_x': 0, 'offset': 0, 'forward0': True})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def test_parse(self):
+        config = self.config
+        self.assertEqual(config['offset_x'], -10)
+        self.assertIs(config['forward0'], False)
+        self.assertEqual(config['name'], 'spline')
+        self.assertEqual(config['ratio'], 0.5)
+        self.assertEqual(config['offset'], 0)       # default
+        self.assertIsNone(config.get('forward1'))
+        self.assertIs(config.get('forward1', True), True)
+
+    def test_typed_by_default(self):
+        self.assertRaises(ValueError, settings._parse, 'yes', True)
+        self.assertRaises(ValueError, settings._parse, '1.0', 0)
+        self.assertEqual(settings._parse(' 2 ', 0.0), 2.0)
+        self.write('offset = 7\noffset_x = 1.0\nforward0 = yes\n')
+        self.config.mtime = None
+        self.config.check()
+        self.assertEqual(self.config['offset'], 7)
+        # values that do not fit the default's type are ignored
+        self.assertEqual(self.config['offset_x'], 0)
+        self.assertIs(self.config['forward0'], True)
+
+    def test_check_notifies_changes(self):
+        changes = []
+        self.config.subscribe(changes.append)
+        self.config.subscribe(changes.append)
+        self.assertEqual(self.config.check(), [])
+        self.write('offset_x = 5\nforward0 = False\nname = spline\nratio = 0.5\n')
+        self.config.mtime = None
+        self.assertEqual(self.config.check(), ['offset_x'])
+        self.assertEqual(changes, [['offset_x']])
+        self.config.unsubscribe(changes.append)
+        self.write('offset_x = 6\n')
+        self.config.mtime = None
+        self.config.check()
+        self.assertEqual(changes, [['offset_x']])
+
+    def test_save_keeps_other_lines(self):
+        changed = self.config.save({'offset_x': 3, 'forward1': False, 'offset': None})
+        self.assertEqual(sorted(changed), ['forward1', 'offset_x'])
+        with open(self.path) as f:
+            text = f.read()
+        self.assertIn('# comment\n', text)
+        self.assertIn('offset_x = 3\n', text)
+        self.assertIn('forward1 = False\n', text)
+        self.assertNotIn('offset =', text)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertEqual(self.config['offset_x'], 3)
+
+    def test_missing_file(self):
+        config = settings.Config(os.path.join(self.dir, 'missing'), {'offset': 4})
+        self.assertEqual(config.values, {'offset': 4})
+        config.save({'offset': 5})
+        self.assertEqual(config['offset'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import socket
+import unittest
+
+import drive_frame
+import udp_drive
+
+CLIENT = ('192.168.1.10', 40000)
+
+
+def datagram(seq, timestamp):
+    return drive_frame.pack(drive_frame.DriveFrame(seq, timestamp, 50, 1, 128, 0, 0, 0))
+
+
+class NewerTest(unittest.TestCase):
+
+    def test_newer(self):
+        self.assertTrue(udp_drive.newer(2, 1))
+        self.assertFalse(udp_drive.newer(1, 1))
+        self.assertFalse(udp_drive.newer(1, 2))
+
+    def test_wraparound(self):
+        self.assertTrue(udp_drive.newer(0, 0xFFFFFFFF))
+        self.assertTrue(udp_drive.newer(5, 0xFFFFFFF0))
+        self.assertFalse(udp_drive.newer(0xFFFFFFF0, 5))
+
+
+class DriveReceiverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.applied = []
+        self.result = None
+        self.receiver = udp_drive.DriveReceiver(0, self.apply, max_age=0.1, host='127.0.0.1')
+        self.receiver.allow(CLIENT[0])
+
+    def tearDown(self):
+        self.receiver.sock.close()
+
+    def apply(self, frame):
+        self.applied.append(frame.seq)
+        return self.result
+
+    def test_applies_newer_frames_only(self):
+        handle = self.receiver.handle
+        self.assertTrue(handle(datagram(1, 100.0), CLIENT, 1000.0))
+        self.assertTrue(handle(datagram(3, 100.02), CLIENT, 1000.02))
+        self.assertFalse(handle(datagram(2, 100.01), CLIENT, 1000.03))
+        self.assertFalse(handle(datagram(3, 100.02), CLIENT, 1000.03))
+        self.assertEqual(self.applied, [1, 3])
+        self.assertEqual(self.receiver.stats['old'], 2)
+
+    def test_stale(self):
+        handle = self.receiver.handle
+        handle(datagram(1, 100.0), CLIENT, 1000.0)
+        # 0.5 s longer in transit than the quickest frame so far
+        self.assertFalse(handle(datagram(2, 100.1), CLIENT, 1000.6))
+        self.assertEqual(self.receiver.stats['stale'], 1)
+        self.assertTrue(handle(datagram(3, 100.7), CLIENT, 1000.7))
+
+    def test_refused_and_malformed(self):
+        handle = self.receiver.handle
+        self.assertFalse(handle(datagram(1, 100.0), ('10.0.0.1', 1), 1000.0))
+        self.assertFalse(handle('stop\n', CLIENT, 1000.0))
+        bad = bytearray(datagram(1, 100.0))
+        bad[0] = 0
+        self.assertFalse(handle(str(bad), CLIENT, 1000.0))
+        stats = self.receiver.stats
+        self.assertEqual((stats['refused'], stats['malformed'], stats['received']), (1, 2, 3))
+        self.assertEqual(self.applied, [])
+
+    def test_ignored(self):
+        self.result = False
+        self.assertFalse(self.receiver.handle(datagram(1, 100.0), CLIENT, 1000.0))
+        self.assertEqual(self.receiver.stats['ignored'], 1)
+        self.assertEqual(self.receiver.stats['applied'], 0)
+
+    def test_disallow_forgets_sender(self):
+        handle = self.receiver.handle
+        handle(datagram(10, 100.0), CLIENT, 1000.0)
+        self.receiver.disallow(CLIENT[0])
+        self.assertFalse(handle(datagram(11, 100.0), CLIENT, 1000.0))
+        self.receiver.allow(CLIENT[0])
+        # a new session may start its sequence numbers over
+        self.assertTrue(handle(datagram(1, 100.0), CLIENT, 1000.0))
+
+    def test_read_from_socket(self):
+        port = self.receiver.sock.getsockname()[1]
+        self.receiver.allow('127.0.0.1')
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for seq in (1, 2):
+                sender.sendto(datagram(seq, 100.0), ('127.0.0.1', port))
+            self.receiver.read(now=1000.0)
+        finally:
+            sender.close()
+        self.assertEqual(self.applied, [1, 2])
+        self.assertEqual(json.loads(self.receiver.to_json())['received'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
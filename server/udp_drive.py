@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+'''
+Drive frames over UDP, next to the TCP command connection.
+
+Over TCP one lost segment holds back every later steering command until
+it is retransmitted. For driving only the newest setpoint matters, so
+DriveReceiver takes drive_frame frames as datagrams and applies a frame
+only if its sequence number is newer than the last applied one from
+that sender and it is not older than max_age. Everything else is
+dropped and counted. Reliable commands (xy_home, calibration, programs)
+stay on TCP.
+
+The age is measured without synchronized clocks: the offset between the
+client timestamps and our clock is estimated as the smallest
+(receive time - timestamp) seen over the last two windows, so a frame's
+age is how much longer than the quickest recent frame it took.
+
+Only hosts passed to allow() are listened to; tcp_server allows the
+address of the driver while it is connected. DriveReceiver has no
+thread of its own: the owner calls read() when its socket is readable,
+from tcp_server's select() loop, so frames are applied in turn with the
+TCP commands and never alongside them.
+'''
+
+import errno
+import json
+import socket
+import time
+
+import drive_frame
+
+OFFSET_WINDOW = 10.0    # seconds per clock offset window
+
+
+def newer(seq, last):
+    '''True if seq comes after last, allowing for the 32 bit wrap'''
+    return 0 < ((seq - last) & 0xFFFFFFFF) < 0x80000000
+
+
+class _Sender(object):
+
+    def __init__(self, now):
+        self.last_seq = None
+        self.offset = None          # min(receive - timestamp) of this window
+        self.previous_offset = None
+        self.window_start = now
+
+    def age(self, now, timestamp):
+        delay = now - timestamp
+        if now - self.window_start > OFFSET_WINDOW:
+            self.previous_offset, self.offset = self.offset, None
+            self.window_start = now
+        if self.offset is None or delay < self.offset:
+            self.offset = delay
+        offset = self.offset
+        if self.previous_offset is not None and self.previous_offset < offset:
+            offset = self.previous_offset
+        return delay - offset
+
+
+class DriveReceiver(object):
+    '''Applies fresh drive frames received on port with apply(frame).
+    apply() returns False for a frame it ignored.'''
+
+    def __init__(self, port, apply, max_age=0.1, host=''):
+        self.port = port
+        self.apply = apply
+        self.max_age = max_age
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self._allowed = set()
+        self._senders = {}
+        self.stats = dict.fromkeys(('received', 'applied', 'ignored', 'old', 'stale', 'malformed', 'refused'), 0)
+        self.max_applied_age = 0.0
+
+    def allow(self, host):
+        self._allowed.add(host)
+
+    def disallow(self, host):
+        self._allowed.discard(host)
+        for address in [a for a in self._senders if a[0] == host]:
+            del self._senders[address]
+
+    def handle(self, data, address, now):
+        '''Decide about one datagram, returns True if it was applied'''
+        self.stats['received'] += 1
+        if address[0] not in self._allowed:
+            self.stats['refused'] += 1
+            return False
+        try:
+            if len(data) != drive_frame.FRAME.size:
+                raise ValueError('%d bytes' % len(data))
+            frame = drive_frame.unpack_from(data)
+        except ValueError:
+            self.stats['malformed'] += 1
+            return False
+        sender = self._senders.get(address)
+        if sender is None:
+            sender = self._senders[address] = _Sender(now)
+        age = sender.age(now, frame.timestamp)
+        if sender.last_seq is not None and not newer(frame.seq, sender.last_seq):
+            self.stats['old'] += 1
+            return False
+        if age > self.max_age:
+            self.stats['stale'] += 1
+            return False
+        sender.last_seq = frame.seq
+        if self.apply(frame) is False:
+            self.stats['ignored'] += 1
+            return False
+        self.stats['applied'] += 1
+        self.max_applied_age = max(self.max_applied_age, age)
+        return True
+
+    def read(self, now=None):
+        '''Handle every datagram waiting on the socket'''
+        while True:
+            try:
+                data, address = self.sock.recvfrom(64)
+            except socket.error, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+            self.handle(data, address, time.time() if now is None else now)
+
+    def to_json(self):
+        stats = dict(self.stats, port=self.port, max_age=self.max_age, max_applied_age=self.max_applied_age)
+        return json.dumps(stats, sort_keys=True)
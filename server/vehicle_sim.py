@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+'''
+Kinematic model of the car, driven by what the server writes to the
+simulated PCA9685 and GPIO.
+
+VehicleSim reads the motor EN duty (CH4/CH5) and the direction pins of
+motor.py for the speed, the steering pulse (CH0) for the wheel angle
+and the pan/tilt pulses (CH14/CH15) for the camera, integrates a
+bicycle model at rate_hz and keeps the pose as a time series. The
+wheel speed follows the duty with a first order lag and the steering
+servo turns at a limited rate. render_frame() draws what the camera
+would see of a checkered floor.
+
+Run this file for a closed-loop test: it starts tcp_server on the
+simulator in this process, drives it over TCP like the client does and
+reports the pose and the command-to-output latency.
+
+    python vehicle_sim.py [seconds] [--rate 20] [--csv pose.csv] [--frame frame.pgm]
+'''
+
+import collections
+import math
+import os
+import sys
+import threading
+import time
+
+import hw_backend
+import realtime
+import settings
+
+STEER_CHANNEL = 0
+MOTOR_CHANNELS = (4, 5)
+PAN_CHANNEL = 14
+TILT_CHANNEL = 15
+MOTOR_PINS = ((11, 12), (13, 15))   # motor.Motor0_A/B, Motor1_A/B
+
+CENTER_PULSE = 450      # straight ahead, and camera centered
+LOCK_PULSES = 100       # pulses from center to full steering lock
+CAMERA_PULSES_PER_DEGREE = 500 / 180.0
+
+_LED0_OFF_L = 0x08
+
+
+class VehicleSim(object):
+    '''Bicycle model of the car. Lengths in meters, angles in radians.'''
+
+    def __init__(self, bus=None, address=0x40, gpio=None, rate_hz=200,
+                 wheelbase=0.14, max_speed=0.8, speed_lag=0.2,
+                 max_steer=math.radians(30), steer_rate=math.radians(300),
+                 history=100000):
+        self.bus = bus if bus is not None else hw_backend.sim_bus(1)
+        self.chip = self.bus.devices[address]
+        if gpio is None:
+            import sim_gpio as gpio
+        self.gpio = gpio
+        self.rate_hz = rate_hz
+        self.wheelbase = wheelbase
+        self.max_speed = max_speed
+        self.speed_lag = speed_lag
+        self.max_steer = max_steer
+        self.steer_rate = steer_rate
+        self.forward = (settings.get('forward0'), settings.get('forward1', True))
+        self.history = collections.deque(maxlen=history)
+        self._thread = None
+        self._stop = threading.Event()
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        self.t = 0.0
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.speed = 0.0
+        self.steer = 0.0
+        self.pan = 0.0
+        self.tilt = 0.0
+        self.history.clear()
+
+    # ----- what the car is told to do -----
+
+    def _direction(self, motor):
+        '''+1 driving forward, -1 backward, 0 braked or unset'''
+        a, b = (self.gpio.pins.get(pin) for pin in MOTOR_PINS[motor])
+        if a is None or a == b:
+            return 0
+        clockwise = bool(b)     # motor.motor0(True) sets A low, B high
+        return 1 if clockwise == bool(self.forward[motor]) else -1
+
+    def _duty(self, channel):
+        on, off = self.chip.channel(channel)
+        if off & 0x1000:
+            return 0.0
+        if on & 0x1000:
+            return 1.0
+        return ((off - on) % 4096) / 4096.0
+
+    def commanded(self):
+        '''(speed m/s, steering rad, pan rad, tilt rad) the outputs ask for'''
+        speeds = [self._direction(m) * self._duty(ch) * self.max_speed
+                  for m, ch in enumerate(MOTOR_CHANNELS)]
+        steer_pulse = self.chip.channel(STEER_CHANNEL)[1]
+        steer = (steer_pulse - CENTER_PULSE) / float(LOCK_PULSES) * self.max_steer if steer_pulse else 0.0
+        steer = max(-self.max_steer, min(self.max_steer, steer))
+        angles = []
+        for channel in (PAN_CHANNEL, TILT_CHANNEL):
+            pulse = self.chip.channel(channel)[1]
+            angles.append(math.radians((pulse - CENTER_PULSE) / CAMERA_PULSES_PER_DEGREE) if pulse else 0.0)
+        return sum(speeds) / len(speeds), steer, angles[0], angles[1]
+
+    # ----- the model -----
+
+    def step(self, dt):
+        '''Advance the model by dt seconds and record the new pose'''
+        speed, steer, self.pan, self.tilt = self.commanded()
+        self.speed += (speed - self.speed) * min(1.0, dt / self.speed_lag)
+        turn = self.steer_rate * dt
+        self.steer += max(-turn, min(turn, steer - self.steer))
+        self.heading += self.speed / self.wheelbase * math.tan(self.steer) * dt
+        self.x += self.speed * math.cos(self.heading) * dt
+        self.y += self.speed * math.sin(self.heading) * dt
+        self.t += dt
+        self.history.append(self.pose())
+
+    def pose(self):
+        return (self.t, self.x, self.y, self.heading, self.speed, self.steer, self.pan, self.tilt)
+
+    def _run(self):
+        period = 1.0 / self.rate_hz
+        last = realtime.monotonic()
+        while not self._stop.wait(period):
+            now = realtime.monotonic()
+            self.step(now - last)
+            last = now
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='vehicle-sim')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def write_csv(self, path):
+        with open(path, 'w') as f:
+            f.write('t,x,y,heading,speed,steer,pan,tilt\n')
+            for sample in list(self.history):
+                f.write(','.join('%.6f' % value for value in sample) + '\n')
+
+    # ----- the camera -----
+
+    def render_frame(self, width=80, height=60, fov=math.radians(60), camera_height=0.12, square=0.25):
+        '''Grey levels (rows of 0..255) of a checkered floor as seen by
+        the camera at its current pan and tilt; above the horizon is white'''
+        yaw = self.heading - self.pan           # pan pulses above center look right
+        pitch = self.tilt
+        focal = (width / 2.0) / math.tan(fov / 2)
+        cos_yaw, sin_yaw = math.cos(yaw), math.sin(yaw)
+        cos_pitch, sin_pitch = math.cos(pitch), math.sin(pitch)
+        rows = []
+        for row in range(height):
+            v = (height / 2.0 - row - 0.5) / focal
+            forward = cos_pitch - v * sin_pitch     # pitch the ray (1, u, v) up by tilt
+            dz = sin_pitch + v * cos_pitch
+            line = []
+            for column in range(width):
+                u = (width / 2.0 - column - 0.5) / focal
+                if dz >= 0:
+                    line.append(255)
+                    continue
+                dx = forward * cos_yaw - u * sin_yaw
+                dy = forward * sin_yaw + u * cos_yaw
+                distance = camera_height / -dz
+                gx = self.x + dx * distance
+                gy = self.y + dy * distance
+                dark = (int(math.floor(gx / square)) + int(math.floor(gy / square))) % 2
+                line.append(60 if dark else 200)
+            rows.append(line)
+        return rows
+
+    def write_frame(self, path, **kwargs):
+        '''Save render_frame() as a binary PGM image'''
+        rows = self.render_frame(**kwargs)
+        with open(path, 'wb') as f:
+            f.write('P5\n%d %d\n255\n' % (len(rows[0]), len(rows)))
+            for line in rows:
+                f.write(''.join(chr(value) for value in line))
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def load_test(seconds=10.0, rate_hz=20, port=21567):
+    '''Run tcp_server in this process, steer it back and forth over TCP
+    at rate_hz and return the VehicleSim and the latencies from sending
+    each turn= to the first write of the steering channel'''
+    import socket
+    import framing
+    import tcp_server       # sets the car up on the simulator
+    server = threading.Thread(target=tcp_server.serve, name='tcp-server')
+    server.daemon = True
+    server.start()
+    deadline = time.time() + 10
+    while True:
+        try:
+            client = socket.create_connection(('127.0.0.1', port))
+            break
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    sim = VehicleSim()
+    steer_writes = []
+    def listener(address, reg, values):
+        if reg <= _LED0_OFF_L < reg + len(values):
+            steer_writes.append(realtime.monotonic())
+    sim.bus.listeners.append(listener)
+    sim.start()
+
+    sent = []
+    period = 1.0 / rate_hz
+    client.send(framing.encode(['forward=60']))
+    time.sleep(period)
+    start = realtime.monotonic()
+    i = 0
+    while realtime.monotonic() - start < seconds:
+        sent.append(realtime.monotonic())
+        client.send(framing.encode(['turn=%d' % (60 if i % 2 else 200)]))
+        i += 1
+        time.sleep(period)
+    client.send(framing.encode(['stop']))
+    time.sleep(0.5)
+    sim.stop()
+    sim.bus.listeners.remove(listener)
+    client.close()
+
+    latencies = []
+    for n, when in enumerate(sent):
+        until = sent[n+1] if n + 1 < len(sent) else when + period
+        first = [t for t in steer_writes if when <= t < until]
+        if first:
+            latencies.append(first[0] - when)
+    return sim, latencies
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for name in ('--rate', '--csv', '--frame'):
+        if name in args:
+            i = args.index(name)
+            options[name] = args[i+1]
+            del args[i:i+2]
+    seconds = float(args[0]) if args else 10.0
+
+    os.environ['PCA9685_BUS'] = 'sim'
+    sim, latencies = load_test(seconds, int(options.get('--rate', 20)))
+    t, x, y, heading, speed, steer, pan, tilt = sim.pose()
+    print 'pose after %.1f s: x %.2f m  y %.2f m  heading %.0f deg' % (t, x, y, math.degrees(heading))
+    print 'path length %.2f m over %d samples' % (
+        sum(math.hypot(b[1] - a[1], b[2] - a[2]) for a, b in zip(sim.history, list(sim.history)[1:])), len(sim.history))
+    if latencies:
+        print 'turn= to steering write: %d of %d commands, p50 %.2f ms  p99 %.2f ms  max %.2f ms' % (
+            len(latencies), int(seconds * int(options.get('--rate', 20))),
+            _percentile(latencies, 50) * 1000, _percentile(latencies, 99) * 1000, max(latencies) * 1000)
+    if '--csv' in options:
+        sim.write_csv(options['--csv'])
+    if '--frame' in options:
+        sim.write_frame(options['--frame'])
+    os._exit(0)     # tcp_server's select() loop and control loop never return
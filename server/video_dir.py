@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 import PCA9685 as servo
+import realtime
+import settings
+import threading
 import time                  # Import necessary modules
 
 MinPulse = 200
@@ -8,34 +11,44 @@ MaxPulse = 700
 Current_x = 0
 Current_y = 0
 
+# ==========================================================================================
+# Velocity mode: set_velocity(vx, vy) gives the pan/tilt rate in pulses per second and a
+# thread integrates it at Rate_hz, so camera speed no longer depends on how often the
+# client sends commands. The rate follows the target with at most MaxAccel pulses/s^2 and
+# is limited to MaxRate pulses/s. Every tick that moves the camera is one batched write.
+# ==========================================================================================
+Rate_hz = 50
+MaxRate = 1500
+MaxAccel = 6000
+
+_target_rate = [0.0, 0.0]
+_rate = [0.0, 0.0]
+_moving = threading.Event()
+_velocity_lock = threading.Lock()
+_integrator = None
+
+def load_offset(changed=None):
+	'''(Re)compute the home position from the config offsets. Registered
+	with settings, so edited offsets apply to the next home_x_y().'''
+	global home_x, home_y
+	if changed is not None and 'offset_x' not in changed and 'offset_y' not in changed:
+		return
+	offset_x = settings.get('offset_x')
+	offset_y = settings.get('offset_y')
+	print('Offset x: {}'.format(offset_x))
+	print('Offset y: {}'.format(offset_y))
+	home_x = (Xmax + Xmin) / 2 + offset_x
+	home_y = (Ymax + Ymin) / 2 + offset_y
+
 def setup(busnum=None):
-	global Xmin, Ymin, Xmax, Ymax, home_x, home_y, pwm
-	offset_x = 0
-	offset_y = 0
-	try:
-		for line in open('config'):
-			if line[0:8] == 'offset_x':
-				offset_x = int(line[11:-1])
-                                print('Offset x: {}'.format(offset_x))
-                                print('Line: {}'.format(line))
-				#print 'offset_x =', offset_x
-			if line[0:8] == 'offset_y':
-				offset_y = int(line[11:-1])
-                                print('Offset y: {}'.format(offset_y))
-                                print('Line: {}'.format(line))
-				#print 'offset_y =', offset_y
-	except:
-		pass
+	global Xmin, Ymin, Xmax, Ymax, pwm
 	Xmin = MinPulse
 	Xmax = MaxPulse
 	Ymin = MinPulse
 	Ymax = MaxPulse
-	home_x = (Xmax + Xmin) / 2 + offset_x
-	home_y = (Ymax + Ymin) / 2 + offset_y
-	if busnum == None:
-		pwm = servo.PWM()                  # Initialize the servo controller.
-	else:
-		pwm = servo.PWM(bus_number=busnum) # Initialize the servo controller.
+	load_offset()
+	settings.subscribe(load_offset)
+	pwm = servo.get_pwm(busnum)        # Shared servo controller, initialized once per process.
 	pwm.frequency = 60
 
 # ==========================================================================================
@@ -88,13 +101,85 @@ def home_x_y():
 	Current_y = home_y 
 	Current_x = home_x
         print('Writing {},{} to pwm'.format(Current_x, Current_y))
-	pwm.write(14, 0, Current_x)
-	pwm.write(15, 0, Current_y)
+	pwm.write_many({14: (0, Current_x), 15: (0, Current_y)})
 
 def calibrate(x,y):
         print('Writing {},{} to pwm'.format(x, y))
-	pwm.write(14, 0, (MaxPulse+MinPulse)/2+x)
-	pwm.write(15, 0, (MaxPulse+MinPulse)/2+y)
+	pwm.write_many({14: (0, (MaxPulse+MinPulse)/2+x), 15: (0, (MaxPulse+MinPulse)/2+y)})
+
+def move_to(x=None, y=None):
+	'''Move the camera to absolute pulses, clamped to the limits'''
+	global Current_x, Current_y
+	if x is not None:
+		Current_x = max(Xmin, min(Xmax, x))
+	if y is not None:
+		Current_y = max(Ymin, min(Ymax, y))
+	pwm.write_many({14: (0, Current_x), 15: (0, Current_y)})
+
+def _approach(current, target, step):
+	if target > current:
+		return min(current + step, target)
+	return max(current - step, target)
+
+def set_velocity(vx, vy):
+	'''Pan the camera at vx and tilt it at vy pulses per second. Positive
+	values increase the pulse, like move_decrease_x() and move_increase_y().'''
+	global _integrator
+	with _velocity_lock:
+		_target_rate[0] = float(max(-MaxRate, min(MaxRate, vx)))
+		_target_rate[1] = float(max(-MaxRate, min(MaxRate, vy)))
+		if _integrator is None:
+			_integrator = threading.Thread(target=_integrate, name='pan-tilt')
+			_integrator.daemon = True
+			_integrator.start()
+		_moving.set()
+
+def stop_moving(timeout=1.0):
+	'''Stop panning and tilting at once, without the deceleration of
+	set_velocity(0, 0), and wait until the integrator has made its last
+	write, so a write that follows is not overwritten.'''
+	with _velocity_lock:
+		_target_rate[0] = _target_rate[1] = 0.0
+		_rate[0] = _rate[1] = 0.0
+	deadline = realtime.monotonic() + timeout
+	while _moving.is_set() and realtime.monotonic() < deadline:
+		time.sleep(1.0 / Rate_hz)
+
+def _integrate():
+	global Current_x, Current_y
+	period = 1.0 / Rate_hz
+	step = MaxAccel * period
+	while True:
+		_moving.wait()
+		pos = [float(Current_x), float(Current_y)]
+		due = realtime.monotonic()
+		while True:
+			due += period
+			delay = due - realtime.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				due = realtime.monotonic()
+			with _velocity_lock:
+				for axis in (0, 1):
+					_rate[axis] = _approach(_rate[axis], _target_rate[axis], step)
+			if int(pos[0]) != Current_x:	# moved by a step command or home_x_y()
+				pos[0] = float(Current_x)
+			if int(pos[1]) != Current_y:
+				pos[1] = float(Current_y)
+			pos[0] = max(Xmin, min(Xmax, pos[0] + _rate[0] * period))
+			pos[1] = max(Ymin, min(Ymax, pos[1] + _rate[1] * period))
+			for axis, low, high in ((0, Xmin, Xmax), (1, Ymin, Ymax)):
+				if pos[axis] <= low and _rate[axis] < 0 or pos[axis] >= high and _rate[axis] > 0:
+					_rate[axis] = 0.0		# stop pushing against the limit
+			if int(pos[0]) != Current_x or int(pos[1]) != Current_y:
+				Current_x = int(pos[0])
+				Current_y = int(pos[1])
+				pwm.write_many({14: (0, Current_x), 15: (0, Current_y)})
+			with _velocity_lock:
+				if _rate == [0.0, 0.0] and _target_rate == [0.0, 0.0]:
+					_moving.clear()
+					break
 
 def test():
 	while True: